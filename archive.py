@@ -0,0 +1,144 @@
+import io
+import json
+import os
+import shutil
+import struct
+
+from codec import COPY_BUFFER, codec_ext, strip_codec_ext, wrap_writer
+
+# 文件结构: 文件头 | 各成员数据(每个成员单独压缩) | JSON 索引 | 文件尾(索引偏移, 索引长度, 魔数)
+ARCHIVE_EXT = '.dbbp'
+HEADER_MAGIC = b'DBBPARC1'
+FOOTER_MAGIC = b'DBBPIDX1'
+FOOTER = struct.Struct('<QQ8s')
+
+
+def pack_dir(src_dir, dest_path=None, codec=None, level=None, delete=True):
+    """
+    将备份目录打包为带索引的归档文件，每张表(或分片)为一个独立压缩的成员，可单独定位读取
+
+    已逐表压缩的文件原样写入；未压缩的文件按 codec 压缩后写入。
+
+    :param src_dir: 备份目录
+    :param dest_path: 归档文件路径，默认为 备份目录名.dbbp
+    :param codec: 未压缩文件的压缩算法，为空时原样写入
+    :param level: 压缩级别
+    :param delete: 写入后删除源文件和目录
+    :return: 归档文件路径
+    """
+    if not dest_path:
+        dest_path = os.path.normpath(src_dir) + ARCHIVE_EXT
+    members = []
+    with open(dest_path, 'wb') as out:
+        out.write(HEADER_MAGIC)
+        for file_name in sorted(os.listdir(src_dir)):
+            src_path = os.path.join(src_dir, file_name)
+            if not os.path.isfile(src_path):
+                continue
+            member_codec = None if strip_codec_ext(file_name)[1] else codec
+            offset = out.tell()
+            writer = wrap_writer(_NonClosing(out), member_codec, level)
+            with open(src_path, 'rb') as src, writer:
+                shutil.copyfileobj(src, writer, COPY_BUFFER)
+            members.append({'name': file_name + codec_ext(member_codec), 'offset': offset,
+                            'size': out.tell() - offset, 'raw_size': os.path.getsize(src_path)})
+            if delete:
+                os.remove(src_path)
+        index = json.dumps({'version': 1, 'members': members}, ensure_ascii=False).encode('utf-8')
+        index_offset = out.tell()
+        out.write(index)
+        out.write(FOOTER.pack(index_offset, len(index), FOOTER_MAGIC))
+    if delete:
+        shutil.rmtree(src_dir, ignore_errors=True)
+    return dest_path
+
+
+def read_index(path):
+    """
+    读取归档文件尾部的索引，只读取索引本身，与归档大小无关
+
+    :param path: 归档文件路径
+    :return: {成员名: {'offset', 'size', 'raw_size'}}
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(HEADER_MAGIC)) != HEADER_MAGIC:
+            raise ValueError(f'{path} 不是 dbbp 归档文件')
+        f.seek(-FOOTER.size, os.SEEK_END)
+        index_offset, index_size, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != FOOTER_MAGIC:
+            raise ValueError(f'{path} 的索引损坏或归档未写完')
+        f.seek(index_offset)
+        index = json.loads(f.read(index_size).decode('utf-8'))
+    return {m['name']: m for m in index['members']}
+
+
+def open_member(path, name, index=None):
+    """
+    打开归档中的一个成员，返回成员的原始(仍压缩的)数据流，只读取该成员所在的字节范围
+
+    :param path: 归档文件路径
+    :param name: 成员名
+    :param index: 已读取的索引，为空时重新读取
+    :return: 二进制输入流
+    """
+    member = (index or read_index(path))[name]
+    f = open(path, 'rb', buffering=COPY_BUFFER)
+    f.seek(member['offset'])
+    return io.BufferedReader(_MemberReader(f, member['size']), COPY_BUFFER)
+
+
+def extract(path, dest_dir=None, names=None):
+    """
+    从归档中提取部分或全部成员，成员保持压缩状态写出
+
+    :param path: 归档文件路径
+    :param dest_dir: 输出目录，默认为与归档同名的目录
+    :param names: 需要提取的成员名，为空时提取全部
+    :return: 输出目录
+    """
+    index = read_index(path)
+    dest_dir = dest_dir or os.path.splitext(path)[0]
+    os.makedirs(dest_dir, exist_ok=True)
+    for name in (index if names is None else names):
+        with open_member(path, name, index) as src, open(os.path.join(dest_dir, name), 'wb') as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER)
+    return dest_dir
+
+
+class _MemberReader(io.RawIOBase):
+    def __init__(self, f, size):
+        super().__init__()
+        self._f = f
+        self._remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._remaining <= 0:
+            return 0
+        view = memoryview(b)[:self._remaining]
+        n = self._f.readinto(view)
+        self._remaining -= n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+
+class _NonClosing(io.RawIOBase):
+    """
+    压缩流关闭时会关闭底层文件，写入归档的成员之间需要保持归档文件打开
+    """
+
+    def __init__(self, f):
+        super().__init__()
+        self._f = f
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self._f.write(b)
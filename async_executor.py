@@ -0,0 +1,173 @@
+import asyncio
+import os
+import queue
+import shutil
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from clogger import clogger
+from scheduler import pick_task
+
+_thread_pools = weakref.WeakKeyDictionary()  # {事件循环: (默认线程池, 线程数)}
+
+
+def find_executable(name, cwd=None):
+    """
+    查找命令的完整路径，优先使用 cwd(数据库安装目录)中的命令，不经过 shell 直接执行时需要完整路径
+
+    :param name: 命令名，如 mysqldump
+    :param cwd: 优先查找的目录
+    :return: 命令路径，找不到时原样返回命令名
+    """
+    return (cwd and shutil.which(name, path=cwd)) or shutil.which(name) or name
+
+
+async def run_process(args, cwd=None, timeout=None, stdin=None, stdout=None, **kwargs):
+    """
+    不经过 shell 直接启动子进程并等待结束，错误输出逐行读取并记录
+
+    stdin/stdout 可以是已打开的文件，由子进程直接读写；也可以是函数，
+    在线程中以管道另一端的文件对象为参数调用，用于边解压边输入或边输出边压缩，不阻塞事件循环。
+
+    :param args: 命令及参数列表
+    :param cwd: 工作目录
+    :param timeout: 超时秒数，超时后结束子进程并抛出 TimeoutError，为空时不限制
+    :param stdin: 标准输入
+    :param stdout: 标准输出
+    :param kwargs: 传给 create_subprocess_exec 的其他参数，如 Windows 上的 creationflags
+    :return: (返回码, 错误输出)
+    """
+    loop = asyncio.get_running_loop()
+    pumps = []
+    child_stdin, child_stdout = stdin, stdout
+    if callable(stdin):
+        read_fd, write_fd = os.pipe()
+        child_stdin = read_fd
+        pumps.append((stdin, write_fd, read_fd, 'wb'))
+    if callable(stdout):
+        read_fd, write_fd = os.pipe()
+        child_stdout = write_fd
+        pumps.append((stdout, read_fd, write_fd, 'rb'))
+    try:
+        process = await asyncio.create_subprocess_exec(*args, cwd=cwd, stdin=child_stdin, stdout=child_stdout,
+                                                       stderr=asyncio.subprocess.PIPE, **kwargs)
+    except Exception:
+        for _, fd, _, _ in pumps:
+            os.close(fd)
+        raise
+    finally:
+        # 子进程已继承管道的一端，父进程关闭自己的副本，否则管道另一端读不到结束
+        for _, _, child_fd, _ in pumps:
+            os.close(child_fd)
+    futures = [loop.run_in_executor(None, _pump, func, fd, mode) for func, fd, _, mode in pumps]
+    stderr_lines = []
+
+    async def read_stderr():
+        async for line in process.stderr:
+            text = line.decode('utf-8', errors='replace').rstrip()
+            stderr_lines.append(text)
+            clogger.debug(text)
+
+    try:
+        await asyncio.wait_for(asyncio.gather(read_stderr(), process.wait(), *futures), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise TimeoutError(f"{os.path.basename(args[0])} 超过 {timeout} 秒未完成，已结束")
+    return process.returncode, '\n'.join(stderr_lines)
+
+
+def _pump(func, fd, mode):
+    try:
+        with open(fd, mode) as f:
+            func(f)
+    except BrokenPipeError:
+        # 子进程提前退出，返回码中包含失败原因
+        pass
+
+
+async def run_in_thread(func):
+    """
+    在线程中调用以结果队列返回结果的备份或还原函数，不需要 Manager 队列
+
+    :param func: 以结果队列为唯一参数的函数
+    :return: (队列中的结果, 函数返回值)
+    """
+    result_queue = queue.Queue()
+    value = await asyncio.get_running_loop().run_in_executor(None, func, result_queue)
+    return result_queue.get(), value
+
+
+def use_thread_pool(max_workers):
+    """
+    确保当前事件循环的默认线程池至少有 max_workers 个线程
+
+    同一次 asyncio.run 中已有足够大的线程池时直接沿用，需要更大的线程池时替换并关闭原来的线程池，
+    asyncio.run 结束时关闭最后一个。
+    """
+    loop = asyncio.get_running_loop()
+    previous, size = _thread_pools.get(loop, (None, 0))
+    if size >= max_workers:
+        return
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    loop.set_default_executor(executor)
+    _thread_pools[loop] = (executor, max_workers)
+    if previous is not None:
+        # 原线程池中已提交的任务继续执行完，之后线程退出
+        previous.shutdown(wait=False)
+
+
+def progress_bar(weights, desc):
+    """
+    按任务字节数前进的进度条，大表完成时前进得多，任务大小都未知时按任务数前进
+
+    :param weights: 每个任务的字节数
+    :param desc: 进度条描述
+    :return: (进度条, 每个任务完成时前进的量)
+    """
+    # 进度条只在主进程中用到，子进程导入本模块时不导入 tqdm
+    from tqdm import tqdm
+    weights = list(weights)
+    if not sum(weights):
+        return tqdm(total=len(weights), desc=desc, ncols=80), [1] * len(weights)
+    return tqdm(total=sum(weights), desc=desc, ncols=80, unit='B', unit_scale=True, unit_divisor=1024), weights
+
+
+async def run_all(coros, desc, limit, controller=None, groups=None, group_limit=None, weights=None):
+    """
+    按顺序启动任务，同时运行的任务数不超过 limit，任务完成时即更新进度
+
+    :param coros: 协程列表，按启动顺序排列
+    :param desc: 进度条描述
+    :param limit: 同时运行的任务数，自适应并发时为上限
+    :param controller: 自适应并发控制器，同时运行的任务数随其当前并发数变化，为空时固定为 limit
+    :param groups: 每个任务所属的分组(如服务器)，与 coros 一一对应，为空时不分组
+    :param group_limit: 每个分组同时运行的任务数上限
+    :param weights: 每个任务的字节数，进度按字节数前进，为空时按任务数
+    :return: 各任务的返回值，按完成顺序排列
+    """
+    # 每个任务最多占用两个线程(输入和输出管道)，线程中执行的任务占用一个
+    use_thread_pool(limit * 2)
+    pending = list(coros)
+    pending_groups = list(groups) if groups else [None] * len(pending)
+    bar, pending_weights = progress_bar(weights or [0] * len(pending), desc)
+    running = {}  # {任务: (分组, 进度)}
+    results = []
+    with bar:
+        while pending or running:
+            # 按提交顺序(大任务优先)补足到当前并发数，所在分组已满的任务留给后面的任务让路
+            while pending:
+                index = pick_task(pending_groups, [group for group, _ in running.values()],
+                                  controller.limit if controller else limit, group_limit)
+                if index is None:
+                    break
+                running[asyncio.ensure_future(pending.pop(index))] = (pending_groups.pop(index),
+                                                                      pending_weights.pop(index))
+            # 自适应并发时定期醒来，并发数调高后不必等到有任务完成才启动新任务
+            done, _ = await asyncio.wait(running, timeout=controller and controller.interval,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                _, weight = running.pop(future)
+                results.append(future.result())
+                bar.update(weight)
+    return results
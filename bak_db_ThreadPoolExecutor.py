@@ -11,6 +11,7 @@ from rich.prompt import Prompt
 from tqdm import tqdm
 
 from clogger import clogger
+from scheduler import get_file_sizes, get_table_sizes, lpt_order
 from zip_file import compress_and_delete, decompress
 
 
@@ -93,6 +94,8 @@ class MysqlBackuper:
         cursor.execute("SHOW TABLES")
         tables = [table[0] for table in cursor]
         cursor.close()
+        # 按表体积由大到小排序，大表先开始，小表填充空闲线程
+        tables = lpt_order(tables, get_table_sizes(cnx, self.database))
         cnx.close()
 
         # 使用线程池并发备份所有表格
@@ -146,6 +149,8 @@ class MysqlBackuper:
         clogger.info(f'开始还原数据库{self.database},目录:{restore_dir}')
         # 获取所有备份文件的名称
         backup_files = os.listdir(restore_dir)
+        # 按文件大小由大到小排序
+        backup_files = lpt_order(backup_files, get_file_sizes(restore_dir, backup_files))
 
         # 使用线程池并发还原所有表格
         with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
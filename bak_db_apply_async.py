@@ -1,17 +1,46 @@
 import argparse
+import asyncio
+import contextlib
+import functools
+import io
 import multiprocessing
 import os
+import shutil
 import subprocess
+import tempfile
 import time
-from queue import Empty
+from queue import Empty, Queue
 
 import mysql.connector
-import yaml
-from rich.prompt import Prompt
-from tqdm import tqdm
 
+import archive
+import binlog
+import connections
+import object_store
+import snapshot
+import throttle
+from async_executor import find_executable, progress_bar, run_all, run_in_thread, run_process
+from checkpoint import (JOURNAL_NAME, PARTIAL_DIR, append_checkpoint, commit_files, read_checkpoints,
+                        replace_inserts, restore_journal_path)
+from chunker import TRIGGER_PART, parse_part_file, part_file_name, plan_chunks, split_schema_files
 from clogger import clogger
-from zip_file import compress_and_delete, decompress
+from concurrency import SLOT_POLL_SECONDS, ConcurrencyController
+from codec import COPY_BUFFER, RECIPE_EXT, codec_ext, open_writer, plain_path, strip_codec_ext, wrap_writer
+from ddl import alter_table_sql, rewrite_create_tables
+from dump_engine import (DUMP_FOOTER, DUMP_HEADER, dump_table, get_dump_columns, set_utc_session, show_triggers,
+                         start_snapshot, write_create_table, write_triggers)
+from metrics import RESTORE_REPORT_EXT, REPORT_NAME, TaskMetrics, build_report, write_prometheus, write_report
+from manifest import (MANIFEST_NAME, chained_backups, find_previous_backup, get_fingerprints, group_files_by_table,
+                      hash_file, new_manifest, referenced_files, reuse_table, write_manifest)
+from repository import (STORE_DIR, ChunkStore, ChunkWriter, collect_garbage, prune_backups, recipe_size,
+                        store_dir_for)
+from sql_splitter import replay_statements, split_statements
+from scheduler import assign_tiers, get_table_sizes, lpt_order, match_patterns, pick_task, tier_index
+from tab_format import load_tab_file, write_tab_rows
+from targets import expand_targets, server_of, target_label
+from workers import call, create_pool, use_forkserver
+from zip_file import (archive_members, compress_and_delete, decompress, extract_backup, hash_backup_file,
+                      is_solid_archive, list_backup_files, open_backup_reader, open_backup_text, read_backup_manifest)
 
 
 # from queue import Queue
@@ -19,7 +48,16 @@ from zip_file import compress_and_delete, decompress
 
 class MysqlBackuper:
     def __init__(self, hostname, username, password, database, port=3306, db_cwd=None, backup_dir=None, ex_opt=None,
-                 max_workers=4):
+                 max_workers=4, chunk_size_mb=0, dump_engine='mysqldump', backup_format='sql', fast_restore=False,
+                 skip_binlog=False, compress_codec=None, compress_level=None, archive_format='7z', incremental=False,
+                 incremental_check='auto', binlog_dir=None, binlog_server_id=None, executor='pool', task_timeout=None,
+                 adaptive_concurrency=False, min_workers=1, adaptive_interval=5, max_threads_running=None,
+                 max_row_lock_waits=None, max_replication_lag=None, throttle_read_mb=None, throttle_write_mb=None,
+                 throttle_profiles=None, low_priority=False, consistent_snapshot=False, connect_retries=5,
+                 connect_retry_delay=0.5, circuit_breaker_failures=3, split_sql_mb=0, restore_tiers=None,
+                 tier_hook=None, prometheus_textfile=None, storage='files', keep_backups=None, s3_url=None,
+                 s3_endpoint_url=None, s3_region=None, s3_access_key=None, s3_secret_key=None, s3_part_mb=16,
+                 s3_threads=4):
         """
         初始化备份对象属性
         :param hostname: 数据库主机名或 IP 地址
@@ -28,8 +66,50 @@ class MysqlBackuper:
         :param database: 待备份的数据库名
         :param port: 数据库端口号，默认为 3306
         :param backup_dir: 备份文件存储目录，默认为 './backup'
+        :param chunk_size_mb: 大表分片大小(MB)，超过该大小的表按主键范围切分并行备份，0 表示不分片
+        :param dump_engine: 备份引擎，mysqldump 为调用 mysqldump 命令，native 为使用 mysql.connector 在进程内导出
+        :param backup_format: 备份格式，sql 为 INSERT 语句，tab 为表结构 .sql 加制表符分隔的 .txt 数据文件
+        :param fast_restore: 快速还原，建表时只保留主键，关闭唯一性和外键检查导入数据后再并行补建二级索引和外键
+        :param skip_binlog: 快速还原时关闭还原会话的 binlog 写入(sql_log_bin=0)，需要 SUPER 权限
+        :param compress_codec: 逐表流式压缩算法 zstd/gzip/xz/lzma，为空时不压缩
+        :param compress_level: 压缩级别，为空时使用算法默认值
+        :param archive_format: 压缩备份目录的格式，7z 或 dbbp(每张表单独压缩并带索引，可只读取部分表)
+        :param incremental: 增量备份，只备份指纹变化的表，未变化的表复用上一次备份的文件
+        :param incremental_check: 变更指纹的计算方式，auto 优先使用 UPDATE_TIME，checksum 始终使用 CHECKSUM TABLE
+        :param binlog_dir: 持续拉取的 binlog 分段存放目录，默认为备份目录下的 binlog
+        :param binlog_server_id: mysqlbinlog 拉取 binlog 时使用的 server id，不能与复制拓扑中的其他节点相同
+        :param executor: 任务执行方式，pool 为进程池，asyncio 为单个事件循环直接驱动 mysqldump/mysql 子进程
+        :param task_timeout: asyncio 执行方式下单个任务的超时秒数，为空时不限制
+        :param adaptive_concurrency: 自适应并发，按服务端负载和吞吐在 min_workers 与 max_workers 之间调整并发数
+        :param min_workers: 自适应并发的下限和初始并发数
+        :param adaptive_interval: 自适应并发的采样周期秒数
+        :param max_threads_running: Threads_running 超过该值时降低并发，为空时不检查
+        :param max_row_lock_waits: InnoDB 当前行锁等待数超过该值时降低并发，为空时不检查
+        :param max_replication_lag: 复制延迟秒数超过该值时降低并发，为空时不检查
+        :param throttle_read_mb: 备份时所有任务合计从服务端读取的限速(MB/s)，为空时不限制
+        :param throttle_write_mb: 备份时所有任务合计写入备份目录的限速(MB/s)，为空时不限制
+        :param throttle_profiles: 按时段的限速 [{'start': '09:00', 'end': '18:00', 'read_mb', 'write_mb'}]
+        :param low_priority: 备份时以低 CPU 和 IO 优先级运行 mysqldump 和进程池中的子进程
+        :param consistent_snapshot: 一致性快照，短暂持有全局读锁让所有连接开启同一时刻的快照，再并行导出
+        :param connect_retries: 连接数据库失败后的重试次数，按指数退避加随机抖动等待
+        :param connect_retry_delay: 第一次重试前的基础等待秒数
+        :param circuit_breaker_failures: 连续多少个任务无法连接数据库时熔断，剩余任务直接失败，0 表示不熔断
+        :param split_sql_mb: 还原时超过该大小(MB)的 .sql 数据文件拆分为语句流，由 max_workers 个连接并行导入，0 表示不拆分
+        :param restore_tiers: 还原优先级，每层为表名或通配符列表，前一层全部还原后才开始下一层，不匹配的表最后还原
+        :param tier_hook: 每层还原完成后执行的命令，环境变量 DBBP_TIER、DBBP_TIER_TABLES、DBBP_TIER_FAILED 传入层信息
+        :param prometheus_textfile: 每次备份或还原后写入 Prometheus 指标的 .prom 文件，为空时只写 JSON 报告
+        :param storage: 备份文件的存放方式，files 为每个文件单独存放，repository 为按内容切块去重后存入备份目录下的块仓库
+        :param keep_backups: --prune 时保留的最近备份数，为空时只回收块仓库中未被引用的块
+        :param s3_url: 备份文件直接流式上传到对象存储的位置 s3://桶/路径，本地备份目录只保留清单和进度，为空时写入本地
+        :param s3_endpoint_url: S3 兼容存储(如 MinIO)的地址，为空时使用 AWS
+        :param s3_region: 对象存储的区域
+        :param s3_access_key: 访问密钥，为空时使用 boto3 默认的凭证(环境变量、~/.aws 等)
+        :param s3_secret_key: 访问密钥对应的私钥
+        :param s3_part_mb: 分段上传和分段下载每段的大小(MB)，不能小于 5
+        :param s3_threads: 每个文件并行上传或下载的分段数，每个文件最多占用 s3_part_mb * (s3_threads + 1) 的内存
         """
         self.ex_opt = "" if ex_opt is None else ' '.join(ex_opt)  # 额外的备份命令选项
+        self.ex_args = list(ex_opt or [])  # 不经过 shell 执行时的额外选项
         self.hostname = hostname
         self.username = username
         self.password = password
@@ -39,222 +119,1571 @@ class MysqlBackuper:
         self.backup_dir = backup_dir
         self.mysql_exe = 'mysqldump'  # 默认备份命令
         self.max_workers = max_workers  # 默认备份线程数
+        self.chunk_size = int(chunk_size_mb * 1024 * 1024)  # 分片大小(字节)
+        self.dump_engine = dump_engine
+        self.backup_format = backup_format
+        self.fast_restore = fast_restore
+        self.skip_binlog = skip_binlog
+        codec_ext(compress_codec)  # 提前检查压缩算法是否可用
+        self.compress_codec = compress_codec
+        self.compress_level = compress_level
+        self.archive_format = archive_format
+        self.incremental = incremental
+        self.incremental_check = incremental_check
+        self.binlog_dir = binlog_dir or (os.path.join(backup_dir, 'binlog') if backup_dir else None)
+        self.binlog_server_id = binlog_server_id
+        self.executor = executor
+        self.task_timeout = task_timeout
+        self.adaptive_concurrency = adaptive_concurrency
+        self.min_workers = min_workers
+        self.adaptive_interval = adaptive_interval
+        self.max_threads_running = max_threads_running
+        self.max_row_lock_waits = max_row_lock_waits
+        self.max_replication_lag = max_replication_lag
+        self.throttle_read_mb = throttle_read_mb
+        self.throttle_write_mb = throttle_write_mb
+        self.throttle_profiles = throttle_profiles
+        self.low_priority = low_priority
+        self.consistent_snapshot = consistent_snapshot
+        self.connect_retries = connect_retries
+        self.connect_retry_delay = connect_retry_delay
+        self.circuit_breaker_failures = circuit_breaker_failures
+        self.split_sql_mb = split_sql_mb
+        self.restore_tiers = restore_tiers
+        self.tier_hook = tier_hook
+        self.prometheus_textfile = prometheus_textfile
+        if storage not in ('files', 'repository'):
+            raise ValueError(f"不支持的存放方式 {storage}")
+        self.storage = storage
+        self.keep_backups = keep_backups
+        self.s3_url = s3_url.rstrip('/') if s3_url else None
+        self.s3_settings = None  # 对象存储的连接配置，多数据库备份时各数据库须相同
+        if s3_url:
+            if not object_store.is_object_url(s3_url):
+                raise ValueError(f"s3_url 须以 {object_store.URL_PREFIX} 开头")
+            if s3_part_mb < object_store.MIN_PART_MB:
+                raise ValueError(f"s3_part_mb 不能小于 {object_store.MIN_PART_MB}")
+            self.s3_settings = {'endpoint_url': s3_endpoint_url, 'region': s3_region, 'access_key': s3_access_key,
+                                'secret_key': s3_secret_key, 'part_mb': s3_part_mb, 'threads': s3_threads}
+            object_store.install(self.s3_settings)
+        if consistent_snapshot and dump_engine == 'mysqldump' and backup_format == 'sql':
+            # 各 mysqldump 进程只能各自开启快照，共享快照的连接需要在进程内导出
+            clogger.warning("一致性快照需要在进程内导出，dump_engine 改为 native")
+            self.dump_engine = 'native'
+        if self.s3_url and incremental:
+            # 增量备份以硬链接或引用方式复用本地的文件
+            clogger.warning("备份到对象存储时不支持增量备份，改为完整备份")
+            self.incremental = False
+        if self.s3_url and storage == 'repository':
+            clogger.warning("备份到对象存储时不支持块仓库，storage 改为 files")
+            self.storage = 'files'
 
-    def backup_table(self, table_name, result_queue):
-        # 增加异常处理，处理数据库连接异常
-        connected = False
-        cnx = None
-        err = ""
-        while not connected:
-            try:
-                # 连接数据库，直到连接成功为止
-                cnx = mysql.connector.connect(user=self.username, password=self.password, host=self.hostname,
-                                              port=self.port, database=self.database)
-                connected = True
-            except Exception as ec:
-                clogger.info(f"数据库连接异常:{ec}")
-                time.sleep(2)
+    def backup_table(self, table_name, result_queue, part=None, where=None):
+        """
+        备份单张表或大表的一个分片
 
+        :param table_name: 表名
+        :param result_queue: 备份结果队列
+        :param part: 分片序号，None 为整表备份，0 为仅备份表结构，大于 0 为按 where 条件备份数据，
+            TRIGGER_PART 为仅备份触发器
+        :param where: 分片的 where 条件
+        """
+        cnx = None
+        metrics = TaskMetrics(table_name if part is None else part_file_name(table_name, part), table_name)
         try:
+            if self.consistent_snapshot:
+                # 使用已开启快照的连接
+                cnx = snapshot.acquire()
+            elif self.backup_format == 'tab' or self.dump_engine == 'native':
+                # 复用本进程的空闲连接，连接失败时有限次重试；mysqldump 自行连接，不需要
+                with metrics.phase('connect'):
+                    cnx = self.acquire_connection()
+            else:
+                connections.check_breaker(self.connect_kwargs())
             # 输出备份进度
             # clogger.info(f"正在备份表 {table_name}...")
-            # 构造备份命令
-            #  --routines 用于在备份时同时备份存储过程和函数等程序性对象。
-            cmd = f"{self.mysql_exe} -u {self.username} -p{self.password} " \
-                  f"-h {self.hostname} -P {self.port} {self.ex_opt} {self.database} {table_name}"
-            backup_file = os.path.join(self.db_backup_dir, table_name + '.sql')  # 备份文件名为表名加上后缀 .sql
-            cmd = f'{cmd} > {backup_file}'
-            result = subprocess.run(cmd, shell=True, cwd=self.db_cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            assert result.stdout.decode('gbk') == ''
-            err = result.stderr.decode('gbk')
-            assert err == ''
+            start_time = time.time()
+            rows = None  # mysqldump 导出时不统计行数
+            # 备份文件名为表名加上后缀 .sql，分片为 表名.NNNN.sql
+            file_name = table_name + '.sql' if part is None else part_file_name(table_name, part)
+            # 先写入未完成目录，写完后再移入备份目录，中断后留下的文件不会被当作已完成
+            partial_dir = os.path.join(self.db_backup_dir, PARTIAL_DIR)
+            backup_file = os.path.join(partial_dir, file_name)
+            if self.backup_format == 'tab':
+                backup_files, rows = self.tab_dump_table(cnx, table_name, partial_dir, part, where, metrics)
+            elif self.dump_engine == 'native':
+                with self.open_backup_text(backup_file, metrics) as out:
+                    rows = dump_table(cnx, table_name, out, where=where, no_data=part in (0, TRIGGER_PART),
+                                      no_create_info=bool(part), triggers=part in (None, TRIGGER_PART),
+                                      single_transaction=self.single_transaction())
+                backup_files = [backup_file + self.stored_ext()]
+            else:
+                err = self.mysqldump_table(table_name, backup_file, part, where, metrics)
+                if err:
+                    # 返回码为 0 时错误输出只是警告，如在命令行中使用密码的提示
+                    clogger.warning(f"表 {table_name} 备份时 mysqldump 输出：{err.strip()}")
+                backup_files = [backup_file + self.stored_ext()]
+            info = self.finish_backup_task(table_name, part, backup_files, rows, time.time() - start_time, metrics)
             # 输出备份完成信息
             # clogger.info(f"表 {table_name} bak done")
 
             # 将备份结果写入共享队列
-            result_queue.put((table_name, True, backup_file))
+            result_queue.put((table_name, True, info))
         except Exception as es:
             # 抛出备份异常信息
-            clogger.error(f"表 {table_name} 备份失败：{es} {err}")
-            result_queue.put((table_name, False, str(e)))
+            clogger.error(f"表 {table_name} 备份失败：{es}")
+            result_queue.put((table_name, False, str(es)))
             # raise es
         finally:
-            cnx.close()  # 关闭数据库连接
+            # 归还连接，同一进程的下一个任务继续使用
+            if self.consistent_snapshot and cnx is not None:
+                snapshot.release(cnx)
+            elif cnx is not None:
+                self.release_connection(cnx)
+
+    def single_transaction(self):
+        # 每个任务各自开启快照事务；一致性快照时连接已在快照事务中，不能再开启或回滚
+        return '--single-transaction' in self.ex_opt and not self.consistent_snapshot
+
+    def connect_kwargs(self, **extra):
+        return dict({'user': self.username, 'password': self.password, 'host': self.hostname, 'port': self.port,
+                     'database': self.database}, **extra)
+
+    def acquire_connection(self, **extra):
+        """
+        取出本进程中的空闲连接，没有时新建，连接失败时按指数退避重试
+
+        :param extra: 额外的连接参数，如 allow_local_infile，参数不同的连接分别复用
+        """
+        return connections.acquire(self.connect_kwargs(**extra), self.connect_retries, self.connect_retry_delay)
+
+    def release_connection(self, cnx, **extra):
+        connections.release(cnx, self.connect_kwargs(**extra))
+
+    def finish_backup_task(self, table_name, part, backup_files, rows, seconds, metrics=None):
+        """
+        将写完的文件移入备份目录，计算哈希并记录进度
+
+        :param metrics: 任务的 TaskMetrics，提交文件和计算哈希的时间计入 commit 阶段
+        :return: 统计信息 {'rows', 'seconds', 'hashes', 'metrics'}
+        """
+        metrics = metrics or TaskMetrics(table_name if part is None else part_file_name(table_name, part), table_name)
+        with metrics.phase('commit'):
+            if self.s3_url:
+                # 提交分段上传后对象才出现在桶中，哈希在上传时已计算
+                urls = [object_store.join_url(self.object_dir(), os.path.basename(f)) for f in backup_files]
+                hashes = {os.path.basename(url): object_store.commit(url) for url in urls}
+            else:
+                backup_files = commit_files(backup_files, self.db_backup_dir)
+                # 刚写完的文件仍在页缓存中，此时计算哈希基本不产生额外的磁盘读取
+                hashes = {os.path.basename(f): hash_file(f) for f in backup_files}
+        if self.storage != 'repository':
+            # 块仓库模式下 bytes_out 为新写入块仓库的字节数，已在写入时统计
+            metrics.bytes_out = sum(size for size, _ in hashes.values())
+        info = {'rows': rows, 'seconds': seconds, 'hashes': hashes, 'metrics': metrics.finish()}
+        # 记录进度，中断后继续备份时跳过已完成的表和分片
+        unit = table_name if part is None else part_file_name(table_name, part)
+        append_checkpoint(os.path.join(self.db_backup_dir, JOURNAL_NAME), dict(info, unit=unit, table=table_name))
+        return info
+
+    def mysqldump_table(self, table_name, backup_file, part=None, where=None, metrics=None):
+        """
+        调用 mysqldump 命令备份表
+
+        :param metrics: 任务的 TaskMetrics，边导出边压缩或限速时统计压缩和写入的耗时
+        :return: mysqldump 的错误输出，返回码不为 0 时抛出异常；结果同时计入熔断器
+        """
+        # 以参数列表形式执行，不经过 shell，分片 where 条件中带反引号的列名不会被 shell 解释
+        args = self.mysqldump_args(table_name, part, where)
+        priority_kwargs = throttle.low_priority_kwargs() if self.low_priority else {}
+        if self.piped_dump():
+            # 边导出边压缩和限速，未压缩的数据不落盘；错误输出写入临时文件，避免管道写满阻塞 mysqldump
+            out, _ = self.open_backup_writer(backup_file, metrics)
+            with out, tempfile.TemporaryFile() as err_file:
+                process = subprocess.Popen(args, cwd=self.db_cwd, stdout=subprocess.PIPE, stderr=err_file,
+                                           **priority_kwargs)
+                shutil.copyfileobj(process.stdout, out, COPY_BUFFER)
+                recode = process.wait()
+                err_file.seek(0)
+                err = err_file.read().decode('gbk')
+        else:
+            with open(backup_file, 'wb') as out:
+                result = subprocess.run(args, cwd=self.db_cwd, stdout=out, stderr=subprocess.PIPE, **priority_kwargs)
+            recode, err = result.returncode, result.stderr.decode('gbk')
+        connections.record_client_result(recode, err, self.connect_kwargs())
+        if recode != 0:
+            # 输出被截断时 mysqldump 不一定有错误输出，不能只看错误输出
+            raise RuntimeError(f"mysqldump 返回码为 {recode}：{err}")
+        return err
+
+    def open_backup_writer(self, backup_file, metrics=None):
+        """
+        打开备份输出文件，配置了压缩算法时写入即压缩；配置了限速时，
+        压缩前的数据按读取限速、写入磁盘的数据按写入限速取得配额
+
+        块仓库模式下写入的数据按内容切块存入块仓库，备份目录中只写块引用文件；配置了对象存储时直接分段上传
+
+        :param metrics: 任务的 TaskMetrics，写入磁盘(或上传)和压缩的耗时分别计入 write(或 upload)和 compress 阶段
+        :return: (二进制输出流, 实际文件路径)
+        """
+        if self.storage == 'repository':
+            # 未配置压缩算法时块仓库中的块使用 gzip 压缩
+            path = backup_file + RECIPE_EXT
+            store = ChunkStore(store_dir_for(self.db_backup_dir), self.compress_codec or 'gzip', self.compress_level)
+            return throttle.wrap_read(ChunkWriter(store, path, metrics)), path
+        path = backup_file + codec_ext(self.compress_codec)
+        if self.s3_url:
+            # 直接分段上传，本地不落盘，任务完成时才提交
+            path = object_store.join_url(self.object_dir(), os.path.basename(path))
+            out, phase = object_store.open_writer(path), 'upload'
+        elif not throttle.active() and metrics is None:
+            return open_writer(backup_file, self.compress_codec, self.compress_level)
+        else:
+            out, phase = open(path, 'wb', buffering=COPY_BUFFER), 'write'
+        if metrics:
+            out = metrics.meter(out, phase, count=not codec_ext(self.compress_codec))
+        out = wrap_writer(throttle.wrap_write(out), self.compress_codec, self.compress_level)
+        if metrics and codec_ext(self.compress_codec):
+            out = metrics.meter(out, 'compress', count=True)
+        return throttle.wrap_read(out), path
+
+    def object_dir(self):
+        # 本次备份在对象存储中的位置，备份名与本地备份目录相同
+        return object_store.join_url(self.s3_url, os.path.basename(os.path.normpath(self.db_backup_dir)))
+
+    def stored_ext(self):
+        # 备份文件写入后的扩展名
+        return RECIPE_EXT if self.storage == 'repository' else codec_ext(self.compress_codec)
+
+    def piped_dump(self):
+        # mysqldump 的输出是否需要经过本进程处理(压缩、限速、切块或上传)，而不是直接写入文件
+        return bool(codec_ext(self.compress_codec) or throttle.active() or self.storage == 'repository' or self.s3_url)
+
+    def open_backup_text(self, backup_file, metrics=None):
+        """
+        以文本方式打开备份输出文件，配置了压缩算法时写入即压缩
+        """
+        out, _ = self.open_backup_writer(backup_file, metrics)
+        return io.TextIOWrapper(out, encoding='utf-8', newline='\n')
+
+    def tab_dump_table(self, cnx, table_name, out_dir, part=None, where=None, metrics=None):
+        """
+        以 tab 格式备份表: 表结构写入 .sql 文件，数据写入制表符分隔的 .txt 文件，触发器写入 .triggers.sql 文件，
+        效果与 mysqldump --tab 相同，但数据经连接传回本地，可用于远程服务器
+
+        :param out_dir: 输出目录
+        :param metrics: 任务的 TaskMetrics
+        :return: (写出的文件路径列表, 导出的行数)
+        """
+        # TIMESTAMP 列以 UTC 写入数据文件，导入时同样以 UTC 解释
+        set_utc_session(cnx)
+        single_transaction = self.single_transaction()
+        if single_transaction:
+            start_snapshot(cnx)
+        backup_files = []
+        rows = 0
+        is_view = False
+        if not part:
+            schema_name = table_name + '.sql' if part is None else part_file_name(table_name, 0)
+            schema_file = os.path.join(out_dir, schema_name)
+            with self.open_backup_text(schema_file, metrics) as out:
+                out.write(DUMP_HEADER)
+                is_view = write_create_table(cnx, table_name, out)
+                out.write(DUMP_FOOTER)
+            backup_files.append(schema_file + self.stored_ext())
+        if part not in (0, TRIGGER_PART) and not is_view:
+            data_name = table_name + '.txt' if part is None else part_file_name(table_name, part, 'txt')
+            out, data_file = self.open_backup_writer(os.path.join(out_dir, data_name), metrics)
+            with out:
+                rows = write_tab_rows(cnx, table_name, out, where)
+            backup_files.append(data_file)
+        if part in (None, TRIGGER_PART) and not is_view:
+            # 表结构文件先于数据文件还原，触发器写入单独的文件，在数据导入之后还原
+            triggers = show_triggers(cnx, table_name)
+            if triggers or part == TRIGGER_PART:
+                trigger_file = os.path.join(out_dir, part_file_name(table_name, TRIGGER_PART))
+                with self.open_backup_text(trigger_file, metrics) as out:
+                    out.write(DUMP_HEADER)
+                    write_triggers(out, triggers)
+                    out.write(DUMP_FOOTER)
+                backup_files.append(trigger_file + self.stored_ext())
+        if single_transaction:
+            cnx.rollback()
+        return backup_files, rows
+
+    def concurrency_controller(self, bytes_counter):
+        """
+        开启自适应并发时返回并发控制器，否则返回空的上下文，并发数固定为 max_workers
+
+        控制器包含后台线程和数据库连接，不能传入进程池，只在主进程中使用。
+
+        :param bytes_counter: 计算吞吐的服务端计数器，备份为 Bytes_sent，还原为 Bytes_received
+        """
+        if not self.adaptive_concurrency:
+            return contextlib.nullcontext()
+        return ConcurrencyController(
+            lambda: mysql.connector.connect(user=self.username, password=self.password, host=self.hostname,
+                                            port=self.port),
+            self.min_workers, self.max_workers, self.adaptive_interval, self.max_threads_running,
+            self.max_row_lock_waits, self.max_replication_lag, bytes_counter)
 
     db_backup_dir = None  # 备份时按照时间命名的实际sql输出工作目录
+    snapshot_position = None  # 一致性快照时全局读锁期间记录的 binlog 位置
+    checkpoint_path = None  # 还原进度日志路径
+    resuming = False  # 是否在继续一次中断的还原
 
-    def backup_all_tables(self):
+    def backup_all_tables(self, resume_dir=None):
+        """
+        并行备份所有表
+
+        :param resume_dir: 继续一次中断的备份，跳过进度日志中已完成的表和分片，为空时新建以当前时间命名的目录
+        """
         start_time = time.time()
-        # 创建以当前时间命名的目录
-        self.db_backup_dir = os.path.join(self.backup_dir, time.strftime('%Y%m%d_%H%M%S'))
+        job = self.prepare_backup(resume_dir)
+
+        # 所有任务共用读取和写入配额，进程池的子进程由初始化函数启用
+        throttle.install(throttle.make_buckets(self.throttle_profiles, self.throttle_read_mb, self.throttle_write_mb))
+        if throttle.active():
+            read_mb, write_mb = throttle.profile_rates(self.throttle_profiles, self.throttle_read_mb,
+                                                       self.throttle_write_mb)
+            clogger.info(f"备份限速：读取 {read_mb or '不限'}MB/s，写入 {write_mb or '不限'}MB/s")
+        breaker = connections.CircuitBreaker(self.circuit_breaker_failures)
+        connections.install(breaker)
+        try:
+            with self.concurrency_controller('Bytes_sent') as controller:
+                if self.executor == 'asyncio':
+                    results = asyncio.run(self.async_backup(job['task_names'], job['tasks'], controller,
+                                                            job['plan']['task_sizes']))
+                else:
+                    results = self.pool_backup(job['task_names'], job['tasks'], controller, job['plan']['task_sizes'])
+        finally:
+            throttle.install()
+            connections.install()
+            connections.close_all()
+        if breaker.is_open():
+            clogger.error("无法连接数据库，本次备份提前结束")
+        self.finish_backup(job, results, start_time)
+
+    def prepare_backup(self, resume_dir=None):
+        """
+        创建备份目录，生成或读取备份计划，得到剩余的备份任务
+
+        :param resume_dir: 继续一次中断的备份，为空时新建以当前时间命名的目录
+        :return: {'plan', 'tasks', 'task_names', 'journal_path', 'partial_dir', 'resume_dir'}，
+                 task_names 按任务体积由大到小排列
+        """
+        if resume_dir:
+            self.db_backup_dir = resume_dir
+        else:
+            # 创建以当前时间命名的目录
+            self.db_backup_dir = os.path.join(self.backup_dir, time.strftime('%Y%m%d_%H%M%S'))
         # 如果目录不存在，则创建目录
         if not os.path.exists(self.db_backup_dir):
             os.makedirs(self.db_backup_dir)
+        journal_path = os.path.join(self.db_backup_dir, JOURNAL_NAME)
+        partial_dir = os.path.join(self.db_backup_dir, PARTIAL_DIR)
 
-        clogger.info(f'开始备份数据库{self.database},目录:{self.db_backup_dir}')
+        records = read_checkpoints(journal_path) if resume_dir else []
+        plans = [r['plan'] for r in records if 'plan' in r]
+        if resume_dir and not plans:
+            raise RuntimeError(f"{resume_dir} 中没有备份进度，无法继续备份")
+        if plans:
+            # 沿用中断前的备份计划，保证分片的范围与已完成的分片一致
+            plan = plans[0]
+            clogger.info(f'继续备份数据库{self.database},目录:{self.db_backup_dir}')
+            if self.consistent_snapshot:
+                clogger.warning("继续备份时剩余的表来自新的快照，与中断前完成的表不是同一时刻的数据")
+        else:
+            clogger.info(f'开始备份数据库{self.database},目录:{self.db_backup_dir}')
+            plan = self.plan_backup()
+            append_checkpoint(journal_path, {'plan': plan})
+        # 中断时未写完的文件全部丢弃，对应的表和分片会重新备份
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        os.makedirs(partial_dir)
+        done_units = {r['unit'] for r in records if 'unit' in r}
+        tasks = {name: task for name, task in plan['tasks'].items() if name not in done_units}
+        if done_units:
+            clogger.info(f"跳过已完成的 {len(done_units)} 个表或分片，剩余 {len(tasks)} 个")
+        # 按任务体积由大到小排序，大表先开始，小表填充空闲进程
+        task_names = lpt_order(list(tasks), {name: tuple(size) for name, size in plan['task_sizes'].items()})
+        return {'plan': plan, 'tasks': tasks, 'task_names': task_names, 'journal_path': journal_path,
+                'partial_dir': partial_dir, 'resume_dir': resume_dir}
 
-        # 获取所有表的名称
-        cnx = mysql.connector.connect(user=self.username, password=self.password, host=self.hostname, port=self.port,
-                                      database=self.database)
-        cursor = cnx.cursor()
-        cursor.execute("SHOW TABLES")
-        tables = [table[0] for table in cursor]
-        cursor.close()
-        cnx.close()
+    def finish_backup(self, job, results, start_time):
+        """
+        汇总备份结果，写入清单，全部成功时删除进度日志
 
+        :param job: prepare_backup 的返回值
+        :param results: 备份结果列表 [(表名, 是否成功, 统计信息或失败原因)]
+        :param start_time: 备份开始时间
+        """
+        plan, journal_path, partial_dir = job['plan'], job['journal_path'], job['partial_dir']
+        resume_dir = job['resume_dir']
+        # 处理备份结果，记录日志
+        success_tables = []
+        failed_tables = []
+        for table_name, success, info in results:
+            if success:
+                success_tables.append(table_name)
+                # clogger.info(f"表 {table_name} 备份成功，备份文件为 {info}")
+            else:
+                failed_tables.append(table_name)
+                clogger.error(f"表 {table_name} 备份失败，失败原因：{info}")
+
+        if failed_tables:
+            clogger.warning(f"{len(failed_tables)} 张表备份失败：{', '.join(failed_tables)}")
+        else:
+            clogger.info("所有表备份成功！")
+
+        if self.snapshot_position and not resume_dir:
+            # 所有表都来自全局读锁期间开启的快照，按时间点恢复从锁定时的位置开始重放
+            plan['manifest']['binlog'] = self.snapshot_position
+            plan['manifest']['consistent_snapshot'] = True
+
+        # 按进度日志汇总各表的统计，包括中断前已完成的分片，大表的各个分片按表汇总
+        table_stats = {}
+        task_metrics = []  # 本次运行完成的任务的指标
+        for record in read_checkpoints(journal_path):
+            if 'unit' not in record:
+                continue
+            if record.get('metrics') and record['metrics']['start'] >= start_time:
+                task_metrics.append(record['metrics'])
+            stats = table_stats.setdefault(record['table'], {'rows': 0, 'seconds': 0.0, 'hashes': {}})
+            stats['rows'] = None if stats['rows'] is None or record['rows'] is None \
+                else stats['rows'] + record['rows']
+            stats['seconds'] += record['seconds']
+            stats['hashes'].update(record['hashes'])
+
+        # 记录本次备份的清单，失败的表不记录指纹，下次增量备份时会重新备份
+        # mysqldump 导出时没有精确行数，记录 information_schema 中的估算值
+        manifest = plan['manifest']
+        if self.s3_url:
+            table_files = {name: sorted(stats['hashes']) for name, stats in table_stats.items()}
+        else:
+            table_files = group_files_by_table(self.db_backup_dir)
+        for table_name in plan['tables']:
+            if table_name not in failed_tables:
+                stats = table_stats.get(table_name, {'rows': None, 'seconds': 0.0, 'hashes': {}})
+                rows_exact = stats['rows'] is not None
+                manifest['tables'][table_name] = {
+                    'fingerprint': plan['fingerprints'].get(table_name), 'files': table_files.get(table_name, []),
+                    'ref': None, 'bytes': sum(size for size, _ in stats['hashes'].values()),
+                    'rows': stats['rows'] if rows_exact else plan['table_rows'].get(table_name, 0),
+                    'rows_exact': rows_exact, 'seconds': round(stats['seconds'], 3),
+                    'hashes': {name: digest for name, (_, digest) in stats['hashes'].items()}}
+
+        # 输出备份完成信息
+        clogger.info("备份完成！")
+        end_time = time.time()
+        manifest['seconds'] = round(end_time - start_time, 3)
+        write_manifest(self.db_backup_dir, manifest)
+        self.write_metrics('backup', self.db_backup_dir, os.path.join(self.db_backup_dir, REPORT_NAME), task_metrics,
+                           end_time - start_time, failed_tables)
+        if self.s3_url:
+            self.upload_metadata()
+        if not failed_tables:
+            # 全部完成后清单已包含所有信息，不再需要进度日志
+            os.remove(journal_path)
+            shutil.rmtree(partial_dir, ignore_errors=True)
+        else:
+            clogger.info(f"可使用 --resume {self.db_backup_dir} 重新备份失败的表")
+        clogger.info(f"备份总共耗时：{end_time - start_time:.2f}秒")
+
+    def upload_metadata(self):
+        # 清单和性能报告随备份文件一起上传，从对象存储还原和校验时读取；失败的任务已上传的分段不再需要
+        for name in (MANIFEST_NAME, REPORT_NAME):
+            if os.path.exists(os.path.join(self.db_backup_dir, name)):
+                object_store.upload_file(os.path.join(self.db_backup_dir, name),
+                                         object_store.join_url(self.object_dir(), name))
+        count = object_store.abort_incomplete(self.object_dir())
+        if count:
+            clogger.info(f"已放弃 {count} 个未完成的分段上传")
+        clogger.info(f"备份已上传到 {self.object_dir()}")
+
+    def write_metrics(self, kind, location, report_path, task_metrics, seconds, failed_tables, stored_sizes=None):
+        """
+        写入本次运行的性能报告，配置了 prometheus_textfile 时同时写入 Prometheus 指标
+
+        :param kind: backup 或 restore
+        :param location: 备份目录或压缩包路径
+        :param report_path: 报告文件路径
+        :param task_metrics: 本次运行完成的任务的指标
+        :param seconds: 本次运行的总耗时
+        :param failed_tables: 失败的表名列表
+        :param stored_sizes: {任务名: 备份文件字节数}
+        """
+        report = build_report(kind, self.database, location, task_metrics, seconds, self.max_workers, failed_tables,
+                              stored_sizes)
+        try:
+            write_report(report_path, report)
+            if self.prometheus_textfile:
+                write_prometheus(self.prometheus_textfile, report)
+        except OSError as em:
+            clogger.warning(f"写入性能报告失败：{em}")
+            return
+        clogger.info(f"性能报告：{report_path}，{report['mb_per_s']}MB/s，并发利用率 {report['worker_utilization']}")
+
+    def pool_backup(self, task_names, tasks, controller=None, task_sizes=None):
+        """
+        使用进程池执行备份任务
+
+        :param controller: 自适应并发控制器，为空时任务全部提交给进程池
+        :param task_sizes: {任务名: (估算字节数, 估算行数)}，进度按字节数前进
+
+        :return: 备份结果列表 [(表名, 是否成功, 统计信息或失败原因)]
+        """
         with multiprocessing.Manager() as manager:
             # 创建共享队列
-            table_queue = manager.Queue(len(tables))
+            table_queue = manager.Queue(len(task_names))
             # 将任务放入队列
-            for table_name in tables:
-                table_queue.put(table_name)
+            for task_name in task_names:
+                table_queue.put(tasks[task_name])
 
             # 创建一个共享队列，用于存储备份结果
             result_queue = multiprocessing.Manager().Queue()
 
-            # 创建进程池，并启动若干个子进程
-            pool = multiprocessing.Pool(processes=self.max_workers)
+            # 创建进程池，并启动若干个子进程，子进程启用与主进程共享的限速配额
+            pool = self.backup_pool()
             backup_threads = []
             while not table_queue.empty():
                 try:
                     # 从任务队列中取出一个表名
-                    table_name = table_queue.get(timeout=1)
+                    table_name, part, where = table_queue.get(timeout=1)
+                    if controller:
+                        # 自适应并发时等待运行中的任务数低于当前并发数
+                        controller.wait_slot(backup_threads)
                     # 立即启动一个子进程进行备份操作
-                    backup_thread = pool.apply_async(self.backup_table, args=(table_name, result_queue))
+                    backup_thread = pool.apply_async(call, args=(0, 'backup_table', table_name, result_queue, part,
+                                                                 where))
                     backup_threads.append(backup_thread)
                 except Empty:
                     break
 
             # 等待所有子进程完成备份操作
-            for backup_thread in tqdm(backup_threads, desc="备份进度", ncols=80):
-                backup_thread.get()
+            bar, steps = progress_bar([(task_sizes or {}).get(name, (0,))[0] for name in task_names], "备份进度")
+            with bar:
+                for backup_thread, step in zip(backup_threads, steps):
+                    backup_thread.get()
+                    bar.update(step)
+            # 子进程退出时结束各自的快照事务
+            pool.close()
+            pool.join()
 
-            # 处理备份结果，记录日志
-            success_tables = []
-            failed_tables = []
+            results = []
             while not result_queue.empty():
-                table_name, success, info = result_queue.get()
-                if success:
-                    success_tables.append(table_name)
-                    # clogger.info(f"表 {table_name} 备份成功，备份文件为 {info}")
-                else:
-                    failed_tables.append(table_name)
-                    clogger.error(f"表 {table_name} 备份失败，失败原因：{info}")
+                results.append(result_queue.get())
+            return results
 
-            if failed_tables:
-                clogger.warning(f"{len(failed_tables)} 张表备份失败：{', '.join(failed_tables)}")
-            else:
-                clogger.info("所有表备份成功！")
+    def backup_pool(self):
+        """
+        创建备份进程池，子进程启用与主进程共享的限速配额；
+        一致性快照时等每个子进程都建立连接后才加全局读锁，子进程开启快照后立即释放
+        """
+        if not self.consistent_snapshot:
+            return create_pool(self.max_workers, (self,), init_backup_worker,
+                               (throttle.installed(), self.low_priority, connections.installed()))
+        with snapshot.SnapshotLock(self.connect_kwargs()) as lock:
+            pool = create_pool(self.max_workers, (self,), init_backup_worker,
+                               (throttle.installed(), self.low_priority, connections.installed(), lock.worker_args()))
+            try:
+                self.snapshot_position = lock.wait_workers(self.max_workers)
+            except Exception:
+                pool.terminate()
+                raise
+        clogger.info(f"{self.max_workers} 个连接已开启一致性快照，binlog 位置：{self.snapshot_position}")
+        return pool
 
-        # 输出备份完成信息
-        clogger.info("备份完成！")
-        end_time = time.time()
-        clogger.info(f"备份总共耗时：{end_time - start_time:.2f}秒")
+    async def async_backup(self, task_names, tasks, controller=None, task_sizes=None):
+        """
+        在一个事件循环中并发执行备份任务，不创建进程池和 Manager 进程
+
+        :param controller: 自适应并发控制器，为空时并发数固定为 max_workers
+        :param task_sizes: {任务名: (估算字节数, 估算行数)}，进度按字节数前进
+
+        :return: 备份结果列表 [(表名, 是否成功, 统计信息或失败原因)]
+        """
+        if self.consistent_snapshot:
+            # 在主进程中开启 max_workers 个快照连接，线程中执行的任务轮流使用；连接在加锁之前建立
+            with snapshot.SnapshotLock(self.connect_kwargs()) as lock:
+                cnxs = [mysql.connector.connect(**self.connect_kwargs()) for _ in range(self.max_workers)]
+                self.snapshot_position = lock.snapshot(cnxs)
+            clogger.info(f"{self.max_workers} 个连接已开启一致性快照，binlog 位置：{self.snapshot_position}")
+        try:
+            return await run_all([self.async_backup_table(*tasks[name]) for name in task_names], "备份进度",
+                                 self.max_workers, controller,
+                                 weights=[(task_sizes or {}).get(name, (0,))[0] for name in task_names])
+        finally:
+            snapshot.close_all()
+
+    async def async_backup_table(self, table_name, part=None, where=None):
+        """
+        直接执行 mysqldump 备份表或分片，进程内导出的引擎和 tab 格式在线程中执行
+
+        :return: (表名, 是否成功, 统计信息或失败原因)
+        """
+        if self.dump_engine == 'native' or self.backup_format == 'tab':
+            result, _ = await run_in_thread(lambda q: self.backup_table(table_name, q, part, where))
+            return result
+        try:
+            connections.check_breaker(self.connect_kwargs())
+            start_time = time.time()
+            file_name = table_name + '.sql' if part is None else part_file_name(table_name, part)
+            metrics = TaskMetrics(os.path.splitext(file_name)[0], table_name)
+            # 不压缩、不限速时 mysqldump 直接写文件，否则在线程中边读边压缩和限速
+            piped = self.piped_dump()
+            out, backup_file = self.open_backup_writer(os.path.join(self.db_backup_dir, PARTIAL_DIR, file_name),
+                                                       metrics if piped else None)
+            with out:
+                sink = (lambda src: shutil.copyfileobj(src, out, COPY_BUFFER)) if piped else out
+                recode, err = await run_process(self.mysqldump_args(table_name, part, where), self.db_cwd,
+                                                self.task_timeout, stdout=sink,
+                                                **(throttle.low_priority_kwargs() if self.low_priority else {}))
+            connections.record_client_result(recode, err, self.connect_kwargs())
+            if recode != 0:
+                raise RuntimeError(f"mysqldump 返回码为 {recode}：{err}")
+            info = self.finish_backup_task(table_name, part, [backup_file], None, time.time() - start_time, metrics)
+            return table_name, True, info
+        except Exception as ea:
+            clogger.error(f"表 {table_name} 备份失败：{ea}")
+            return table_name, False, str(ea)
 
-    def restore_table(self, restore_dir, table_name, result_queue):
-        # 将备份文件恢复到数据表
+    def mysqldump_args(self, table_name, part=None, where=None):
+        # mysqldump 命令的参数列表，不经过 shell 直接执行
+        #  --routines 用于在备份时同时备份存储过程和函数等程序性对象。
+        args = [find_executable(self.mysql_exe, self.db_cwd), '-u', self.username, f'-p{self.password}',
+                '-h', self.hostname, '-P', str(self.port)] + self.ex_args
+        if part == 0:
+            # 触发器单独导出，否则先于数据创建，导入每一行时都会执行，后续分片还会重复创建
+            args += ['--no-data', '--skip-triggers']
+        elif part == TRIGGER_PART:
+            # 只导出触发器，在所有数据分片之后还原
+            args += ['--no-data', '--no-create-info']
+        elif part is not None:
+            # 分片并行还原时不能锁表，也不需要每个分片各自重建索引
+            args += ['--no-create-info', '--skip-triggers', '--skip-add-locks', '--skip-disable-keys',
+                     f'--where={where}']
+        if self.low_priority:
+            args = throttle.low_priority_args() + args
+        return args + [self.database, table_name]
+
+    def plan_backup(self):
+        """
+        生成备份计划: 需要备份的表、按主键范围切分的分片和初始清单
+
+        计划写入进度日志，继续中断的备份时沿用同一计划。
+
+        :return: {'manifest', 'fingerprints', 'tables', 'table_rows', 'tasks', 'task_sizes'}
+        """
+        # 获取所有表的名称
+        cnx = connections.connect(self.connect_kwargs(), self.connect_retries, self.connect_retry_delay)
+        cursor = cnx.cursor()
+        cursor.execute("SHOW TABLES")
+        tables = [table[0] for table in cursor]
+        cursor.close()
+        table_sizes = get_table_sizes(cnx, self.database)
+        manifest = new_manifest(self.database)
+        # 只有一致性快照模式下所有表来自同一时刻，全局读锁期间的 binlog 位置在备份完成后写入清单，
+        # 按时间点恢复时从这里开始重放；否则各表的导出时刻不同，开始导出前的位置只作参考，记录在 binlog_reference 中
+        manifest['binlog'] = None
+        if not self.consistent_snapshot:
+            try:
+                position = binlog.get_binlog_position(cnx)
+            except mysql.connector.Error as eb:
+                clogger.warning(f"无法读取 binlog 位置：{eb}")
+                position = None
+            manifest['binlog_reference'] = position and dict(position, consistent=False)
+            if os.path.isdir(self.binlog_dir):
+                clogger.warning("未开启 consistent_snapshot，各表在不同时刻导出，该备份不能用于按时间点恢复")
+        fingerprints = {}
+        if self.incremental:
+            tables, fingerprints = self.reuse_unchanged_tables(cnx, tables, manifest)
+        # 生成备份任务，超过分片大小的表按主键范围切分为多个分片
+        tasks = {}
+        task_sizes = {}
+        for table_name in tables:
+            table_bytes, table_rows = table_sizes.get(table_name, (0, 0))
+            wheres = plan_chunks(cnx, self.database, table_name, table_bytes, self.chunk_size)
+            if wheres is None:
+                tasks[table_name] = (table_name, None, None)
+                task_sizes[table_name] = (table_bytes, table_rows)
+                continue
+            clogger.info(f"表 {table_name} 切分为 {len(wheres)} 个分片备份")
+            tasks[part_file_name(table_name, 0)] = (table_name, 0, None)
+            for part, where in enumerate(wheres, start=1):
+                task_name = part_file_name(table_name, part)
+                tasks[task_name] = (table_name, part, where)
+                task_sizes[task_name] = (table_bytes // len(wheres), table_rows // len(wheres))
+            tasks[part_file_name(table_name, TRIGGER_PART)] = (table_name, TRIGGER_PART, None)
+        cnx.close()
+        return {'manifest': manifest, 'fingerprints': fingerprints, 'tables': tables,
+                'table_rows': {name: rows for name, (_, rows) in table_sizes.items()}, 'tasks': tasks,
+                'task_sizes': task_sizes}
+
+    def reuse_unchanged_tables(self, cnx, tables, manifest):
+        """
+        对比上一次备份清单中的指纹，复用未变化的表
+
+        :param cnx: mysql.connector 连接
+        :param tables: 所有表名
+        :param manifest: 本次备份的清单，复用的表写入其中
+        :return: (需要重新备份的表名列表, 本次计算的指纹)
+        """
+        fingerprints = get_fingerprints(cnx, self.database, tables, self.incremental_check)
+        previous_dir, previous = find_previous_backup(self.backup_dir, self.db_backup_dir, self.database)
+        if previous is None:
+            clogger.info("未找到上一次备份的清单，本次为完整备份")
+            return tables, fingerprints
+        manifest['parent'] = os.path.basename(previous_dir)
+        changed_tables = []
+        for table_name in tables:
+            previous_entry = previous['tables'].get(table_name)
+            if table_name in fingerprints and previous_entry \
+                    and previous_entry.get('fingerprint') == fingerprints[table_name]:
+                entry = reuse_table(self.backup_dir, previous_dir, previous_entry, self.db_backup_dir)
+                if entry is not None:
+                    manifest['tables'][table_name] = entry
+                    continue
+            changed_tables.append(table_name)
+        clogger.info(f"增量备份：{len(tables) - len(changed_tables)} 张表未变化，复用 {previous_dir}，"
+                     f"{len(changed_tables)} 张表需要备份")
+        return changed_tables, fingerprints
+
+    def restore_session_sql(self):
+        """
+        还原会话的设置语句，快速还原时关闭唯一性检查和 binlog 写入
+        """
+        # 数据文件之间没有顺序，关闭外键检查
+        statements = ["SET SESSION foreign_key_checks = 0"]
+        if self.fast_restore:
+            statements.append("SET SESSION unique_checks = 0")
+            if self.skip_binlog:
+                statements.append("SET SESSION sql_log_bin = 0")
+        return statements
+
+    def restore_table(self, restore_dir, table_name, result_queue, file_name=None):
+        """
+        将备份文件恢复到数据表，压缩的备份文件和 7z 压缩包中的文件边解压边还原
+
+        :param restore_dir: 备份目录或 .7z 压缩包路径
+        :param file_name: 备份文件名，默认为表名加上后缀 .sql
+
+        :return: 快速还原时从建表语句中移除的 {表名: (二级索引定义, 外键定义)}
+        """
+        deferred = {}
+        metrics = TaskMetrics(f"{table_name}.sql", parse_part_file(f"{table_name}.sql")[0], residual='load')
         try:
-            backup_path = os.path.join(restore_dir, f"{table_name}.sql")  # 备份文件名为表名加上后缀 .sql
-            if not os.path.exists(backup_path):
+            # mysql 命令行每次单独登录，无法复用连接，熔断后直接跳过
+            connections.check_breaker(self.connect_kwargs())
+            file_name = file_name or f"{table_name}.sql"  # 备份文件名为表名加上后缀 .sql
+            backup_path = os.path.join(restore_dir, file_name)
+            from_archive = not os.path.isdir(restore_dir)
+            if not from_archive and not os.path.exists(backup_path):
                 raise Exception(f"数据表 {table_name} 的备份文件不存在！")
 
-            # 使用 mysql 命令行工具恢复数据表
-            cmd = f"mysql -u {self.username} -p{self.password} " \
-                  f"-h {self.hostname} -P {self.port} {self.database}"
-            cmd = f'{cmd} < {backup_path}'
-            restore_cmd = f"{cmd} < {backup_path}"
-            recode = subprocess.call(restore_cmd, shell=True, cwd=self.db_cwd)
+            # 使用 mysql 命令行工具恢复数据表，以参数列表形式执行，密码不经过 shell
+            args = self.mysql_args()
+            # 错误输出写入临时文件，用于判断是否为连接类错误并更新熔断器
+            with tempfile.TemporaryFile() as err_file:
+                if self.fast_restore or from_archive or strip_codec_ext(file_name)[1] or self.resuming:
+                    with open_backup_text(restore_dir, file_name) as f:
+                        lines = rewrite_create_tables(f, deferred) if self.fast_restore else f
+                        # 继续中断的还原时，未完成的文件可能已导入部分行
+                        lines = replace_inserts(lines) if self.resuming else lines
+                        recode = self.pipe_restore(args, lines, err_file)
+                else:
+                    with open(backup_path, 'rb') as f:
+                        recode = subprocess.call(args, cwd=self.db_cwd, stdin=f, stderr=err_file)
+                err_file.seek(0)
+                err = err_file.read().decode('gbk', errors='replace')
+            connections.record_client_result(recode, err, self.connect_kwargs())
             if recode == 0:
-                result_queue.put((table_name, True))
+                append_checkpoint(self.checkpoint_path, {'unit': f"{table_name}.sql", 'deferred': deferred})
+                result_queue.put((table_name, True, metrics.finish()))
                 # print(f"数据表 {table_name} 还原成功！")
             else:
-                error_msg = f"恢复数据表 {table_name} 失败，返回码为 {recode}"
-                raise subprocess.CalledProcessError(recode, restore_cmd, error_msg)
+                raise RuntimeError(f"恢复数据表 {table_name} 失败，返回码为 {recode}：{err}")
         except Exception as er:
             result_queue.put((table_name, False, str(er)))
+        return deferred
+
+    def mysql_args(self):
+        # mysql 命令行还原的参数列表，不经过 shell 直接执行
+        return [find_executable('mysql', self.db_cwd), '-u', self.username, f'-p{self.password}',
+                '-h', self.hostname, '-P', str(self.port), self.database]
+
+    def pipe_restore(self, args, lines, stderr=None):
+        """
+        在还原会话设置之后，将 SQL 文本逐行经标准输入交给 mysql 命令行执行
+
+        :param args: mysql 命令的参数列表
+        :param lines: 可迭代的 SQL 文本行
+        :param stderr: mysql 命令的错误输出文件，为空时输出到终端
+        :return: mysql 命令的返回码
+        """
+        process = subprocess.Popen(args, cwd=self.db_cwd, stdin=subprocess.PIPE, stderr=stderr)
+        try:
+            self.write_restore_sql(process.stdin, lines)
+        except BrokenPipeError:
+            # mysql 提前退出，返回码中包含失败原因
+            pass
+        finally:
+            process.stdin.close()
+        return process.wait()
+
+    def write_restore_sql(self, stdin, lines):
+        # 先写入还原会话设置，再写入备份文件的内容
+        for sql in self.restore_session_sql():
+            stdin.write(f"{sql};\n".encode())
+        for line in lines:
+            stdin.write(line.encode('utf-8', errors='surrogateescape'))
+
+    def load_table(self, restore_dir, file_stem, result_queue, file_name=None):
+        # 使用 LOAD DATA LOCAL INFILE 将 tab 格式的数据文件导入数据表
+        cnx = None
+        metrics = TaskMetrics(f"{file_stem}.txt", parse_part_file(f"{file_stem}.txt")[0], residual='load')
+        try:
+            file_name = file_name or f"{file_stem}.txt"
+            table_name = parse_part_file(f"{file_stem}.txt")[0]
+            with metrics.phase('connect'):
+                cnx = self.acquire_connection(allow_local_infile=True)
+            cursor = cnx.cursor()
+            for sql in self.restore_session_sql():
+                cursor.execute(sql)
+            cursor.close()
+            # 数据文件中的 TIMESTAMP 值为导出时的 UTC 时间
+            set_utc_session(cnx)
+            # 压缩的数据文件和 7z 压缩包中的文件边解压边导入
+            if os.path.isdir(restore_dir):
+                data_file = plain_path(os.path.join(restore_dir, file_name))
+            else:
+                data_file = plain_path(file_name, lambda: open_backup_reader(restore_dir, file_name))
+            with data_file as data_path:
+                load_tab_file(cnx, table_name, get_dump_columns(cnx, table_name), data_path, replace=self.resuming)
+            append_checkpoint(self.checkpoint_path, {'unit': f"{file_stem}.txt"})
+            result_queue.put((file_stem, True, metrics.finish()))
+        except Exception as el:
+            result_queue.put((file_stem, False, str(el)))
+        finally:
+            if cnx is not None:
+                self.release_connection(cnx, allow_local_infile=True)
+
+    def add_deferred_keys(self, table_name, definitions, result_queue, unit):
+        # 数据导入完成后一次性补建一张表的二级索引或外键
+        cnx = None
+        metrics = TaskMetrics(unit, table_name, residual='index')
+        try:
+            with metrics.phase('connect'):
+                cnx = self.acquire_connection()
+            cursor = cnx.cursor()
+            for sql in self.restore_session_sql():
+                cursor.execute(sql)
+            cursor.execute(alter_table_sql(table_name, definitions))
+            cursor.close()
+            append_checkpoint(self.checkpoint_path, {'unit': unit})
+            result_queue.put((table_name, True, metrics.finish()))
+        except Exception as ek:
+            result_queue.put((table_name, False, f"数据表 {table_name} 补建索引或外键失败：{ek}"))
+        finally:
+            if cnx is not None:
+                self.release_connection(cnx)
+
+    def restore_all_tables(self, restore_dir, tables=None, resume=False):
+        """
+        并行还原备份目录、7z 压缩包或 dbbp 归档中的所有表
 
-    def restore_all_tables(self, restore_dir):
+        :param restore_dir: 备份目录、.7z 压缩包、.dbbp 归档路径或对象存储中的备份 s3://桶/路径/备份名，
+                            压缩包和对象存储中的文件直接流式读取还原，不需要先下载或解压到磁盘
+        :param tables: 只还原这些表，支持通配符，为空时还原全部
+        :param resume: 继续一次中断的还原，跳过进度日志中已完成的文件，未完成的文件以覆盖方式重新导入
+        :return: 还原失败的表名列表，没有可还原的文件时返回 None
+        """
         start_time = time.time()
-        # 获取备份文件名列表
-        backup_files = [f for f in os.listdir(restore_dir) if
-                        os.path.isfile(os.path.join(restore_dir, f)) and f.endswith('.sql')]
-        if not backup_files:
+        # 进度日志放在备份目录或压缩包旁边，压缩包本身是只读的
+        self.checkpoint_path = restore_journal_path(self.local_location(restore_dir))
+        self.resuming = resume
+        records = read_checkpoints(self.checkpoint_path) if resume else []
+        if not resume and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        done_units = {r['unit'] for r in records}
+        if done_units:
+            clogger.info(f"跳过已完成的 {len(done_units)} 个文件或索引")
+        # 获取备份文件名列表，增量备份中以引用方式复用的文件从被引用的备份目录读取
+        file_sizes = list_backup_files(restore_dir)
+        if os.path.isdir(restore_dir):
+            file_sizes.update(referenced_files(restore_dir))
+        if not file_sizes:
             print(f"备份目录 '{restore_dir}' 中未找到任何备份文件！")
             return
+        # 压缩的备份文件按去掉压缩扩展名和压缩包内目录后的文件名调度
+        plain_files = {os.path.basename(strip_codec_ext(f)[0].replace('\\', '/')): f for f in file_sizes}
+        if tables:
+            plain_files = {k: v for k, v in plain_files.items() if match_patterns(parse_part_file(k)[0], tables)}
+            if not plain_files:
+                print(f"备份 '{restore_dir}' 中未找到表 {', '.join(tables)} 的备份文件！")
+                return
+        # 按文件大小由大到小排序
+        backup_files = lpt_order(list(plain_files), {k: (file_sizes[v], 0) for k, v in plain_files.items()})
+
+        # 快速还原时记录建表语句中移除的二级索引和外键，中断前已建的表从进度日志中读取
+        resumed_deferred = {}
+        for record in records:
+            resumed_deferred.update(record.get('deferred') or {})
+        # 按优先级分层，一层的表(包括补建的索引和外键)全部还原后才开始下一层，核心表最先可用
+        tiers = assign_tiers(backup_files, self.restore_tiers, lambda f: parse_part_file(f)[0])
+        breaker = connections.CircuitBreaker(self.circuit_breaker_failures)
+        connections.install(breaker)
+        results = []
+        try:
+            for index, tier_files in enumerate(tiers):
+                if not tier_files and index == len(tiers) - 1:
+                    continue
+                deferred = {name: keys for name, keys in resumed_deferred.items()
+                            if tier_index(name, self.restore_tiers) == index}
+                tier_results = []
+                if tier_files:
+                    tier_results = self.restore_files(restore_dir, tier_files, plain_files, file_sizes, deferred,
+                                                      done_units)
+                results += tier_results
+                if self.restore_tiers:
+                    self.tier_complete(index + 1, {parse_part_file(f)[0] for f in tier_files}, tier_results)
+        finally:
+            connections.install()
+            connections.close_all()
+        if breaker.is_open():
+            clogger.error("无法连接数据库，本次还原提前结束")
+
+        # 处理还原结果
+        success_tables = []
+        failed_tables = []
+        for table_name, success, message in results:
+            if success:
+                success_tables.append(table_name)
+            else:
+                failed_tables.append(table_name)
+                clogger.info(message)
+
+        end_time = time.time()
+        # 成功的任务返回各自的指标
+        task_metrics = [info for _, success, info in results if success and isinstance(info, dict)]
+        self.write_metrics('restore', restore_dir, self.local_location(restore_dir) + RESTORE_REPORT_EXT, task_metrics,
+                           end_time - start_time, failed_tables,
+                           {name: file_sizes[file_name] for name, file_name in plain_files.items()})
+        if failed_tables:
+            print(f"还原失败的数据表：{', '.join(failed_tables)}")
+            clogger.info(f"可使用 --resume {restore_dir} 继续还原")
+        else:
+            print("所有数据表都已成功恢复！")
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+        clogger.info(f"备份总共耗时：{end_time - start_time:.2f}秒")
+        return failed_tables
+
+    def local_location(self, location):
+        # 对象存储中的备份在本地备份目录中按备份名记录还原进度和性能报告
+        if object_store.is_object_url(location):
+            return os.path.join(self.backup_dir, location.rstrip('/').rsplit('/', 1)[-1])
+        return os.path.normpath(location)
+
+    def restore_files(self, restore_dir, backup_files, plain_files, file_sizes, deferred, done_units):
+        """
+        还原一组备份文件: 先建表，再导入数据，最后补建二级索引和外键以及分片表的触发器
+
+        :param backup_files: 去掉压缩扩展名的文件名列表，按大小由大到小排列
+        :param plain_files: {去掉压缩扩展名的文件名: 备份文件名}
+        :param file_sizes: {备份文件名: 字节数}
+        :param deferred: 中断前已建的表移除的 {表名: (二级索引定义, 外键定义)}，本组新建的表也记录在其中
+        :param done_units: 进度日志中已完成的文件和索引
+        :return: 还原结果列表 [(表名, 是否成功, 失败原因)]
+        """
+        # 分片表的表结构(.0000.sql)和 tab 格式的表结构(.sql)必须先于数据文件还原
+        schema_files, data_files = split_schema_files(backup_files)
+        schema_files = [f for f in schema_files if f not in done_units]
+        data_files = [f for f in data_files if f not in done_units]
+        # 分片表的触发器在所有数据分片导入之后创建
+        trigger_files = [f for f in data_files if parse_part_file(f)[1] == TRIGGER_PART]
+        data_files = [f for f in data_files if f not in trigger_files]
+        # 超过拆分大小的 .sql 数据文件(如整库导出的单个文件)单独拆分为语句流并行导入，
+        # 拆分导入先于建表执行，表结构尚未还原的数据分片仍由进程池在建表之后导入
+        split_size = self.split_sql_mb * 1024 * 1024
+        pending_tables = {parse_part_file(f)[0] for f in schema_files}
+        split_files = [f for f in data_files
+                       if split_size and f.endswith('.sql') and file_sizes[plain_files[f]] >= split_size
+                       and not (parse_part_file(f)[1] and parse_part_file(f)[0] in pending_tables)]
+        data_files = [f for f in data_files if f not in split_files]
+        results = []
+        for backup_file in split_files:
+            result, keys = self.replay_split_file(restore_dir, backup_file, plain_files[backup_file])
+            results.append(result)
+            deferred.update(keys)
+        with self.concurrency_controller('Bytes_received') as controller:
+            if self.executor == 'asyncio':
+                results += asyncio.run(self.async_restore(restore_dir, schema_files, data_files, plain_files,
+                                                          deferred, done_units, controller, file_sizes))
+            else:
+                results += self.pool_restore(restore_dir, schema_files, data_files, plain_files, deferred,
+                                             done_units, controller, file_sizes)
+        trigger_queue = Queue()
+        for backup_file in trigger_files:
+            self.restore_table(restore_dir, os.path.splitext(backup_file)[0], trigger_queue, plain_files[backup_file])
+        results += [trigger_queue.get() for _ in trigger_files]
+        return results
+
+    def tier_complete(self, tier, tables, results):
+        """
+        记录一层还原完成，配置了 tier_hook 时执行该命令
+
+        :param tier: 层序号，从 1 开始，不匹配任何一层的表为最后一层
+        :param tables: 该层的表名
+        :param results: 该层的还原结果
+        """
+        failed = sorted({name for name, success, _ in results if not success})
+        clogger.info(f"第 {tier} 层还原完成：{len(tables)} 张表，{len(failed)} 个失败")
+        if not self.tier_hook:
+            return
+        env = dict(os.environ, DBBP_TIER=str(tier), DBBP_TIER_TABLES=','.join(sorted(tables)),
+                   DBBP_TIER_FAILED=','.join(failed))
+        recode = subprocess.call(self.tier_hook, shell=True, env=env)
+        if recode != 0:
+            clogger.warning(f"第 {tier} 层的完成命令返回码为 {recode}")
+
+    def replay_split_file(self, restore_dir, plain_name, file_name):
+        """
+        将一个大 .sql 文件拆分为语句流，INSERT 语句由 max_workers 个连接并行导入，DDL 按文件中的顺序在数据之前执行
 
+        :param plain_name: 去掉压缩扩展名的文件名
+        :param file_name: 备份文件名
+        :return: ((表名, 是否成功, 失败原因), 快速还原时移除的 {表名: (二级索引定义, 外键定义)})
+        """
+        table_name = os.path.splitext(plain_name)[0]
+        deferred = {}
+        metrics = TaskMetrics(plain_name, parse_part_file(plain_name)[0], residual='load')
+        try:
+            start_time = time.time()
+            clogger.info(f"拆分 {plain_name} 为语句流，由 {self.max_workers} 个连接并行导入")
+            with open_backup_text(restore_dir, file_name) as f:
+                lines = rewrite_create_tables(f, deferred) if self.fast_restore else f
+                lines = replace_inserts(lines) if self.resuming else lines
+                # 会话设置会改变连接状态，不使用连接池中的连接
+                count = replay_statements(
+                    split_statements(lines),
+                    lambda: connections.connect(self.connect_kwargs(), self.connect_retries, self.connect_retry_delay),
+                    self.max_workers, self.restore_session_sql())
+            clogger.info(f"{plain_name} 共 {count} 条语句，耗时：{time.time() - start_time:.2f}秒")
+            append_checkpoint(self.checkpoint_path, {'unit': plain_name, 'deferred': deferred})
+            return (table_name, True, metrics.finish()), deferred
+        except Exception as es:
+            return (table_name, False, f"并行导入 {plain_name} 失败：{es}"), deferred
+
+    def pool_restore(self, restore_dir, schema_files, data_files, plain_files, deferred, done_units,
+                     controller=None, file_sizes=None):
+        """
+        使用进程池依次执行建表、导入数据和补建索引外键
+
+        :param controller: 自适应并发控制器，导入数据和补建索引外键时按其当前并发数提交任务
+        :param file_sizes: {备份文件名: 字节数}，导入数据的进度按字节数前进
+
+        :return: 还原结果列表 [(表名, 是否成功, 失败原因)]
+        """
+        start_time = time.time()
         # 初始化一个共享队列和任务队列
         result_queue = multiprocessing.Manager().Queue()
         task_queue = multiprocessing.Manager().Queue()
-        for backup_file in backup_files:
-            table_name = os.path.splitext(backup_file)[0]
-            task_queue.put(table_name)
+        for backup_file in data_files:
+            task_queue.put(backup_file)
 
         # 创建进程池，启动若干个子进程进行还原操作
-        pool = multiprocessing.Pool(processes=self.max_workers)
-        restore_threads = []
+        # 子进程共用主进程的熔断器，各自保留空闲连接供后续任务复用
+        pool = create_pool(self.max_workers, (self,), connections.install, (connections.installed(),))
+        schema_threads = [pool.apply_async(call, args=(0, 'restore_table', restore_dir, os.path.splitext(f)[0],
+                                                       result_queue, plain_files[f]))
+                          for f in schema_files]
+        for schema_thread in schema_threads:
+            deferred.update(schema_thread.get() or {})
+        restore_threads = []  # [(AsyncResult, 文件字节数)]
         while not task_queue.empty():
             try:
-                table_name = task_queue.get(timeout=1)
-                restore_thread = pool.apply_async(self.restore_table, args=(restore_dir, table_name, result_queue))
-                restore_threads.append(restore_thread)
+                backup_file = task_queue.get(timeout=1)
+                table_name, ext = os.path.splitext(backup_file)
+                # .txt 数据文件使用 LOAD DATA 导入，.sql 文件使用 mysql 命令行还原
+                restore_func = 'load_table' if ext == '.txt' else 'restore_table'
+                if controller:
+                    controller.wait_slot([thread for thread, _ in restore_threads])
+                restore_thread = pool.apply_async(call, args=(0, restore_func, restore_dir, table_name, result_queue,
+                                                              plain_files[backup_file]))
+                restore_threads.append((restore_thread, (file_sizes or {}).get(plain_files[backup_file], 0)))
             except Exception as ef:
                 print(ef)
 
         # 等待所有子进程完成工作
-        for restore_thread in tqdm(restore_threads, desc="还原进度", ncols=80):
-            restore_thread.get()
+        bar, steps = progress_bar([size for _, size in restore_threads], "还原进度")
+        with bar:
+            for (restore_thread, _), step in zip(restore_threads, steps):
+                deferred.update(restore_thread.get() or {})
+                bar.update(step)
+        clogger.info(f"建表及导入数据耗时：{time.time() - start_time:.2f}秒")
 
-        # 处理还原结果
-        success_tables = []
-        failed_tables = []
+        # 所有数据导入后并行补建二级索引，再补建外键，外键依赖被引用表上的索引
+        for phase, index in (("二级索引", 0), ("外键", 1)):
+            phase_start = time.time()
+            phase_threads = []
+            for name, keys in deferred.items():
+                if keys[index] and f"{phase}:{name}" not in done_units:
+                    if controller:
+                        controller.wait_slot(phase_threads)
+                    phase_threads.append(pool.apply_async(call, args=(0, 'add_deferred_keys', name, keys[index],
+                                                                      result_queue, f"{phase}:{name}")))
+            if not phase_threads:
+                continue
+            bar, steps = progress_bar([0] * len(phase_threads), f"{phase}进度")
+            with bar:
+                for phase_thread, step in zip(phase_threads, steps):
+                    phase_thread.get()
+                    bar.update(step)
+            clogger.info(f"创建{phase}耗时：{time.time() - phase_start:.2f}秒")
+        # 子进程退出时关闭各自保留的连接
+        pool.close()
+        pool.join()
+
+        results = []
         while not result_queue.empty():
-            table_name, success, message = result_queue.get()
-            if success:
-                success_tables.append(table_name)
+            results.append(result_queue.get())
+        return results
+
+    async def async_restore(self, restore_dir, schema_files, data_files, plain_files, deferred, done_units,
+                            controller=None, file_sizes=None):
+        """
+        在一个事件循环中依次执行建表、导入数据和补建索引外键，每个阶段内并发执行
+
+        :param controller: 自适应并发控制器，为空时并发数固定为 max_workers
+        :param file_sizes: {备份文件名: 字节数}，导入数据的进度按字节数前进
+
+        :return: 还原结果列表 [(表名, 是否成功, 失败原因)]
+        """
+        start_time = time.time()
+        results = []
+        for phase_files, desc in ((schema_files, "建表进度"), (data_files, "还原进度")):
+            weights = [(file_sizes or {}).get(plain_files[f], 0) for f in phase_files]
+            for result, keys in await run_all([self.async_restore_file(restore_dir, f, plain_files[f])
+                                               for f in phase_files], desc, self.max_workers, controller,
+                                              weights=weights):
+                results.append(result)
+                deferred.update(keys or {})
+        clogger.info(f"建表及导入数据耗时：{time.time() - start_time:.2f}秒")
+
+        # 所有数据导入后并行补建二级索引，再补建外键，外键依赖被引用表上的索引
+        for phase, index in (("二级索引", 0), ("外键", 1)):
+            phase_start = time.time()
+            coros = [run_in_thread(functools.partial(self.add_deferred_keys, name, keys[index],
+                                                     unit=f"{phase}:{name}"))
+                     for name, keys in deferred.items() if keys[index] and f"{phase}:{name}" not in done_units]
+            if not coros:
+                continue
+            results += [result for result, _ in await run_all(coros, f"{phase}进度", self.max_workers, controller)]
+            clogger.info(f"创建{phase}耗时：{time.time() - phase_start:.2f}秒")
+        return results
+
+    async def async_restore_file(self, restore_dir, plain_name, file_name):
+        """
+        直接执行 mysql 还原一个 .sql 文件，.txt 数据文件在线程中使用 LOAD DATA 导入
+
+        :param plain_name: 去掉压缩扩展名的文件名
+        :param file_name: 备份文件名
+        :return: ((表名, 是否成功, 失败原因), 快速还原时移除的 {表名: (二级索引定义, 外键定义)})
+        """
+        table_name, ext = os.path.splitext(plain_name)
+        if ext == '.txt':
+            return await run_in_thread(lambda q: self.load_table(restore_dir, table_name, q, file_name))
+        deferred = {}
+        metrics = TaskMetrics(plain_name, parse_part_file(plain_name)[0], residual='load')
+        try:
+            connections.check_breaker(self.connect_kwargs())
+            args = self.mysql_args()
+            from_archive = not os.path.isdir(restore_dir)
+            if self.fast_restore or from_archive or strip_codec_ext(file_name)[1] or self.resuming:
+                def feed(stdin):
+                    with open_backup_text(restore_dir, file_name) as f:
+                        lines = rewrite_create_tables(f, deferred) if self.fast_restore else f
+                        self.write_restore_sql(stdin, replace_inserts(lines) if self.resuming else lines)
+
+                recode, err = await run_process(args, self.db_cwd, self.task_timeout, stdin=feed)
             else:
-                failed_tables.append(table_name)
-                clogger.info(message)
+                with open(os.path.join(restore_dir, file_name), 'rb') as f:
+                    recode, err = await run_process(args, self.db_cwd, self.task_timeout, stdin=f)
+            connections.record_client_result(recode, err, self.connect_kwargs())
+            if recode != 0:
+                raise RuntimeError(f"恢复数据表 {table_name} 失败，返回码为 {recode}：{err}")
+            append_checkpoint(self.checkpoint_path, {'unit': plain_name, 'deferred': deferred})
+            return (table_name, True, metrics.finish()), deferred
+        except Exception as er:
+            return (table_name, False, str(er)), deferred
 
-        if failed_tables:
-            print(f"还原失败的数据表：{', '.join(failed_tables)}")
+    def login_opt(self):
+        return f"-u {self.username} -p{self.password} -h {self.hostname} -P {self.port}"
+
+    def stream_binlogs(self):
+        """
+        持续拉取 binlog 到 binlog 目录，按配置的压缩算法压缩已写完的分段
+
+        binlog 目录中没有分段时，从最近一次完整备份记录的 binlog 文件开始，没有完整备份时从服务端当前的 binlog 文件开始。
+        """
+        start_file = None
+        _, manifest = find_previous_backup(self.backup_dir, self.binlog_dir, self.database)
+        if manifest and manifest.get('binlog'):
+            start_file = manifest['binlog']['file']
         else:
-            print("所有数据表都已成功恢复！")
-        end_time = time.time()
-        clogger.info(f"备份总共耗时：{end_time - start_time:.2f}秒")
+            cnx = mysql.connector.connect(user=self.username, password=self.password, host=self.hostname,
+                                          port=self.port)
+            position = binlog.get_binlog_position(cnx)
+            cnx.close()
+            if not position:
+                raise RuntimeError("服务端未开启 binlog，无法拉取")
+            start_file = position['file']
+        binlog.stream_binlogs(self.login_opt(), self.db_cwd, self.binlog_dir, start_file, self.compress_codec,
+                              self.compress_level, self.binlog_server_id)
+
+    def replay_binlogs(self, restore_dir, stop_datetime):
+        """
+        在完整备份还原之后重放 binlog 分段，将数据库恢复到指定时间点
+
+        :param restore_dir: 已还原的备份目录、.7z 压缩包或 .dbbp 归档路径
+        :param stop_datetime: 目标时间，如 2024-01-01 12:00:00
+        """
+        manifest = read_backup_manifest(restore_dir)
+        if not manifest or not manifest.get('binlog'):
+            raise RuntimeError(f"{restore_dir} 中没有记录 binlog 位置，无法按时间点恢复")
+        start_time = time.time()
+        clogger.info(f"从 {manifest['binlog']['file']}:{manifest['binlog']['position']} 开始重放 binlog 到 {stop_datetime}")
+        count = binlog.replay_binlogs(self.login_opt(), self.database, self.db_cwd, self.binlog_dir,
+                                      manifest['binlog'], stop_datetime)
+        clogger.info(f"重放 {count} 个 binlog 分段耗时：{time.time() - start_time:.2f}秒")
+
+    def verify_backup(self, location):
+        """
+        重新计算备份文件的哈希并与清单对比，多个文件由进程池并行计算
+
+        :param location: 备份目录、.7z 压缩包、.dbbp 归档路径或对象存储中的备份
+        :return: 校验失败的文件名列表
+        """
+        manifest = read_backup_manifest(location)
+        if not manifest:
+            raise RuntimeError(f"{location} 中没有清单文件，无法校验")
+        start_time = time.time()
+        is_dir = os.path.isdir(location)
+        members = None if is_dir else archive_members(location)
+        expected = {}
+        for table_name, entry in manifest['tables'].items():
+            if not entry.get('hashes'):
+                clogger.warning(f"表 {table_name} 在清单中没有记录哈希，跳过校验")
+                continue
+            if entry.get('ref') and not is_dir:
+                clogger.warning(f"表 {table_name} 引用了 {entry['ref']} 中的文件，不在压缩包中，跳过校验")
+                continue
+            for file_name, digest in entry['hashes'].items():
+                # 以引用方式复用的文件从被引用的备份目录读取
+                path = os.path.join(os.pardir, entry['ref'], file_name) if entry.get('ref') else file_name
+                expected[path] = digest
+        # 大文件先开始，避免最后只剩一个大文件在单个进程中计算
+        # 块引用文件按引用的数据量计算
+        sizes = {path: ((recipe_size if path.endswith(RECIPE_EXT) else os.path.getsize)(os.path.join(location, path)),
+                        0) for path in expected if is_dir and os.path.isfile(os.path.join(location, path))}
+        failed_files = []
+        total_bytes = 0
+        with create_pool(self.max_workers) as pool:
+            verify_threads = {}
+            for path in lpt_order(list(expected), sizes):
+                member = None if is_dir else members.get(path)
+                if not is_dir and member is None:
+                    failed_files.append(path)
+                    clogger.error(f"文件 {path} 不在压缩包中")
+                    continue
+                verify_threads[path] = pool.apply_async(hash_backup_file, args=(location, path, member))
+            bar, steps = progress_bar([sizes.get(path, (0,))[0] for path in verify_threads], "校验进度")
+            with bar:
+                for (path, verify_thread), step in zip(verify_threads.items(), steps):
+                    try:
+                        size, digest = verify_thread.get()
+                    except Exception as ev:
+                        failed_files.append(path)
+                        clogger.error(f"文件 {path} 读取失败：{ev}")
+                        continue
+                    finally:
+                        bar.update(step)
+                    total_bytes += size
+                    if digest != expected[path]:
+                        failed_files.append(path)
+                        clogger.error(f"文件 {path} 的哈希与清单不一致")
+        seconds = time.time() - start_time
+        clogger.info(f"校验 {len(expected)} 个文件共 {total_bytes / 1024 / 1024:.2f}MB，耗时：{seconds:.2f}秒，"
+                     f"{total_bytes / 1024 / 1024 / max(seconds, 0.001):.2f}MB/s")
+        if failed_files:
+            clogger.warning(f"{len(failed_files)} 个文件校验失败：{', '.join(failed_files)}")
+        else:
+            clogger.info("所有文件校验通过！")
+        return failed_files
+
+
+def init_backup_worker(buckets, low_priority, breaker, snapshot_args=None):
+    """
+    备份进程池的子进程初始化函数: 启用共享的限速配额和熔断器，一致性快照时开启快照连接
+    """
+    throttle.install(buckets, low_priority)
+    connections.install(breaker)
+    if snapshot_args:
+        snapshot.join(*snapshot_args)
+
+
+def backup_targets(backupers, max_workers, max_workers_per_server=None):
+    """
+    在一个进程池(或事件循环)中备份多个数据库，所有数据库的任务按体积由大到小统一调度
+
+    每个数据库使用各自的备份目录、进度日志、清单和熔断器；执行方式、限速和低优先级沿用第一个数据库的配置。
+
+    :param backupers: 每个数据库一个 MysqlBackuper
+    :param max_workers: 所有服务器合计的并发数
+    :param max_workers_per_server: 单个服务器的并发上限，为空时等于 max_workers
+    """
+    start_time = time.time()
+    first = backupers[0]
+    if any(b.consistent_snapshot for b in backupers):
+        raise RuntimeError("多数据库备份不支持一致性快照，请分别备份")
+    if any(b.adaptive_concurrency for b in backupers):
+        clogger.warning("多数据库备份不支持自适应并发，并发数固定为 max_workers")
+    # 对象存储的客户端在进程内只有一份，各数据库可以使用不同的 s3_url，但连接配置须相同
+    store_settings = [b.s3_settings for b in backupers if b.s3_url]
+    if any(settings != store_settings[0] for settings in store_settings):
+        raise RuntimeError("多数据库备份的对象存储连接配置(s3_endpoint_url、s3_region、密钥等)不同，请分别备份")
+    object_store.install(store_settings[0] if store_settings else None)
+    max_workers_per_server = max_workers_per_server or max_workers
+    jobs = [b.prepare_backup() for b in backupers]
+    servers = [server_of(b) for b in backupers]
+    # 所有数据库的任务统一按体积由大到小排序，大表先开始，小表填充空闲进程
+    units = {f"{target_label(backupers[index])}/{name}": (index, name)
+             for index, job in enumerate(jobs) for name in job['task_names']}
+    sizes = {unit: tuple(jobs[index]['plan']['task_sizes'][name]) for unit, (index, name) in units.items()}
+    pending = [units[unit] for unit in lpt_order(list(units), sizes)]
+    clogger.info(f"开始备份 {len(backupers)} 个数据库({len(set(servers))} 台服务器)，共 {len(pending)} 个任务，"
+                 f"并发 {max_workers}，每台服务器最多 {max_workers_per_server}")
+
+    throttle.install(throttle.make_buckets(first.throttle_profiles, first.throttle_read_mb, first.throttle_write_mb))
+    # 各数据库分别熔断，一个数据库无法连接时其余数据库继续备份
+    breakers = {connections.breaker_key(b.connect_kwargs()): connections.CircuitBreaker(b.circuit_breaker_failures)
+                for b in backupers}
+    connections.install(breakers)
+    try:
+        if first.executor == 'asyncio':
+            results = asyncio.run(async_backup_targets(backupers, jobs, servers, pending, max_workers,
+                                                       max_workers_per_server))
+        else:
+            results = pool_backup_targets(backupers, jobs, servers, pending, max_workers, max_workers_per_server)
+    finally:
+        throttle.install()
+        connections.install()
+        connections.close_all()
+    for backuper, job, target_results in zip(backupers, jobs, results):
+        clogger.info(f"数据库 {target_label(backuper)}：")
+        if breakers[connections.breaker_key(backuper.connect_kwargs())].is_open():
+            clogger.error("无法连接数据库，该数据库的备份提前结束")
+        backuper.finish_backup(job, target_results, start_time)
+
+
+def pool_backup_targets(backupers, jobs, servers, pending, max_workers, max_workers_per_server):
+    """
+    使用一个进程池执行多个数据库的备份任务，每台服务器上运行的任务数不超过上限
+
+    :param pending: 按启动顺序排列的任务 [(数据库序号, 任务名)]
+    :return: 每个数据库的备份结果列表
+    """
+    with multiprocessing.Manager() as manager:
+        result_queues = [manager.Queue() for _ in backupers]
+        pool = create_pool(max_workers, backupers, init_backup_worker,
+                           (throttle.installed(), backupers[0].low_priority, connections.installed()))
+        pending = list(pending)
+        running = []  # [(服务器, AsyncResult)]
+        backup_threads = []  # [(AsyncResult, 估算字节数)]
+        while pending:
+            running = [(server, r) for server, r in running if not r.ready()]
+            index = pick_task([servers[target] for target, _ in pending], [server for server, _ in running],
+                              max_workers, max_workers_per_server)
+            if index is None:
+                # 进程都在忙，或剩余任务所在的服务器都已达到上限
+                time.sleep(SLOT_POLL_SECONDS)
+                continue
+            target, name = pending.pop(index)
+            table_name, part, where = jobs[target]['tasks'][name]
+            backup_thread = pool.apply_async(call, args=(target, 'backup_table', table_name, result_queues[target], part,
+                                                         where))
+            running.append((servers[target], backup_thread))
+            backup_threads.append((backup_thread, jobs[target]['plan']['task_sizes'][name][0]))
+
+        # 等待所有子进程完成备份操作
+        bar, steps = progress_bar([size for _, size in backup_threads], "备份进度")
+        with bar:
+            for (backup_thread, _), step in zip(backup_threads, steps):
+                backup_thread.get()
+                bar.update(step)
+        pool.close()
+        pool.join()
+
+        results = []
+        for result_queue in result_queues:
+            target_results = []
+            while not result_queue.empty():
+                target_results.append(result_queue.get())
+            results.append(target_results)
+        return results
+
+
+async def async_backup_targets(backupers, jobs, servers, pending, max_workers, max_workers_per_server):
+    """
+    在一个事件循环中执行多个数据库的备份任务，每台服务器上运行的任务数不超过上限
+
+    :param pending: 按启动顺序排列的任务 [(数据库序号, 任务名)]
+    :return: 每个数据库的备份结果列表
+    """
+
+    async def run_task(target, name):
+        return target, await backupers[target].async_backup_table(*jobs[target]['tasks'][name])
+
+    done = await run_all([run_task(target, name) for target, name in pending], "备份进度", max_workers,
+                         groups=[servers[target] for target, _ in pending], group_limit=max_workers_per_server,
+                         weights=[jobs[target]['plan']['task_sizes'][name][0] for target, name in pending])
+    results = [[] for _ in backupers]
+    for target, result in done:
+        results[target].append(result)
+    return results
 
 
 def prompt(choices):
+    # rich 只在交互选择时用到，子进程不导入
+    from rich.prompt import Prompt
     return Prompt().ask(choices=choices)
 
 
-def backup(backuper: MysqlBackuper):
-    backuper.backup_all_tables()
+def resume_path(backuper, name):
+    # --resume 可以是完整路径，也可以是备份目录下的目录或压缩包名
+    return name if os.path.exists(name) else os.path.join(backuper.backup_dir, name)
 
 
-def restore(backuper):
-    sub_dirs = [name for name in os.listdir(backuper.backup_dir)
-                if os.path.isdir(os.path.join(backuper.backup_dir, name))]
+def backup(backuper: MysqlBackuper, resume=None):
+    backuper.backup_all_tables(resume_path(backuper, resume) if resume else None)
+
+
+def backup_dirs(backuper):
+    # 备份目录下的各次备份，不包括 binlog 目录和块仓库
+    excluded = {os.path.normpath(backuper.binlog_dir), os.path.normpath(os.path.join(backuper.backup_dir, STORE_DIR))}
+    return [name for name in os.listdir(backuper.backup_dir)
+            if os.path.isdir(os.path.join(backuper.backup_dir, name))
+            and os.path.normpath(os.path.join(backuper.backup_dir, name)) not in excluded]
+
+
+def object_backup(backuper, name=None):
+    # 对象存储中的备份，未指定时从桶中选择
+    name = name or prompt(choices=object_store.list_backups(backuper.s3_url))
+    return object_store.join_url(backuper.s3_url, os.path.basename(os.path.normpath(name)))
+
+
+def restore(backuper, tables=None, stop_datetime=None, resume=None):
+    if backuper.s3_url:
+        # 从桶中并行分段下载，边下载边还原
+        restore_to_time(backuper, object_backup(backuper, resume), tables, stop_datetime, bool(resume))
+        return
+    if resume:
+        restore_to_time(backuper, resume_path(backuper, resume), tables, stop_datetime, True)
+        return
+    sub_dirs = backup_dirs(backuper)
     dir_path = prompt(choices=sub_dirs)
     dir_path = os.path.join(backuper.backup_dir, dir_path)
-    backuper.restore_all_tables(dir_path)
+    restore_to_time(backuper, dir_path, tables, stop_datetime)
 
 
-def backup_and_compress(backuper):
-    backuper.backup_all_tables()
-    time.sleep(1)
-    compress_and_delete(backuper.db_backup_dir)
+def restore_to_time(backuper, restore_dir, tables=None, stop_datetime=None, resume=False):
+    if restore_dir.endswith('.7z') and is_solid_archive(restore_dir):
+        # 固实压缩包逐表流式解压时每张表都要从头解压，先整体解压一次
+        clogger.info(f'{restore_dir} 为固实压缩包，先整体解压再还原')
+        restore_dir = extract_backup(restore_dir)
+    failed_tables = backuper.restore_all_tables(restore_dir, tables, resume)
+    if not stop_datetime:
+        return
+    if failed_tables is None or failed_tables:
+        # 完整备份没有全部还原成功时重放 binlog 会得到不一致的数据
+        clogger.error("完整备份未全部还原成功，不重放 binlog")
+        return
+    if tables:
+        clogger.warning("只还原了部分表，binlog 中其他表的事件同样会被重放")
+    backuper.replay_binlogs(restore_dir, stop_datetime)
 
 
-def restore_and_decompress(backuper):
-    sub_dirs = [name for name in os.listdir(backuper.backup_dir)
-                if os.path.isfile(os.path.join(backuper.backup_dir, name)) and name.endswith('7z')]
-    file_name = prompt(choices=sub_dirs)
-    file_path = os.path.join(backuper.backup_dir, file_name)
-    decompress(file_path)
+def stream_binlogs(backuper):
+    backuper.stream_binlogs()
+
+
+def verify(backuper):
+    if backuper.s3_url:
+        backuper.verify_backup(object_backup(backuper))
+        return
+    sub_dirs = backup_dirs(backuper)
+    file_name = prompt(choices=sub_dirs + archive_files(backuper))
+    backuper.verify_backup(os.path.join(backuper.backup_dir, file_name))
+
+
+def archive_dir(backuper, dir_path):
+    # 按配置的归档格式压缩备份目录
+    chained = chained_backups(backuper.backup_dir, dir_path)
+    if chained:
+        # 压缩后目录被删除，清单中的引用无法解析，增量备份也找不到上一次备份
+        clogger.warning(f'{dir_path} 与增量备份 {", ".join(chained)} 之间存在文件引用，跳过压缩')
+        return
+    recipes = [f for _, _, files in os.walk(dir_path) for f in files if f.endswith(RECIPE_EXT)]
+    if recipes or os.path.basename(os.path.normpath(dir_path)) == STORE_DIR:
+        # 块仓库的垃圾回收只统计备份目录中的引用文件，归档后其引用的块会被删除
+        clogger.warning(f'{dir_path} 属于块仓库模式的备份，跳过压缩')
+        return
+    if backuper.archive_format == 'dbbp':
+        clogger.info(f'正在将{dir_path}打包为带索引的 dbbp 归档,然后删除源文件')
+        archive.pack_dir(dir_path, codec=backuper.compress_codec or 'gzip', level=backuper.compress_level)
+    else:
+        compress_and_delete(dir_path)
+
+
+def backup_and_compress(backuper, resume=None):
+    backuper.backup_all_tables(resume_path(backuper, resume) if resume else None)
+    compress_backup(backuper)
+
+
+def compress_backup(backuper):
+    if backuper.s3_url:
+        clogger.info('备份文件已上传到对象存储，跳过压缩')
+        return
+    if backuper.storage == 'repository':
+        # 块引用文件离开备份根目录就找不到块仓库
+        clogger.info('备份文件已存入块仓库，跳过压缩')
+        return
+    if codec_ext(backuper.compress_codec) and backuper.archive_format != 'dbbp':
+        # 已逐表流式压缩，不需要再整体压缩
+        clogger.info(f'备份文件已使用 {backuper.compress_codec} 逐表压缩，跳过 7z 压缩')
+        return
+    if backuper.incremental:
+        # 下一次增量备份以本次备份目录为基础，压缩后只能重新全量备份
+        clogger.info('增量备份目录是下一次增量备份的基础，跳过压缩')
+        return
     time.sleep(1)
-    file_name = ''.join(file_name.split('.')[:-1])
+    archive_dir(backuper, backuper.db_backup_dir)
+
+
+def archive_files(backuper):
+    # 备份目录下的压缩包和归档文件
+    return [name for name in os.listdir(backuper.backup_dir)
+            if os.path.isfile(os.path.join(backuper.backup_dir, name)) and name.endswith(('7z', archive.ARCHIVE_EXT))]
+
+
+def restore_and_decompress(backuper, tables=None, stop_datetime=None, resume=None):
+    if resume:
+        restore_to_time(backuper, resume_path(backuper, resume), tables, stop_datetime, True)
+        return
+    file_name = prompt(choices=archive_files(backuper))
     file_path = os.path.join(backuper.backup_dir, file_name)
-    backuper.restore_all_tables(file_path)
+    # 直接从压缩包中逐表流式解压并还原，不需要先解压整个压缩包
+    restore_to_time(backuper, file_path, tables, stop_datetime)
 
 
 def compress_and_delete_dir(backuper):
@@ -262,15 +1691,41 @@ def compress_and_delete_dir(backuper):
                 if os.path.isdir(os.path.join(backuper.backup_dir, name))]
     dir_name = prompt(choices=sub_dirs)
     file_path = os.path.join(backuper.backup_dir, dir_name)
-    compress_and_delete(file_path)
+    archive_dir(backuper, file_path)
 
 
-def decompress_file(backuper):
-    sub_dirs = [name for name in os.listdir(backuper.backup_dir)
-                if os.path.isfile(os.path.join(backuper.backup_dir, name)) and name.endswith('7z')]
-    file_name = prompt(choices=sub_dirs)
+def decompress_file(backuper, tables=None):
+    file_name = prompt(choices=archive_files(backuper))
     file_path = os.path.join(backuper.backup_dir, file_name)
-    decompress(file_path)
+    if file_name.endswith(archive.ARCHIVE_EXT):
+        # dbbp 归档可以只提取选中的表
+        names = [name for name in archive.read_index(file_path)
+                 if not tables or match_patterns(parse_part_file(strip_codec_ext(name)[0])[0], tables)]
+        clogger.info(f'正在从{file_path}提取 {len(names)} 个文件')
+        archive.extract(file_path, names=names)
+    else:
+        decompress(file_path)
+
+
+def list_backup(backuper):
+    # 列出备份目录、压缩包或归档中的文件及大小，dbbp 归档只读取索引
+    if backuper.s3_url:
+        location = object_backup(backuper)
+    else:
+        location = os.path.join(backuper.backup_dir, prompt(choices=backup_dirs(backuper) + archive_files(backuper)))
+    file_sizes = list_backup_files(location)
+    for name, size in sorted(file_sizes.items()):
+        clogger.info(f'{name}\t{size / 1024 / 1024:.2f}MB')
+    clogger.info(f'共 {len(file_sizes)} 个文件，{sum(file_sizes.values()) / 1024 / 1024:.2f}MB')
+
+
+def prune(backuper):
+    # 删除超出保留数量的旧备份，再回收块仓库中不再被引用的块
+    if backuper.keep_backups:
+        for name in prune_backups(backuper.backup_dir, backuper.keep_backups):
+            clogger.info(f'已删除旧备份 {name}')
+    count, freed = collect_garbage(backuper.backup_dir)
+    clogger.info(f'块仓库回收 {count} 个未被引用的块，释放 {freed / 1024 / 1024:.2f}MB')
 
 
 def parse():
@@ -281,16 +1736,21 @@ def parse():
     parser.add_argument('--restore_decompress', '-rsd', action='store_true', help='restore all tables and decompress')
     parser.add_argument('--compress_delete_dir', '-cdd', action='store_true', help='compress and delete a directory')
     parser.add_argument('--decompress', '-dc', action='store_true', help='decompress a file')
+    parser.add_argument('--list', '-ls', action='store_true', help='list the tables in a backup')
+    parser.add_argument('--tables', '-t', help='comma separated tables (wildcards allowed) to restore or extract')
+    parser.add_argument('--binlog_stream', '-bls', action='store_true', help='continuously pull binlog segments')
+    parser.add_argument('--verify', '-vf', action='store_true', help='re-hash backup files and compare with the manifest')
+    parser.add_argument('--prune', '-pr', action='store_true',
+                        help='delete backups beyond keep_backups and unreferenced chunks in the repository')
+    parser.add_argument('--resume', '-rm',
+                        help='with --backup/--restore: continue an interrupted run in this backup directory or archive')
+    parser.add_argument('--stop_datetime', '-sd',
+                        help='after restoring, replay binlog segments up to this time, e.g. "2024-01-01 12:00:00"')
     return parser
 
 
-def main():
-    with open('./dbbp.yaml', 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)
-
-    args = parse().parse_args()
-    backuper_config = config['backuper']
-    backuper = MysqlBackuper(
+def create_backuper(backuper_config):
+    return MysqlBackuper(
         hostname=backuper_config['hostname'],
         username=backuper_config['username'],
         password=backuper_config['password'],
@@ -299,28 +1759,103 @@ def main():
         port=backuper_config['port'],
         max_workers=backuper_config['max_workers'],
         backup_dir=backuper_config['backup_dir'],
-        ex_opt=backuper_config.get('ex_opt')
+        ex_opt=backuper_config.get('ex_opt'),
+        chunk_size_mb=backuper_config.get('chunk_size_mb', 0),
+        dump_engine=backuper_config.get('dump_engine', 'mysqldump'),
+        backup_format=backuper_config.get('backup_format', 'sql'),
+        fast_restore=backuper_config.get('fast_restore', False),
+        skip_binlog=backuper_config.get('skip_binlog', False),
+        compress_codec=backuper_config.get('compress_codec'),
+        compress_level=backuper_config.get('compress_level'),
+        archive_format=backuper_config.get('archive_format', '7z'),
+        incremental=backuper_config.get('incremental', False),
+        incremental_check=backuper_config.get('incremental_check', 'auto'),
+        binlog_dir=backuper_config.get('binlog_dir'),
+        binlog_server_id=backuper_config.get('binlog_server_id'),
+        executor=backuper_config.get('executor', 'pool'),
+        task_timeout=backuper_config.get('task_timeout'),
+        adaptive_concurrency=backuper_config.get('adaptive_concurrency', False),
+        min_workers=backuper_config.get('min_workers', 1),
+        adaptive_interval=backuper_config.get('adaptive_interval', 5),
+        max_threads_running=backuper_config.get('max_threads_running'),
+        max_row_lock_waits=backuper_config.get('max_row_lock_waits'),
+        max_replication_lag=backuper_config.get('max_replication_lag'),
+        throttle_read_mb=backuper_config.get('throttle_read_mb'),
+        throttle_write_mb=backuper_config.get('throttle_write_mb'),
+        throttle_profiles=backuper_config.get('throttle_profiles'),
+        low_priority=backuper_config.get('low_priority', False),
+        consistent_snapshot=backuper_config.get('consistent_snapshot', False),
+        connect_retries=backuper_config.get('connect_retries', 5),
+        connect_retry_delay=backuper_config.get('connect_retry_delay', 0.5),
+        circuit_breaker_failures=backuper_config.get('circuit_breaker_failures', 3),
+        split_sql_mb=backuper_config.get('split_sql_mb', 0),
+        restore_tiers=backuper_config.get('restore_tiers'),
+        tier_hook=backuper_config.get('tier_hook'),
+        prometheus_textfile=backuper_config.get('prometheus_textfile'),
+        storage=backuper_config.get('storage', 'files'),
+        keep_backups=backuper_config.get('keep_backups'),
+        s3_url=backuper_config.get('s3_url'),
+        s3_endpoint_url=backuper_config.get('s3_endpoint_url'),
+        s3_region=backuper_config.get('s3_region'),
+        s3_access_key=backuper_config.get('s3_access_key'),
+        s3_secret_key=backuper_config.get('s3_secret_key'),
+        s3_part_mb=backuper_config.get('s3_part_mb', 16),
+        s3_threads=backuper_config.get('s3_threads', 4)
     )
+
+
+def main():
+    # yaml 只在读取配置时用到，子进程导入本模块时不导入
+    import yaml
+    with open('./dbbp.yaml', 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+
+    args = parse().parse_args()
+    backuper_config = config['backuper']
+    # 配置了 targets 时每个数据库一个备份对象
+    targets = [create_backuper(target_config) for target_config in expand_targets(backuper_config)]
+    if targets and (args.backup or args.backup_compress) and not args.resume:
+        backup_targets(targets, backuper_config['max_workers'], backuper_config.get('max_workers_per_server'))
+        if args.backup_compress:
+            for backuper in targets:
+                compress_backup(backuper)
+        return
+    if targets:
+        # 还原等其他操作针对单个数据库，从目标中选择
+        labels = {target_label(target): target for target in targets}
+        backuper = labels[prompt(choices=list(labels))]
+    else:
+        backuper = create_backuper(backuper_config)
+    tables = [t.strip() for t in args.tables.split(',') if t.strip()] if args.tables else None
     # args.restore = True
     # args.restore_dir = r'D:\NEMBackupDataBase\test\20230328_084354'
     if args.backup:
-        backup(backuper)
+        backup(backuper, args.resume)
     elif args.restore:
-        restore(backuper)
+        restore(backuper, tables, args.stop_datetime, args.resume)
     elif args.backup_compress:
-        backup_and_compress(backuper)
+        backup_and_compress(backuper, args.resume)
     elif args.restore_decompress:
-        restore_and_decompress(backuper)
+        restore_and_decompress(backuper, tables, args.stop_datetime, args.resume)
     elif args.compress_delete_dir:
         compress_and_delete_dir(backuper)
     elif args.decompress:
-        decompress_file(backuper)
+        decompress_file(backuper, tables)
+    elif args.list:
+        list_backup(backuper)
+    elif args.prune:
+        prune(backuper)
+    elif args.binlog_stream:
+        stream_binlogs(backuper)
+    elif args.verify:
+        verify(backuper)
     else:
         clogger.info('Please specify a valid option')
 
 
 if __name__ == '__main__':
     multiprocessing.freeze_support()
+    use_forkserver()
     #  -p clogger.py -p zip_file.py
     # 将 '2023-04-15' 转换为 datetime.datetime 对象
     try:
@@ -0,0 +1,443 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows 上没有 resource 模块，不记录峰值内存
+    resource = None
+
+import mysql.connector
+
+import archive
+from bak_db_apply_async import MysqlBackuper, create_backuper
+from checkpoint import JOURNAL_NAME
+from clogger import clogger
+from manifest import new_manifest
+from synthetic import KINDS, PROFILES, make_row, make_spec, table_rng
+from workers import create_pool, use_forkserver
+from zip_file import list_backup_files
+
+INSERT_BATCH_ROWS = 1000  # 生成数据时每次插入的行数
+PHASES = ('backup', 'compress', 'restore')
+STARTUP_FIELDS = ('cold_seconds', 'warm_seconds', 'worker_rss_mb', 'worker_private_mb')
+STARTUP_TIMEOUT = 120  # 等待子进程启动的最长秒数
+
+
+def generate(config, database, spec, seed):
+    """
+    在测试库中创建合成表并写入数据，已有的同名表会被删除
+
+    :param config: dbbp.yaml 中的 backuper 配置，用于连接数据库
+    :param database: 测试库名
+    :param spec: make_spec 生成的表清单
+    :param seed: 随机种子
+    """
+    cnx = mysql.connector.connect(user=config['username'], password=config['password'], host=config['hostname'],
+                                  port=config['port'])
+    cursor = cnx.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+    cursor.execute(f"USE `{database}`")
+    for table in spec:
+        columns, _ = KINDS[table['kind']]
+        cursor.execute(f"DROP TABLE IF EXISTS `{table['name']}`")
+        cursor.execute(f"CREATE TABLE `{table['name']}` ({columns}) ENGINE=InnoDB")
+        rng = table_rng(seed, table)
+        rows = []
+        for row_id in range(1, table['rows'] + 1):
+            rows.append(make_row(table['kind'], rng, row_id))
+            if len(rows) >= INSERT_BATCH_ROWS or row_id == table['rows']:
+                marks = ', '.join(['%s'] * len(rows[0]))
+                cursor.executemany(f"INSERT INTO `{table['name']}` VALUES ({marks})", rows)
+                cnx.commit()
+                rows = []
+    cursor.close()
+    cnx.close()
+    clogger.info(f"已在 {database} 中生成 {len(spec)} 张表，约 {sum(t['bytes'] for t in spec) / 1024 / 1024:.2f}MB")
+
+
+def write_fake_clients(bin_dir):
+    # 在 bin_dir 中生成调用 fake_client 的 mysqldump 和 mysql 命令
+    os.makedirs(bin_dir, exist_ok=True)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synthetic.py')
+    for name in ('mysqldump', 'mysql'):
+        if os.name == 'nt':
+            with open(os.path.join(bin_dir, name + '.cmd'), 'w') as f:
+                f.write(f'@"{sys.executable}" "{script}" {name} %*\n')
+            continue
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" {name} "$@"\n')
+        os.chmod(path, 0o755)
+
+
+class FakeBackuper(MysqlBackuper):
+    """
+    不连接数据库的备份对象，备份计划来自合成表清单，导出和还原由 mysqldump/mysql 替身完成
+    """
+    spec = None
+
+    def plan_backup(self):
+        manifest = new_manifest(self.database)
+        manifest['binlog'] = None
+        tables = [t['name'] for t in self.spec]
+        return {'manifest': manifest, 'fingerprints': {}, 'tables': tables,
+                'table_rows': {t['name']: t['rows'] for t in self.spec},
+                'tasks': {name: (name, None, None) for name in tables},
+                'task_sizes': {t['name']: (t['bytes'], t['rows']) for t in self.spec}}
+
+
+def make_backuper(case, database, backup_dir, bin_dir=None):
+    # 按测试用例创建备份对象，threadpool 为 bak_db_ThreadPoolExecutor 中的实现
+    config = case['config']
+    if case['executor'] == 'threadpool':
+        # 只在 threadpool 用例中导入，本模块作为子进程的主模块时导入的模块与 bak_db_apply_async 相同
+        import bak_db_ThreadPoolExecutor
+        return bak_db_ThreadPoolExecutor.MysqlBackuper(
+            hostname=config['hostname'], username=config['username'], password=config['password'], database=database,
+            port=config['port'], db_cwd=config.get('db_cwd'), backup_dir=backup_dir, ex_opt=config.get('ex_opt'),
+            max_workers=case['workers'])
+    if case['mode'] == 'fake':
+        backuper = FakeBackuper(hostname='127.0.0.1', username='bench', password='bench', database=database,
+                                db_cwd=bin_dir, backup_dir=backup_dir, max_workers=case['workers'],
+                                executor=case['executor'], circuit_breaker_failures=0)
+        backuper.spec = case['spec']
+        return backuper
+    return create_backuper(dict(config, database=database, backup_dir=backup_dir, max_workers=case['workers'],
+                                executor=case['executor'], incremental=False, targets=None))
+
+
+def reset_database(config, database):
+    # 还原到一个空的库中，避免上一次还原的数据影响耗时
+    cnx = mysql.connector.connect(user=config['username'], password=config['password'], host=config['hostname'],
+                                  port=config['port'])
+    cursor = cnx.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{database}`")
+    cursor.execute(f"CREATE DATABASE `{database}`")
+    cursor.close()
+    cnx.close()
+
+
+def phase_stats(seconds, tables, size):
+    return {'seconds': round(seconds, 3), 'tables_per_s': round(tables / seconds, 2) if seconds else None,
+            'mb_per_s': round(size / 1024 / 1024 / seconds, 2) if seconds else None, 'bytes': size}
+
+
+def peak_rss_mb(who):
+    # Linux 上 ru_maxrss 的单位为 KB，macOS 上为字节；子进程为已结束子进程中的最大值
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def memory_mb():
+    """
+    当前进程的常驻内存和独占内存(MB)
+
+    独占内存不含与父进程或 forkserver 共享的页，只在有 /proc/self/smaps_rollup 的 Linux 上可用，其他系统为 None，
+    常驻内存取峰值内存
+    """
+    try:
+        with open('/proc/self/smaps_rollup', encoding='utf-8') as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) for line in f if line.rstrip().endswith('kB')}
+    except OSError:
+        return peak_rss_mb(resource and resource.RUSAGE_SELF), None
+    return round(fields['Rss'] / 1024, 1), round((fields['Private_Clean'] + fields['Private_Dirty']) / 1024, 1)
+
+
+def report_started(status_queue):
+    # 进程池子进程的初始化函数，在模块导入、备份对象反序列化和日志转发之后执行: 报告启动完成的时间和内存
+    rss, private = memory_mb()
+    status_queue.put((os.getpid(), time.time(), rss, private))
+
+
+def import_seconds():
+    # 在新的解释器中导入 bak_db_apply_async 的耗时，即 spawn 子进程还原主模块的开销
+    code = 'import time; start = time.perf_counter(); import bak_db_apply_async; print(time.perf_counter() - start)'
+    out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True).stdout
+    return round(float(out.split()[-1]), 3)
+
+
+def run_startup(case):
+    """
+    在单独的进程中测量进程池的启动开销: 从创建进程池到所有子进程完成初始化的耗时，以及每个子进程的内存
+
+    依次创建两个进程池，第一个(cold)包含 forkserver 服务进程的启动，第二个(warm)相当于同一次运行中后续的进程池。
+
+    :param case: {'start_method', 'workers'}
+    :return: {'start_method', 'workers', 'cold_seconds', 'warm_seconds', 'worker_rss_mb', 'worker_private_mb'}
+    """
+    if case['start_method'] == 'forkserver':
+        use_forkserver()
+    else:
+        multiprocessing.set_start_method(case['start_method'], force=True)
+    backuper = MysqlBackuper(hostname='127.0.0.1', username='bench', password='bench', database='dbbp_bench',
+                             max_workers=case['workers'])
+    status_queue = multiprocessing.Queue()
+    result = {'start_method': case['start_method'], 'workers': case['workers']}
+    for attempt in ('cold', 'warm'):
+        start = time.time()
+        pool = create_pool(case['workers'], (backuper,), report_started, (status_queue,))
+        started = [status_queue.get(timeout=STARTUP_TIMEOUT) for _ in range(case['workers'])]
+        pool.close()
+        pool.join()
+        result[f"{attempt}_seconds"] = round(max(t for _, t, _, _ in started) - start, 3)
+    # 内存取第二个进程池中各子进程的中位数
+    rss = [r for _, _, r, _ in started if r is not None]
+    private = [p for _, _, _, p in started if p is not None]
+    result['worker_rss_mb'] = statistics.median(rss) if rss else None
+    result['worker_private_mb'] = statistics.median(private) if private else None
+    return result
+
+
+def run_case(case):
+    """
+    在单独的进程中执行一个测试用例: 备份、打包压缩、还原，峰值内存只包含这一个用例
+
+    :param case: {'mode', 'executor', 'workers', 'spec', 'seed', 'codec', 'database', 'config', 'fake_mb_s'}
+    :return: 各阶段的耗时和吞吐、峰值内存和失败的表数
+    """
+    work_dir = tempfile.mkdtemp(prefix='dbbp_bench_')
+    bin_dir = None
+    try:
+        if case['mode'] == 'fake':
+            bin_dir = os.path.join(work_dir, 'bin')
+            write_fake_clients(bin_dir)
+            spec_path = os.path.join(work_dir, 'spec.json')
+            with open(spec_path, 'w', encoding='utf-8') as f:
+                json.dump({'spec': case['spec'], 'seed': case['seed']}, f)
+            os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+            os.environ['DBBP_BENCH_SPEC'] = spec_path
+            os.environ['DBBP_BENCH_MB_S'] = str(case['fake_mb_s'] or 0)
+        tables = len(case['spec'])
+        phases = {}
+        wall_start = time.time()
+
+        backuper = make_backuper(case, case['database'], os.path.join(work_dir, 'backup'), bin_dir)
+        start = time.time()
+        backuper.backup_all_tables()
+        backup_dir = backuper.db_backup_dir
+        backup_failed = os.path.exists(os.path.join(backup_dir, JOURNAL_NAME))
+        backup_bytes = sum(list_backup_files(backup_dir).values())
+        phases['backup'] = phase_stats(time.time() - start, tables, backup_bytes)
+
+        start = time.time()
+        archive_path = archive.pack_dir(backup_dir, codec=case['codec'], delete=False)
+        phases['compress'] = phase_stats(time.time() - start, tables, backup_bytes)
+        phases['compress']['archive_bytes'] = os.path.getsize(archive_path)
+
+        restore_database = case['database'] + '_restore'
+        if case['mode'] == 'real':
+            reset_database(case['config'], restore_database)
+        restorer = make_backuper(case, restore_database, os.path.join(work_dir, 'backup'), bin_dir)
+        start = time.time()
+        failed_tables = restorer.restore_all_tables(backup_dir)
+        phases['restore'] = phase_stats(time.time() - start, tables, backup_bytes)
+
+        # forkserver 启动的进程池子进程是 forkserver 服务进程的子进程，不计入本进程的 RUSAGE_CHILDREN
+        child_rss_mb = None
+        if case['executor'] != 'pool' or multiprocessing.get_start_method() != 'forkserver':
+            child_rss_mb = peak_rss_mb(resource and resource.RUSAGE_CHILDREN)
+        return {'executor': case['executor'], 'workers': case['workers'], 'phases': phases,
+                'wall_seconds': round(time.time() - wall_start, 3),
+                'peak_rss_mb': peak_rss_mb(resource and resource.RUSAGE_SELF),
+                'peak_child_rss_mb': child_rss_mb,
+                'backup_failed': backup_failed, 'restore_failed': len(failed_tables or [])}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_matrix(args, config, spec):
+    """
+    按并发数和执行方式的组合逐个执行测试用例，每个用例在新的进程中运行
+
+    :return: 测试结果，见 write_results
+    """
+    cases = []
+    for executor in args.executors.split(','):
+        if executor == 'threadpool' and args.run == 'fake':
+            clogger.warning("bak_db_ThreadPoolExecutor 的备份需要连接数据库，模拟模式下跳过 threadpool")
+            continue
+        for workers in [int(w) for w in args.workers.split(',')]:
+            for repeat in range(args.repeat):
+                cases.append({'mode': args.run, 'executor': executor, 'workers': workers, 'repeat': repeat,
+                              'spec': spec, 'seed': args.seed, 'codec': args.codec, 'database': args.database,
+                              'config': config, 'fake_mb_s': args.fake_mb_s})
+    results = []
+    for case in cases:
+        clogger.info(f"基准测试：{case['executor']} 并发 {case['workers']} 第 {case['repeat'] + 1} 次")
+        results.append(run_in_process(case))
+    return results
+
+
+def run_startup_matrix(args):
+    """
+    按子进程启动方式和并发数的组合测量进程池的启动开销，每个用例在新的进程中运行
+
+    :return: 测试结果列表，见 run_startup
+    """
+    results = []
+    for start_method in args.start_methods.split(','):
+        if start_method not in multiprocessing.get_all_start_methods():
+            clogger.warning(f"当前系统不支持 {start_method}，跳过")
+            continue
+        for workers in [int(w) for w in args.workers.split(',')]:
+            for repeat in range(args.repeat):
+                result = run_in_process({'mode': 'startup', 'start_method': start_method, 'workers': workers,
+                                         'repeat': repeat})
+                clogger.info(f"{start_method:<10} 并发 {workers:<3} 启动 {result['cold_seconds']:.3f}s，"
+                             f"再次启动 {result['warm_seconds']:.3f}s，每个子进程 {result['worker_rss_mb']}MB，"
+                             f"独占 {result['worker_private_mb']}MB")
+                results.append(result)
+    return results
+
+
+def run_in_process(case):
+    # 在新的进程中执行一个用例，用例文件中包含数据库密码，不放在命令行参数中
+    fd, case_path = tempfile.mkstemp(prefix='dbbp_case_', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(case, f)
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--case', case_path], check=True)
+        with open(case_path, encoding='utf-8') as f:
+            result = json.load(f)
+    finally:
+        os.remove(case_path)
+    result['repeat'] = case['repeat']
+    return result
+
+
+def git_version():
+    # 当前代码的提交，用于比较不同版本的结果
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {'version': git_version(), 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+def write_results(path, args, spec, results):
+    report = dict(environment(), mode=args.run, profile=args.profile, seed=args.seed, codec=args.codec,
+                  fake_mb_s=args.fake_mb_s if args.run == 'fake' else None, tables=len(spec),
+                  bytes=sum(t['bytes'] for t in spec), cases=results)
+    write_report(path, report)
+
+
+def write_startup_results(path, results):
+    write_report(path, dict(environment(), mode='startup', import_seconds=import_seconds(), cases=results))
+
+
+def write_report(path, report):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    clogger.info(f"基准测试结果已写入 {path}")
+
+
+def summarize(report):
+    # 同一执行方式(启动方式)和并发数的多次结果取中位数: {(执行方式, 并发数): {阶段: 秒数}}
+    seconds = {}
+    for case in report['cases']:
+        if report['mode'] == 'startup':
+            key, values = (case['start_method'], case['workers']), {field: case[field] for field in STARTUP_FIELDS}
+        else:
+            key, values = (case['executor'], case['workers']), {p: case['phases'][p]['seconds'] for p in PHASES}
+        for field, value in values.items():
+            if value is not None:
+                seconds.setdefault(key, {}).setdefault(field, []).append(value)
+    return {key: {field: statistics.median(values) for field, values in fields.items()}
+            for key, fields in seconds.items()}
+
+
+def compare(old_path, new_path):
+    """
+    比较两次基准测试的结果，输出各执行方式、并发数和阶段的耗时变化
+    """
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    if (old['mode'], old.get('profile'), old.get('seed')) != (new['mode'], new.get('profile'), new.get('seed')):
+        clogger.warning("两次结果的模式、规模或随机种子不同，耗时不能直接比较")
+    old_summary, new_summary = summarize(old), summarize(new)
+    clogger.info(f"{old['version']} -> {new['version']}")
+    if old['mode'] == 'startup' and new['mode'] == 'startup':
+        clogger.info(f"导入 bak_db_apply_async {old['import_seconds']:.3f}s -> {new['import_seconds']:.3f}s")
+    for key in sorted(set(old_summary) & set(new_summary)):
+        for field in [f for f in old_summary[key] if f in new_summary[key]]:
+            before, after = old_summary[key][field], new_summary[key][field]
+            change = (after - before) / before * 100 if before else 0
+            clogger.info(f"{key[0]:<10} 并发 {key[1]:<3} {field:<17} {before:>9.2f} -> {after:>9.2f} ({change:+.1f}%)")
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Backup and restore benchmarks')
+    parser.add_argument('--generate', action='store_true', help='create the synthetic schema in --database')
+    parser.add_argument('--run', choices=['real', 'fake'],
+                        help='real: benchmark against the database in dbbp.yaml; fake: mysqldump/mysql stand-ins')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    parser.add_argument('--startup', action='store_true',
+                        help='measure worker pool startup time and per-worker memory for each --start_methods')
+    parser.add_argument('--start_methods', default='fork,spawn,forkserver',
+                        help='comma separated multiprocessing start methods for --startup')
+    parser.add_argument('--profile', choices=list(PROFILES), default='small', help='size of the synthetic schema')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the synthetic schema')
+    parser.add_argument('--database', default='dbbp_bench', help='database holding the synthetic schema')
+    parser.add_argument('--workers', default='1,2,4', help='comma separated worker counts')
+    parser.add_argument('--executors', default='pool,asyncio', help='comma separated: pool, asyncio, threadpool')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per combination, results keep every run')
+    parser.add_argument('--codec', default='gzip', help='codec of the compress phase (.dbbp archive)')
+    parser.add_argument('--fake_mb_s', type=float, default=0, help='simulated server speed of the stand-ins, 0 = max')
+    parser.add_argument('--output', default='benchmark.json', help='result file')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = parse().parse_args()
+    if args.case:
+        with open(args.case, encoding='utf-8') as f:
+            case = json.load(f)
+        if case['mode'] == 'startup':
+            result = run_startup(case)
+        else:
+            # 与 bak_db_apply_async 相同的子进程启动方式
+            use_forkserver()
+            result = run_case(case)
+        with open(args.case, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.startup:
+        write_startup_results(args.output, run_startup_matrix(args))
+        return
+    config = {}
+    if args.generate or args.run == 'real':
+        import yaml
+        with open('./dbbp.yaml', 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)['backuper']
+    spec = make_spec(args.profile, args.seed)
+    if args.generate:
+        generate(config, args.database, spec, args.seed)
+    if args.run:
+        write_results(args.output, args, spec, run_matrix(args, config, spec))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from clogger import clogger
+from codec import COPY_BUFFER, codec_ext, open_reader, strip_codec_ext, wrap_writer
+
+ROTATE_CHECK_SECONDS = 10  # 检查 binlog 切换并压缩已完成文件的间隔
+RESTART_DELAY_SECONDS = 5  # mysqlbinlog 异常退出后重新连接的间隔
+
+
+def get_binlog_position(cnx):
+    """
+    查询当前的 binlog 文件、位置和 GTID 集合
+
+    :param cnx: mysql.connector 连接
+    :return: {'file', 'position', 'gtid'}，服务端未开启 binlog 时返回 None
+    """
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("SHOW BINARY LOG STATUS")
+    except Exception:
+        # MySQL 8.2 之前及 MariaDB 使用 SHOW MASTER STATUS
+        cursor.execute("SHOW MASTER STATUS")
+    row = cursor.fetchone()
+    cursor.fetchall()
+    cursor.close()
+    if not row:
+        return None
+    return {'file': row[0], 'position': int(row[1]), 'gtid': row[4] if len(row) > 4 else None}
+
+
+def list_segments(binlog_dir):
+    """
+    列出已采集的 binlog 分段文件，按文件名(即 binlog 序号)排序
+
+    :return: [(binlog 文件名, 实际文件名)]
+    """
+    if not os.path.isdir(binlog_dir):
+        return []
+    segments = [(strip_codec_ext(f)[0], f) for f in os.listdir(binlog_dir)
+                if os.path.isfile(os.path.join(binlog_dir, f)) and not f.endswith('.tmp')]
+    return sorted(segments)
+
+
+def compress_finished_segments(binlog_dir, codec, level=None):
+    """
+    压缩已写完的 binlog 分段；mysqlbinlog 只会写入序号最大的文件，其余文件已经完成
+    """
+    raw_segments = [f for name, f in list_segments(binlog_dir) if name == f]
+    for file_name in raw_segments[:-1]:
+        src_path = os.path.join(binlog_dir, file_name)
+        dest_path = src_path + codec_ext(codec)
+        if dest_path == src_path:
+            # 不压缩(如 codec 为 none)时目标文件就是分段本身，替换后再删除源文件会删掉分段
+            continue
+        # 先写临时文件，压缩完成后再改名，中途退出不会留下不完整的分段
+        out = wrap_writer(open(dest_path + '.tmp', 'wb', buffering=COPY_BUFFER), codec, level)
+        with open(src_path, 'rb') as src, out:
+            shutil.copyfileobj(src, out, COPY_BUFFER)
+        os.replace(dest_path + '.tmp', dest_path)
+        os.remove(src_path)
+        clogger.info(f"binlog 分段 {file_name} 已压缩")
+
+
+def stream_binlogs(login_opt, cwd, binlog_dir, start_file, codec=None, level=None, server_id=None):
+    """
+    使用 mysqlbinlog --read-from-remote-server 持续拉取 binlog 到 binlog_dir，已写完的分段按 codec 压缩
+
+    已有分段时从最后一个未压缩的分段继续拉取；mysqlbinlog 异常退出后自动重连，按 Ctrl+C 结束。
+
+    :param login_opt: mysqlbinlog 的连接参数，如 -u root -p123 -h host -P 3306
+    :param cwd: mysqlbinlog 所在目录
+    :param binlog_dir: 分段文件存放目录
+    :param start_file: 没有已采集的分段时开始拉取的 binlog 文件名
+    :param codec: 分段压缩算法
+    :param level: 压缩级别
+    :param server_id: mysqlbinlog 连接使用的 server id，不能与复制拓扑中的其他节点相同
+    """
+    os.makedirs(binlog_dir, exist_ok=True)
+    server_opt = f"--connection-server-id={server_id}" if server_id else ""
+    while True:
+        segments = list_segments(binlog_dir)
+        if not segments:
+            first_file = start_file
+        elif segments[-1][0] == segments[-1][1]:
+            # 最后一个分段未压缩，可能未写完，从它开始重新拉取并覆盖
+            first_file = segments[-1][0]
+        else:
+            # 最后一个分段已压缩，说明它已完成，从下一个文件开始
+            first_file = _next_binlog_name(segments[-1][0])
+        cmd = f"mysqlbinlog --read-from-remote-server --raw --stop-never {server_opt} {login_opt} " \
+              f"--result-file={os.path.join(binlog_dir, '')} {first_file}"
+        clogger.info(f"开始从 {first_file} 拉取 binlog 到 {binlog_dir}")
+        process = subprocess.Popen(cmd, shell=True, cwd=cwd)
+        try:
+            while process.poll() is None:
+                time.sleep(ROTATE_CHECK_SECONDS)
+                if codec_ext(codec):
+                    compress_finished_segments(binlog_dir, codec, level)
+        except KeyboardInterrupt:
+            process.terminate()
+            process.wait()
+            clogger.info("已停止拉取 binlog")
+            return
+        clogger.warning(f"mysqlbinlog 退出，返回码为 {process.returncode}，{RESTART_DELAY_SECONDS} 秒后重新连接")
+        time.sleep(RESTART_DELAY_SECONDS)
+
+
+def _next_binlog_name(name):
+    base, seq = name.rsplit('.', 1)
+    return f"{base}.{int(seq) + 1:0{len(seq)}d}"
+
+
+def replay_binlogs(login_opt, database, cwd, binlog_dir, start, stop_datetime=None):
+    """
+    从完整备份记录的 binlog 位置开始，按顺序重放已采集的分段直到目标时间
+
+    binlog 事件必须按顺序应用：所有分段依次交给同一个 mysql 会话执行，会话中的临时表等状态得以保留；
+    解压、mysqlbinlog 解析和 mysql 执行分别在不同的进程和线程中流水线并行，分段之间不并行重放。
+    重放时去掉事件中的 GTID，还原到原服务器时已执行过的 GTID 不会使事务被跳过。
+
+    :param login_opt: 连接参数
+    :param database: 只重放该数据库的事件
+    :param cwd: mysql/mysqlbinlog 所在目录
+    :param binlog_dir: 分段文件存放目录
+    :param start: 完整备份清单中记录的 {'file', 'position'}
+    :param stop_datetime: 目标时间，如 2024-01-01 12:00:00，为空时重放全部分段
+    :return: 重放的分段数
+    """
+    segments = [(name, f) for name, f in list_segments(binlog_dir) if name >= start['file']]
+    if not segments or segments[0][0] != start['file']:
+        raise RuntimeError(f"binlog 目录 {binlog_dir} 中缺少备份起点 {start['file']}，无法按时间点恢复")
+    stop_opt = f'--stop-datetime="{stop_datetime}"' if stop_datetime else ""
+    mysql = subprocess.Popen(f"mysql {login_opt} {database}", shell=True, cwd=cwd, stdin=subprocess.PIPE)
+    try:
+        for name, file_name in segments:
+            start_opt = f"--start-position={start['position']}" if name == start['file'] else ""
+            # mysqlbinlog 从标准输入读取解压后的分段，输出直接写入 mysql 会话
+            parser = subprocess.Popen(f"mysqlbinlog --skip-gtids --database={database} {start_opt} {stop_opt} -",
+                                      shell=True, cwd=cwd, stdin=subprocess.PIPE, stdout=mysql.stdin)
+            feeder = threading.Thread(target=_feed, args=(os.path.join(binlog_dir, file_name), parser.stdin))
+            feeder.start()
+            feeder.join()
+            if parser.wait() != 0:
+                raise RuntimeError(f"解析 binlog 分段 {file_name} 失败，返回码为 {parser.returncode}")
+            clogger.info(f"binlog 分段 {name} 已重放")
+    finally:
+        mysql.stdin.close()
+        recode = mysql.wait()
+    if recode != 0:
+        raise RuntimeError(f"重放 binlog 失败，mysql 返回码为 {recode}")
+    return len(segments)
+
+
+def _feed(path, stdin):
+    try:
+        with open_reader(path) as src:
+            shutil.copyfileobj(src, stdin, COPY_BUFFER)
+    except BrokenPipeError:
+        pass
+    finally:
+        stdin.close()
@@ -0,0 +1,76 @@
+import json
+import os
+
+JOURNAL_NAME = 'checkpoint.jsonl'  # 备份目录中的进度日志
+PARTIAL_DIR = '.partial'  # 备份目录中存放未完成文件的目录，完成后才移入备份目录
+RESTORE_JOURNAL_EXT = '.restore.jsonl'  # 还原进度日志与备份目录或压缩包同名放在旁边
+
+
+def append_checkpoint(path, record):
+    """
+    向进度日志追加一条记录并刷到磁盘
+
+    每条记录为一行 JSON，以一次追加写入完成，多个进程同时追加时不会交错；
+    进程在写入过程中被杀死时最多留下一行不完整的记录，读取时会被忽略。
+    记录以换行开头，保证不完整的记录之后追加的记录仍从新的一行开始。
+
+    :param path: 进度日志路径
+    :param record: 记录内容
+    """
+    line = ('\n' + json.dumps(record, ensure_ascii=False, default=str)).encode('utf-8')
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_checkpoints(path):
+    """
+    读取进度日志中的全部完整记录
+
+    :return: 记录列表，日志不存在时为空
+    """
+    if not os.path.isfile(path):
+        return []
+    records = []
+    # 未写完的记录可能截断在多字节字符中间
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # 中断时未写完的记录
+                continue
+    return records
+
+
+def restore_journal_path(location):
+    return os.path.normpath(location) + RESTORE_JOURNAL_EXT
+
+
+def commit_files(paths, dest_dir):
+    """
+    将写完的文件从未完成目录移入备份目录，同一文件系统内改名是原子的
+
+    :return: 移动后的文件路径列表
+    """
+    committed = []
+    for path in paths:
+        dest_path = os.path.join(dest_dir, os.path.basename(path))
+        os.replace(path, dest_path)
+        committed.append(dest_path)
+    return committed
+
+
+def replace_inserts(lines):
+    """
+    将 INSERT 语句改为 REPLACE，重做中断的分片时已导入的行被覆盖而不是主键冲突
+    """
+    for line in lines:
+        if line.startswith('INSERT INTO '):
+            line = 'REPLACE INTO ' + line[len('INSERT INTO '):]
+        yield line
@@ -0,0 +1,151 @@
+import math
+import re
+
+# 可用于按范围切分的整数类型
+INTEGER_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint')
+# 分片文件名: 表名.NNNN.sql, 其中 0000 为表结构, 0001 起为数据; tab 格式的数据分片为 表名.NNNN.txt;
+# 表名.triggers.sql 为分片表的触发器，在所有数据分片之后还原
+PART_PATTERN = re.compile(r'^(?P<table>.+)\.(?P<part>\d{4}|triggers)\.(?:sql|txt)$')
+TRIGGER_PART = -1  # 触发器文件的分片序号
+
+
+def part_file_name(table_name, part, ext='sql'):
+    """
+    生成分片备份文件名
+
+    :param table_name: 表名
+    :param part: 分片序号，0 为表结构，TRIGGER_PART 为触发器
+    :param ext: 文件扩展名，sql 或 txt
+    :return: 文件名，如 user.0001.sql
+    """
+    if part == TRIGGER_PART:
+        return f'{table_name}.triggers.{ext}'
+    return f'{table_name}.{part:04d}.{ext}'
+
+
+def parse_part_file(file_name):
+    """
+    解析分片备份文件名
+
+    :param file_name: 备份文件名
+    :return: (表名, 分片序号)，非分片文件返回 (表名, None)
+    """
+    match = PART_PATTERN.match(file_name)
+    if match:
+        part = match.group('part')
+        return match.group('table'), TRIGGER_PART if part == 'triggers' else int(part)
+    return file_name.rsplit('.', 1)[0], None
+
+
+def get_chunk_key(cnx, database, table_name):
+    """
+    查找可用于切分的键：主键优先，其次唯一键，要求首列为整数类型
+
+    :param cnx: mysql.connector 连接
+    :param database: 数据库名
+    :param table_name: 表名
+    :return: (列名, 是否可为空)，找不到时返回 None
+    """
+    cursor = cnx.cursor()
+    cursor.execute(
+        "SELECT s.INDEX_NAME, s.COLUMN_NAME, c.DATA_TYPE, c.IS_NULLABLE "
+        "FROM information_schema.STATISTICS s JOIN information_schema.COLUMNS c "
+        "ON c.TABLE_SCHEMA = s.TABLE_SCHEMA AND c.TABLE_NAME = s.TABLE_NAME AND c.COLUMN_NAME = s.COLUMN_NAME "
+        "WHERE s.TABLE_SCHEMA = %s AND s.TABLE_NAME = %s AND s.NON_UNIQUE = 0 AND s.SEQ_IN_INDEX = 1 "
+        "ORDER BY s.INDEX_NAME = 'PRIMARY' DESC, s.INDEX_NAME",
+        (database, table_name))
+    rows = cursor.fetchall()
+    cursor.close()
+    for _, column, data_type, nullable in rows:
+        if data_type.lower() in INTEGER_TYPES:
+            return column, nullable == 'YES'
+    return None
+
+
+def get_key_range(cnx, database, table_name, column):
+    """
+    查询切分列的最小值和最大值
+
+    :return: (最小值, 最大值)，空表返回 (None, None)
+    """
+    cursor = cnx.cursor()
+    cursor.execute(f"SELECT MIN(`{column}`), MAX(`{column}`) FROM `{database}`.`{table_name}`")
+    lo, hi = cursor.fetchone()
+    cursor.close()
+    return lo, hi
+
+
+def split_ranges(column, lo, hi, parts, nullable=False):
+    """
+    将 [lo, hi] 平均切分为若干个范围，生成 mysqldump --where 条件
+
+    首个范围不设下限、末个范围不设上限，保证切分期间新增的行也会被覆盖；可为空的列在首个范围中包含 NULL。
+
+    :param column: 切分列名
+    :param lo: 最小值
+    :param hi: 最大值
+    :param parts: 期望的分片数
+    :param nullable: 切分列是否可为空
+    :return: where 条件列表
+    """
+    parts = max(1, min(parts, hi - lo + 1))
+    step = math.ceil((hi - lo + 1) / parts)
+    bounds = [lo + step * i for i in range(1, parts) if lo + step * i <= hi]
+    column = f'`{column}`'
+    wheres = []
+    for i in range(len(bounds) + 1):
+        conditions = []
+        if i > 0:
+            conditions.append(f'{column} >= {bounds[i - 1]}')
+        if i < len(bounds):
+            conditions.append(f'{column} < {bounds[i]}')
+        where = ' AND '.join(conditions) or '1=1'
+        if i == 0 and nullable:
+            where = f'{where} OR {column} IS NULL'
+        wheres.append(where)
+    return wheres
+
+
+def plan_chunks(cnx, database, table_name, table_bytes, chunk_size):
+    """
+    为超过分片阈值的大表生成分片计划
+
+    :param cnx: mysql.connector 连接
+    :param database: 数据库名
+    :param table_name: 表名
+    :param table_bytes: 表的估算字节数
+    :param chunk_size: 分片大小(字节)，为 0 时不分片
+    :return: where 条件列表，不需要或无法分片时返回 None
+    """
+    if not chunk_size or table_bytes <= chunk_size:
+        return None
+    key = get_chunk_key(cnx, database, table_name)
+    if key is None:
+        return None
+    column, nullable = key
+    lo, hi = get_key_range(cnx, database, table_name, column)
+    if lo is None:
+        return None
+    wheres = split_ranges(column, lo, hi, math.ceil(table_bytes / chunk_size), nullable)
+    return wheres if len(wheres) > 1 else None
+
+
+def split_schema_files(file_names):
+    """
+    将备份文件分为必须先还原的表结构文件和其余文件
+
+    分片表的 .0000.sql 以及 tab 格式中与 .txt 数据文件对应的 .sql 只包含表结构，必须先于数据文件还原。
+
+    :param file_names: 备份文件名列表
+    :return: (表结构文件列表, 其余文件列表)
+    """
+    data_tables = {parse_part_file(f)[0] for f in file_names if f.endswith('.txt')}
+    schema_files = []
+    other_files = []
+    for file_name in file_names:
+        table_name, part = parse_part_file(file_name)
+        if part == 0 or (part is None and file_name.endswith('.sql') and table_name in data_tables):
+            schema_files.append(file_name)
+        else:
+            other_files.append(file_name)
+    return schema_files, other_files
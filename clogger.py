@@ -1,3 +1,4 @@
+import atexit
 import multiprocessing
 import sys
 import threading
@@ -5,6 +6,9 @@ import threading
 from loguru import logger
 
 log_file_path = './run_log.log'
+# 子进程转发给主进程的日志字段
+FORWARD_FIELDS = ('time', 'name', 'module', 'function', 'line', 'message')
+_forward_queue = None
 
 
 class MyLogger:
@@ -12,6 +16,9 @@ class MyLogger:
         self.logger = logger
         # 清空所有设置
         self.logger.remove()
+        if getattr(multiprocessing.current_process(), '_inheriting', False):
+            # spawn/forkserver 子进程为还原主模块而导入时不打开控制台和日志文件，日志由 forward_to 转发给主进程
+            return
         # 处理进程名
         t_name = threading.current_thread().name
         t_name = "Thread:{thread.name} | "
@@ -37,4 +44,41 @@ class MyLogger:
         return self.logger
 
 
+def forwarding_queue():
+    """
+    在主进程中启动一次日志转发线程，子进程写入返回的队列，日志由主进程写入控制台和日志文件
+
+    :return: 日志队列，创建进程池时传给子进程的 forward_to
+    """
+    global _forward_queue
+    if _forward_queue is None:
+        _forward_queue = multiprocessing.Queue()
+        listener = threading.Thread(target=_listen, args=(_forward_queue,), name='LogForwarder', daemon=True)
+        listener.start()
+        # 退出前先输出队列中剩余的日志
+        atexit.register(_stop_listener, _forward_queue, listener)
+    return _forward_queue
+
+
+def forward_to(log_queue):
+    """
+    在子进程中调用: 移除所有日志输出，之后的日志经队列交给主进程，保留原来的时间、函数和行号
+    """
+    logger.remove()
+    logger.add(lambda message: log_queue.put(dict({key: message.record[key] for key in FORWARD_FIELDS},
+                                                  level=message.record['level'].name)),
+               level='DEBUG', format='{message}')
+
+
+def _listen(log_queue):
+    for record in iter(log_queue.get, None):
+        level, message = record.pop('level'), record.pop('message')
+        logger.patch(lambda r: r.update(record)).log(level, message)
+
+
+def _stop_listener(log_queue, listener):
+    log_queue.put(None)
+    listener.join(timeout=5)
+
+
 clogger = MyLogger().get_logger()
@@ -0,0 +1,255 @@
+import contextlib
+import functools
+import gzip
+import io
+import lzma
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import zstandard
+except ImportError:  # zstd 为可选依赖，未安装时只能使用标准库中的压缩算法
+    zstandard = None
+
+# 压缩算法与文件扩展名
+CODEC_EXTENSIONS = {
+    'zstd': '.zst',
+    'gzip': '.gz',
+    'xz': '.xz',
+    'lzma': '.lzma',
+}
+COPY_BUFFER = 1024 * 1024  # 流式复制的缓冲大小
+RECIPE_EXT = '.chunks'  # 块仓库模式的备份文件只记录内容块的引用，数据存放在块仓库中
+RECIPE_CODEC = 'chunks'  # strip_codec_ext 对块引用文件返回的“压缩算法”
+
+
+def codec_ext(codec):
+    """
+    获取压缩算法对应的文件扩展名，不压缩时为空字符串，算法不可用时抛出异常
+    """
+    if not codec or codec == 'none':
+        return ''
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError(f"不支持的压缩算法：{codec}，可选 {', '.join(CODEC_EXTENSIONS)}")
+    if codec == 'zstd' and zstandard is None:
+        raise RuntimeError("使用 zstd 压缩需要安装 zstandard：pip install zstandard")
+    return CODEC_EXTENSIONS[codec]
+
+
+def strip_codec_ext(file_name):
+    """
+    去掉文件名中的压缩扩展名
+
+    :param file_name: 文件名，如 user.sql.zst
+    :return: (未压缩的文件名, 压缩算法)，未压缩时压缩算法为 None，块引用文件为 RECIPE_CODEC
+    """
+    if file_name.endswith(RECIPE_EXT):
+        return file_name[:-len(RECIPE_EXT)], RECIPE_CODEC
+    for codec, ext in CODEC_EXTENSIONS.items():
+        if file_name.endswith(ext):
+            return file_name[:-len(ext)], codec
+    return file_name, None
+
+
+def wrap_writer(fileobj, codec, level=None):
+    """
+    在二进制输出流外包装压缩流，关闭压缩流时同时关闭 fileobj
+
+    :param fileobj: 二进制输出流
+    :param codec: 压缩算法 zstd/gzip/xz/lzma，为空时不压缩
+    :param level: 压缩级别，为空时使用算法默认值
+    :return: 二进制输出流
+    """
+    if not codec_ext(codec):
+        return fileobj
+    if codec == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        return compressor.stream_writer(fileobj, closefd=True)
+    if codec == 'gzip':
+        return _ClosingWrapper(gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=9 if level is None else level),
+                               fileobj)
+    lzma_format = lzma.FORMAT_XZ if codec == 'xz' else lzma.FORMAT_ALONE
+    return _ClosingWrapper(lzma.LZMAFile(fileobj, 'wb', format=lzma_format, preset=level), fileobj)
+
+
+def wrap_reader(fileobj, codec):
+    """
+    在二进制输入流外包装解压流
+
+    :param fileobj: 二进制输入流
+    :param codec: 压缩算法，为空或 none 时不解压
+    :return: 二进制输入流
+    """
+    if not codec or codec == 'none':
+        return fileobj
+    if codec == RECIPE_CODEC:
+        raise ValueError("块仓库模式的备份文件只能从备份目录中读取")
+    if codec == 'zstd':
+        codec_ext(codec)
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=True), COPY_BUFFER)
+    if codec == 'gzip':
+        return _ClosingWrapper(gzip.GzipFile(fileobj=fileobj, mode='rb'), fileobj)
+    return _ClosingWrapper(lzma.LZMAFile(fileobj, 'rb'), fileobj)
+
+
+def open_writer(path, codec=None, level=None):
+    """
+    打开压缩输出文件，数据在写入时即被压缩，不会产生未压缩的中间文件
+
+    :param path: 未压缩的文件路径，实际写入的文件会加上压缩扩展名
+    :param codec: 压缩算法
+    :param level: 压缩级别
+    :return: (二进制输出流, 实际文件路径)
+    """
+    path = path + codec_ext(codec)
+    return wrap_writer(open(path, 'wb', buffering=COPY_BUFFER), codec, level), path
+
+
+def compress_bytes(data, codec, level=None):
+    """
+    压缩内存中的一段数据，用于块仓库中的内容块
+
+    :param codec: 压缩算法，为空时不压缩
+    :return: 压缩后的字节
+    """
+    if not codec_ext(codec):
+        return bytes(data)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    if codec == 'gzip':
+        # 固定头部中的时间，相同的数据压缩结果相同
+        return gzip.compress(data, compresslevel=9 if level is None else level, mtime=0)
+    return lzma.compress(data, format=lzma.FORMAT_XZ if codec == 'xz' else lzma.FORMAT_ALONE, preset=level)
+
+
+def decompress_bytes(data, codec):
+    # 与 codec_ext 相同，为空或 none 时不解压
+    if not codec or codec == 'none':
+        return data
+    if codec == 'zstd':
+        codec_ext(codec)
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    return lzma.decompress(data)
+
+
+def open_reader(path):
+    """
+    按扩展名打开备份文件，压缩文件在读取时即被解压，块引用文件按顺序读取块仓库中的内容块
+    """
+    if path.endswith(RECIPE_EXT):
+        # repository 依赖本模块，在用到时才导入
+        from repository import open_recipe
+        return open_recipe(path)
+    return wrap_reader(open(path, 'rb', buffering=COPY_BUFFER), strip_codec_ext(path)[1])
+
+
+def open_text_reader(path):
+    """
+    以文本方式读取备份文件，无法解码的字节原样保留，写回时可还原
+    """
+    return io.TextIOWrapper(open_reader(path), encoding='utf-8', errors='surrogateescape', newline='')
+
+
+@contextlib.contextmanager
+def plain_path(path, opener=None):
+    """
+    为需要文件路径的读取方(如 LOAD DATA LOCAL INFILE)提供未压缩数据
+
+    支持命名管道的系统上边解压边读取，不落盘；否则解压到临时文件，用完即删除。
+
+    :param path: 备份文件路径
+    :param opener: 可选，无参函数，返回未压缩数据的二进制输入流，用于读取压缩包成员等不在磁盘上的数据
+    :return: 上下文管理器，产出可读取未压缩数据的路径
+    """
+    if opener is None:
+        if strip_codec_ext(path)[1] is None:
+            yield path
+            return
+        opener = functools.partial(open_reader, path)
+    tmp_dir = tempfile.mkdtemp(prefix='dbbp_')
+    tmp_path = os.path.join(tmp_dir, os.path.basename(strip_codec_ext(path)[0].replace('\\', '/')))
+    try:
+        if hasattr(os, 'mkfifo'):
+            os.mkfifo(tmp_path)
+            errors = []
+            opened = threading.Event()
+            feeder = threading.Thread(target=_feed_fifo, args=(opener, tmp_path, opened, errors), daemon=True)
+            feeder.start()
+            try:
+                yield tmp_path
+            finally:
+                if feeder.is_alive():
+                    # 读取方未读完就退出时，打开读端等待写入线程打开管道后再关闭，写入线程随即因管道断开而退出
+                    fd = os.open(tmp_path, os.O_RDONLY | os.O_NONBLOCK)
+                    opened.wait()
+                    os.close(fd)
+                feeder.join()
+            if errors:
+                # 解压失败时读取方拿到的数据不完整，不能当作成功
+                raise errors[0]
+        else:
+            with opener() as src, open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER)
+            yield tmp_path
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _feed_fifo(opener, fifo_path, opened, errors):
+    # 读取方打开管道后才会开始写入，读取方提前关闭时放弃剩余数据
+    try:
+        with open(fifo_path, 'wb') as dst:
+            opened.set()
+            with opener() as src:
+                shutil.copyfileobj(src, dst, COPY_BUFFER)
+    except BrokenPipeError:
+        pass
+    except Exception as ef:
+        errors.append(ef)
+
+
+class _ClosingWrapper(io.BufferedIOBase):
+    """
+    gzip/lzma 包装已打开的文件对象时不会关闭它，关闭压缩流时一并关闭底层文件
+    """
+
+    def __init__(self, stream, fileobj):
+        super().__init__()
+        self._stream = stream
+        self._fileobj = fileobj
+
+    def readable(self):
+        return self._stream.readable()
+
+    def writable(self):
+        return self._stream.writable()
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def read1(self, size=-1):
+        return self._stream.read1(size)
+
+    def readinto(self, b):
+        return self._stream.readinto(b)
+
+    def write(self, b):
+        return self._stream.write(b)
+
+    def flush(self):
+        self._stream.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            try:
+                self._stream.close()
+            finally:
+                self._fileobj.close()
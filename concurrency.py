@@ -0,0 +1,188 @@
+import threading
+import time
+
+from clogger import clogger
+
+DECREASE_FACTOR = 0.5  # 服务端有压力时并发数乘以该系数
+MIN_GAIN = 1.05  # 增加并发后吞吐至少提升 5% 才保留
+HOLD_INTERVALS = 3  # 增加并发未提升吞吐后，保持并发数不变的采样周期数
+SLOT_POLL_SECONDS = 0.2  # 等待空闲并发名额的轮询间隔
+
+
+def get_global_status(cnx, names):
+    """
+    读取 SHOW GLOBAL STATUS 中的计数器
+
+    :param cnx: mysql.connector 连接
+    :param names: 计数器名列表
+    :return: {计数器名: 整数值}，服务端没有的计数器不返回
+    """
+    cursor = cnx.cursor()
+    cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN (%s)" % ', '.join(['%s'] * len(names)), tuple(names))
+    status = {name: int(value) for name, value in cursor if str(value).isdigit()}
+    cursor.close()
+    return status
+
+
+def get_replication_lag(cnx):
+    """
+    查询本机作为从库时的复制延迟
+
+    :return: 延迟秒数，不是从库或复制线程未运行时返回 None
+    """
+    cursor = cnx.cursor(dictionary=True)
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+    except Exception:
+        # MySQL 8.0.22 之前及 MariaDB 使用 SHOW SLAVE STATUS
+        cursor.execute("SHOW SLAVE STATUS")
+    row = cursor.fetchone()
+    cursor.fetchall()
+    cursor.close()
+    if not row:
+        return None
+    lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+    return None if lag is None else int(lag)
+
+
+class ConcurrencyController:
+    """
+    按服务端负载和吞吐自适应调整并发数(AIMD)
+
+    后台线程每个采样周期读取一次服务端状态:
+    Threads_running、InnoDB 行锁等待数或复制延迟超过阈值时，并发数减半(不低于下限)；
+    没有压力时并发数加一(不超过上限)，如果上一次增加后吞吐没有提升，则撤销这次增加并保持几个周期。
+    吞吐为服务端 Bytes_sent(备份) 或 Bytes_received(还原) 计数器的增量，包含其他客户端的流量。
+    每次调整都会记录日志。
+    """
+
+    def __init__(self, connect, min_workers, max_workers, interval=5, max_threads_running=None,
+                 max_row_lock_waits=None, max_replication_lag=None, bytes_counter='Bytes_sent'):
+        """
+        :param connect: 建立监控连接的函数，返回 mysql.connector 连接
+        :param min_workers: 并发数下限，也是初始并发数
+        :param max_workers: 并发数上限
+        :param interval: 采样周期秒数
+        :param max_threads_running: Threads_running 的上限，包含本工具自己的会话，为空时不检查
+        :param max_row_lock_waits: Innodb_row_lock_current_waits 的上限，为空时不检查
+        :param max_replication_lag: 复制延迟秒数的上限，为空时不检查
+        :param bytes_counter: 计算吞吐的计数器，备份为 Bytes_sent，还原为 Bytes_received
+        """
+        self.connect = connect
+        self.min_workers = max(1, min(min_workers, max_workers))
+        self.max_workers = max_workers
+        self.interval = interval
+        self.max_threads_running = max_threads_running
+        self.max_row_lock_waits = max_row_lock_waits
+        self.max_replication_lag = max_replication_lag
+        self.bytes_counter = bytes_counter
+        self.limit = self.min_workers
+        self.increase_base = None  # 上一次增加并发前的吞吐
+        self.hold = 0
+        self.last_bytes = None
+        self.last_time = None
+        self.cnx = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        clogger.info(f"自适应并发：初始 {self.limit}，范围 {self.min_workers}-{self.max_workers}，"
+                     f"每 {self.interval} 秒采样一次")
+        self.thread = threading.Thread(target=self.run, name='concurrency-controller', daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        if self.cnx is not None:
+            self.cnx.close()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.adjust(self.sample())
+            except Exception as ec:
+                # 监控连接异常时保持当前并发数，下个周期重新连接
+                clogger.warning(f"自适应并发采样失败，保持并发数 {self.limit}：{ec}")
+                if self.cnx is not None:
+                    self.cnx.close()
+                self.cnx = None
+
+    def sample(self):
+        """
+        读取一次服务端状态
+
+        :return: {'threads_running', 'row_lock_waits', 'replication_lag', 'throughput'}，吞吐单位为字节/秒
+        """
+        if self.cnx is None:
+            self.cnx = self.connect()
+        status = get_global_status(self.cnx, ['Threads_running', 'Innodb_row_lock_current_waits',
+                                              self.bytes_counter])
+        now = time.time()
+        total_bytes = status.get(self.bytes_counter)
+        throughput = None
+        if self.last_bytes is not None and total_bytes is not None:
+            throughput = max(0, total_bytes - self.last_bytes) / max(now - self.last_time, 0.001)
+        self.last_bytes, self.last_time = total_bytes, now
+        lag = get_replication_lag(self.cnx) if self.max_replication_lag is not None else None
+        return {'threads_running': status.get('Threads_running'),
+                'row_lock_waits': status.get('Innodb_row_lock_current_waits'),
+                'replication_lag': lag, 'throughput': throughput}
+
+    def pressure(self, sample):
+        # 超过阈值的服务端指标
+        reasons = []
+        for key, threshold in (('threads_running', self.max_threads_running),
+                               ('row_lock_waits', self.max_row_lock_waits),
+                               ('replication_lag', self.max_replication_lag)):
+            if threshold is not None and sample[key] is not None and sample[key] > threshold:
+                reasons.append(f"{key}={sample[key]}>{threshold}")
+        return reasons
+
+    def adjust(self, sample):
+        """
+        根据一次采样调整并发数并记录决策
+
+        :return: 调整后的并发数
+        """
+        old = self.limit
+        throughput = sample['throughput']
+        reasons = self.pressure(sample)
+        if reasons:
+            self.limit = max(self.min_workers, int(old * DECREASE_FACTOR))
+            self.increase_base = None
+            self.hold = 0
+            reason = f"服务端压力 {', '.join(reasons)}"
+        elif throughput is None:
+            reason = "等待吞吐基线"
+        elif self.increase_base is not None and throughput < self.increase_base * MIN_GAIN:
+            # 增加的并发没有带来吞吐提升，瓶颈不在并发数
+            self.limit = max(self.min_workers, old - 1)
+            reason = f"上次增加后吞吐未提升(增加前 {self.increase_base / 1024 / 1024:.2f}MB/s)，撤销"
+            self.increase_base = None
+            self.hold = HOLD_INTERVALS
+        elif self.hold:
+            self.hold -= 1
+            reason = "保持"
+        elif old < self.max_workers:
+            self.limit = old + 1
+            self.increase_base = throughput
+            reason = "无压力，增加"
+        else:
+            self.increase_base = None
+            reason = "已达上限"
+        throughput_text = '-' if throughput is None else f"{throughput / 1024 / 1024:.2f}MB/s"
+        clogger.info(f"自适应并发 {old} -> {self.limit}：{reason}；threads_running={sample['threads_running']} "
+                     f"row_lock_waits={sample['row_lock_waits']} replication_lag={sample['replication_lag']} "
+                     f"吞吐={throughput_text}")
+        return self.limit
+
+    def wait_slot(self, async_results):
+        """
+        等待进程池中未完成的任务数低于当前并发数，再提交下一个任务
+
+        :param async_results: 已提交任务的 AsyncResult 列表
+        """
+        while sum(not r.ready() for r in async_results) >= self.limit:
+            time.sleep(SLOT_POLL_SECONDS)
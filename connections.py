@@ -0,0 +1,208 @@
+import multiprocessing
+import queue
+import random
+import re
+import threading
+import time
+
+import mysql.connector
+
+from clogger import clogger
+
+MAX_RETRY_DELAY_SECONDS = 30  # 重试间隔的上限
+# mysql/mysqldump 命令行无法连接或连接中断时的错误码，如 ERROR 2003 (HY000) 或 Got error: 2003
+CLIENT_CONNECTION_ERROR = re.compile(r'error:? (2002|2003|2005|2006|2013)\b', re.IGNORECASE)
+
+# 当前进程中空闲的连接，按连接参数区分；进程池的子进程同一时刻只执行一个任务，最多保留一个，
+# asyncio 执行方式下主进程中最多保留 max_workers 个
+_idle = {}
+# 当前进程使用的熔断器，主进程在备份或还原开始时安装，进程池的子进程由初始化函数安装
+_breaker = {'breaker': None}
+# 当前线程的连接重试次数，任务开始和结束时各读取一次，得到该任务的重试次数
+_retries = threading.local()
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    熔断器已打开，不再尝试连接数据库
+    """
+
+
+class CircuitBreaker:
+    """
+    进程间共享的熔断器
+
+    连续 threshold 个任务在重试后仍无法连接数据库时打开，之后所有任务立即失败，
+    本次运行很快结束并给出失败列表，而不是每个任务都重试到超时。任意一次连接成功即清零。
+    """
+
+    def __init__(self, threshold):
+        """
+        :param threshold: 打开熔断器的连续连接失败次数，0 表示不熔断
+        """
+        self.threshold = threshold
+        self.failures = multiprocessing.Value('i', 0)
+
+    def is_open(self):
+        return bool(self.threshold) and self.failures.value >= self.threshold
+
+    def record_success(self):
+        with self.failures.get_lock():
+            self.failures.value = 0
+
+    def record_failure(self):
+        with self.failures.get_lock():
+            self.failures.value += 1
+            if self.threshold and self.failures.value == self.threshold:
+                clogger.error(f"连续 {self.threshold} 次无法连接数据库，熔断器打开，剩余任务将直接失败")
+
+
+def install(breaker=None):
+    """
+    在当前进程中启用熔断器，也用作进程池初始化函数的一部分
+
+    :param breaker: CircuitBreaker；多数据库备份时为 {breaker_key(连接参数): CircuitBreaker}，各数据库分别熔断
+    """
+    _breaker['breaker'] = breaker
+
+
+def installed():
+    return _breaker['breaker']
+
+
+def breaker_key(connect_kwargs):
+    # 多数据库备份时按连接的服务器和数据库区分熔断器
+    return f"{connect_kwargs.get('host')}:{connect_kwargs.get('port')}/{connect_kwargs.get('database')}"
+
+
+def find_breaker(connect_kwargs=None):
+    """
+    查找连接参数对应的熔断器
+
+    :param connect_kwargs: 任务的连接参数，只安装了一个熔断器时可以为空
+    :return: CircuitBreaker，未安装时为 None
+    """
+    breaker = _breaker['breaker']
+    if isinstance(breaker, dict):
+        return breaker.get(breaker_key(connect_kwargs or {}))
+    return breaker
+
+
+def check_breaker(connect_kwargs=None):
+    """
+    熔断器打开时抛出 CircuitOpenError，用于不经过本模块连接的任务(如 mysql 命令行)在启动前快速失败
+
+    :param connect_kwargs: 任务的连接参数，用于查找该数据库的熔断器
+    """
+    breaker = find_breaker(connect_kwargs)
+    if breaker is not None and breaker.is_open():
+        raise CircuitOpenError("数据库连接已熔断，跳过该任务")
+
+
+def record_client_result(returncode, stderr, connect_kwargs=None):
+    """
+    按 mysql/mysqldump 命令行的结果更新熔断器，连接类错误计为一次连接失败，成功时清零
+
+    :param returncode: 命令返回码
+    :param stderr: 命令的错误输出
+    :param connect_kwargs: 命令的连接参数，用于查找该数据库的熔断器
+    """
+    breaker = find_breaker(connect_kwargs)
+    if breaker is None:
+        return
+    if returncode == 0:
+        breaker.record_success()
+    elif CLIENT_CONNECTION_ERROR.search(stderr or ''):
+        breaker.record_failure()
+
+
+def connect(connect_kwargs, retries=5, retry_delay=0.5):
+    """
+    连接数据库，失败时按指数退避加随机抖动重试
+
+    :param connect_kwargs: mysql.connector.connect 的参数
+    :param retries: 首次连接失败后的重试次数
+    :param retry_delay: 第一次重试前的基础等待秒数，之后每次翻倍，不超过 30 秒
+    :return: mysql.connector 连接
+    """
+    check_breaker(connect_kwargs)
+    breaker = find_breaker(connect_kwargs)
+    for attempt in range(retries + 1):
+        try:
+            cnx = mysql.connector.connect(**connect_kwargs)
+        except mysql.connector.Error as ec:
+            if attempt == retries:
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            # 全抖动: 在退避上限内随机等待，避免所有进程同时重连
+            delay = random.uniform(0, min(MAX_RETRY_DELAY_SECONDS, retry_delay * 2 ** attempt))
+            _retries.count = retry_count() + 1
+            clogger.info(f"数据库连接异常:{ec}，{delay:.1f}秒后第 {attempt + 1}/{retries} 次重试")
+            time.sleep(delay)
+            check_breaker(connect_kwargs)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return cnx
+
+
+def retry_count():
+    return getattr(_retries, 'count', 0)
+
+
+def acquire(connect_kwargs, retries=5, retry_delay=0.5):
+    """
+    取出当前进程中参数相同的空闲连接，失效的连接丢弃，没有可用连接时新建
+
+    :return: mysql.connector 连接，用完后以 release 归还
+    """
+    check_breaker(connect_kwargs)
+    idle = _idle.setdefault(_key(connect_kwargs), queue.Queue())
+    while True:
+        try:
+            cnx = idle.get_nowait()
+        except queue.Empty:
+            return connect(connect_kwargs, retries, retry_delay)
+        try:
+            # 空闲期间服务端可能已断开连接(如超过 wait_timeout)
+            cnx.ping()
+            return cnx
+        except mysql.connector.Error:
+            _close(cnx)
+
+
+def release(cnx, connect_kwargs):
+    """
+    归还连接，未读完的结果和未结束的事务被丢弃，连接已损坏时直接关闭
+    """
+    try:
+        cnx.consume_results()
+        cnx.rollback()
+    except Exception:
+        _close(cnx)
+        return
+    _idle.setdefault(_key(connect_kwargs), queue.Queue()).put(cnx)
+
+
+def close_all():
+    """
+    关闭当前进程中所有空闲连接
+    """
+    for idle in _idle.values():
+        while True:
+            try:
+                _close(idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+def _key(connect_kwargs):
+    return tuple(sorted(connect_kwargs.items()))
+
+
+def _close(cnx):
+    try:
+        cnx.close()
+    except Exception:
+        pass
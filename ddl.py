@@ -0,0 +1,77 @@
+import re
+
+CREATE_TABLE_PATTERN = re.compile(r'^CREATE TABLE `(?P<table>(?:[^`]|``)+)` \(')
+# 建表语句中可以延后创建的二级索引
+INDEX_PATTERN = re.compile(r'^(?:UNIQUE |FULLTEXT |SPATIAL )?KEY ')
+FOREIGN_KEY_PATTERN = re.compile(r'^CONSTRAINT `(?:[^`]|``)+` FOREIGN KEY ')
+INDEX_COLUMN_PATTERN = re.compile(r'KEY (?:`(?:[^`]|``)+` )?\(`(?P<column>(?:[^`]|``)+)`')
+AUTO_INCREMENT_COLUMN_PATTERN = re.compile(r'^`(?P<column>(?:[^`]|``)+)` .* AUTO_INCREMENT')
+
+
+def split_definitions(definition_lines):
+    """
+    将建表语句中的列和索引定义分为保留的定义、二级索引和外键
+
+    自增列必须有索引，以自增列开头的二级索引保留在建表语句中。
+
+    :param definition_lines: 建表语句括号内的定义行
+    :return: (保留的定义, 二级索引定义, 外键定义)
+    """
+    definitions = [line.strip().rstrip(',') for line in definition_lines]
+    auto_columns = {m.group('column') for m in map(AUTO_INCREMENT_COLUMN_PATTERN.match, definitions) if m}
+    kept, indexes, foreign_keys = [], [], []
+    for definition in definitions:
+        if INDEX_PATTERN.match(definition):
+            column = INDEX_COLUMN_PATTERN.search(definition)
+            if column and column.group('column') in auto_columns:
+                kept.append(definition)
+            else:
+                indexes.append(definition)
+        elif FOREIGN_KEY_PATTERN.match(definition):
+            foreign_keys.append(definition)
+        else:
+            kept.append(definition)
+    return kept, indexes, foreign_keys
+
+
+def rewrite_create_tables(lines, deferred):
+    """
+    改写 SQL 文本中的建表语句，只保留列和主键，二级索引和外键留待数据导入后再创建
+
+    :param lines: 可迭代的 SQL 文本行，如 mysqldump 的输出
+    :param deferred: {表名: (二级索引定义列表, 外键定义列表)}，被移除的定义写入其中
+    :return: 生成器，逐行输出改写后的 SQL
+    """
+    block = None
+    table_name = None
+    for line in lines:
+        if block is None:
+            match = CREATE_TABLE_PATTERN.match(line)
+            if not match:
+                yield line
+                continue
+            table_name = match.group('table').replace('``', '`')
+            block = [line]
+            continue
+        if not line.startswith(')'):
+            block.append(line)
+            continue
+        # 建表语句结束，改写括号内的定义
+        kept, indexes, foreign_keys = split_definitions(block[1:])
+        if indexes or foreign_keys:
+            deferred[table_name] = (indexes, foreign_keys)
+        newline = '\r\n' if block[0].endswith('\r\n') else '\n'
+        yield block[0]
+        yield f',{newline}'.join(f'  {definition}' for definition in kept) + newline
+        yield line
+        block = None
+    if block is not None:
+        yield from block
+
+
+def alter_table_sql(table_name, definitions):
+    """
+    生成一次性补建多个索引或外键的 ALTER TABLE 语句
+    """
+    quoted = '`' + table_name.replace('`', '``') + '`'
+    return f"ALTER TABLE {quoted} " + ', '.join(f'ADD {definition}' for definition in definitions)
@@ -0,0 +1,241 @@
+import datetime
+import decimal
+
+# 与 mysqldump 相同的会话设置，保证输出文件可以直接交给 mysql 命令行还原
+DUMP_HEADER = """/*!40101 SET NAMES utf8mb4 */;
+/*!40103 SET @OLD_TIME_ZONE=@@TIME_ZONE */;
+/*!40103 SET TIME_ZONE='+00:00' */;
+/*!40014 SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0 */;
+/*!40014 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0 */;
+/*!40101 SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */;
+
+"""
+DUMP_FOOTER = """
+/*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
+/*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;
+/*!40014 SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS */;
+/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
+"""
+# 字符串转义规则，与 mysql_real_escape_string 一致
+ESCAPE_TABLE = str.maketrans({
+    '\\': '\\\\',
+    '\0': '\\0',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\x1a': '\\Z',
+    "'": "\\'",
+    '"': '\\"',
+})
+DEFAULT_BATCH_BYTES = 1024 * 1024  # 单条 INSERT 语句的最大字节数，与 mysqldump 的 net_buffer_length 相当
+FETCH_ROWS = 1000  # 每次从服务端读取的行数
+
+
+def quote_identifier(name):
+    return '`' + name.replace('`', '``') + '`'
+
+
+def format_timedelta(value):
+    """
+    将 TIME 列返回的 timedelta 转换为 MySQL 的 [-]HH:MM:SS[.ffffff] 格式
+    """
+    sign = '-' if value < datetime.timedelta(0) else ''
+    microseconds = abs(value.days * 86400_000000 + value.seconds * 1000000 + value.microseconds)
+    seconds, microseconds = divmod(microseconds, 1000000)
+    text = f'{sign}{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+    return f'{text}.{microseconds:06d}' if microseconds else text
+
+
+def sql_literal(value):
+    """
+    将 Python 值转换为 SQL 字面量
+
+    :param value: mysql.connector 返回的列值
+    :return: SQL 字面量字符串
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return "X'" + bytes(value).hex() + "'" if value else "''"
+    if isinstance(value, set):
+        value = ','.join(sorted(value))
+    if isinstance(value, datetime.timedelta):
+        value = format_timedelta(value)
+    elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        value = str(value)
+    return "'" + str(value).translate(ESCAPE_TABLE) + "'"
+
+
+def set_utc_session(cnx):
+    """
+    以 UTC 导出 TIMESTAMP 列，与 DUMP_HEADER 中的 TIME_ZONE 一致，等价于 mysqldump --tz-utc
+    """
+    cursor = cnx.cursor()
+    cursor.execute("SET SESSION time_zone = '+00:00'")
+    cursor.close()
+
+
+def start_snapshot(cnx):
+    """
+    开启一致性快照事务，等价于 mysqldump --single-transaction
+    """
+    cursor = cnx.cursor()
+    cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+    cursor.close()
+
+
+def get_dump_columns(cnx, table_name):
+    """
+    查询需要导出的列，生成列由服务端计算，不能写入
+
+    :return: 列名列表
+    """
+    cursor = cnx.cursor()
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND EXTRA NOT LIKE '%%GENERATED%%' "
+        "ORDER BY ORDINAL_POSITION",
+        (table_name,))
+    columns = [row[0] for row in cursor]
+    cursor.close()
+    return columns
+
+
+def select_rows(cnx, table_name, where=None):
+    """
+    打开非缓冲游标查询表数据，结果逐行从服务端读取，不会把整张表加载到内存
+
+    :return: (游标, 列名列表)
+    """
+    columns = get_dump_columns(cnx, table_name)
+    sql = f"SELECT {', '.join(quote_identifier(c) for c in columns)} FROM {quote_identifier(table_name)}"
+    if where:
+        sql = f"{sql} WHERE {where}"
+    cursor = cnx.cursor(buffered=False)
+    cursor.execute(sql)
+    return cursor, columns
+
+
+def write_create_table(cnx, table_name, out):
+    """
+    写出表(或视图)的 DROP 和 CREATE 语句
+
+    :return: 是否为视图，视图没有数据需要导出
+    """
+    cursor = cnx.cursor()
+    cursor.execute(f"SHOW CREATE TABLE {quote_identifier(table_name)}")
+    row = cursor.fetchone()
+    column_names = cursor.column_names
+    cursor.close()
+    is_view = 'Create View' in column_names
+    kind = 'VIEW' if is_view else 'TABLE'
+    out.write(f"DROP {kind} IF EXISTS {quote_identifier(table_name)};\n")
+    out.write(f"{row[1]};\n\n")
+    return is_view
+
+
+def show_triggers(cnx, table_name):
+    """
+    查询表上的触发器，按同一事件的执行顺序排列
+
+    :return: [(创建时的 sql_mode, CREATE TRIGGER 语句)]
+    """
+    cursor = cnx.cursor()
+    cursor.execute(
+        "SELECT TRIGGER_NAME FROM information_schema.TRIGGERS "
+        "WHERE EVENT_OBJECT_SCHEMA = DATABASE() AND EVENT_OBJECT_TABLE = %s ORDER BY ACTION_ORDER, TRIGGER_NAME",
+        (table_name,))
+    names = [row[0] for row in cursor]
+    triggers = []
+    for name in names:
+        cursor.execute(f"SHOW CREATE TRIGGER {quote_identifier(name)}")
+        _, sql_mode, statement = cursor.fetchall()[0][:3]
+        triggers.append((sql_mode, statement))
+    cursor.close()
+    return triggers
+
+
+def write_triggers(out, triggers):
+    """
+    写出触发器，与 mysqldump 相同放在 DELIMITER 块中并恢复创建时的 sql_mode；
+    触发器必须在数据之后创建，否则导入的每一行都会执行触发器
+
+    :param triggers: show_triggers 的返回值
+    """
+    for sql_mode, statement in triggers:
+        out.write(f"/*!50003 SET @OLD_TRIGGER_SQL_MODE=@@SQL_MODE, SQL_MODE={sql_literal(sql_mode)} */;\n")
+        out.write(f"DELIMITER ;;\n{statement} ;;\nDELIMITER ;\n")
+        out.write("/*!50003 SET SQL_MODE=@OLD_TRIGGER_SQL_MODE */;\n\n")
+
+
+def write_rows(cnx, table_name, out, where=None, batch_bytes=DEFAULT_BATCH_BYTES):
+    """
+    以流式游标读取表数据，写出多行 INSERT 语句，内存占用只与批大小有关
+
+    :param cnx: mysql.connector 连接
+    :param table_name: 表名
+    :param out: 文本输出流
+    :param where: 可选的 where 条件，用于分片导出
+    :param batch_bytes: 单条 INSERT 语句的最大字节数
+    :return: 导出的行数
+    """
+    cursor, columns = select_rows(cnx, table_name, where)
+    prefix = f"INSERT INTO {quote_identifier(table_name)} ({', '.join(quote_identifier(c) for c in columns)}) VALUES "
+    batch = []
+    batch_size = 0
+    row_count = 0
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        for row in rows:
+            values = '(' + ','.join(sql_literal(v) for v in row) + ')'
+            if batch and batch_size + len(values) > batch_bytes:
+                out.write(prefix + ',\n'.join(batch) + ';\n')
+                batch = []
+                batch_size = 0
+            batch.append(values)
+            batch_size += len(values) + 2
+            row_count += 1
+    if batch:
+        out.write(prefix + ',\n'.join(batch) + ';\n')
+    cursor.close()
+    return row_count
+
+
+def dump_table(cnx, table_name, out, where=None, no_data=False, no_create_info=False, triggers=True,
+               single_transaction=True, batch_bytes=DEFAULT_BATCH_BYTES):
+    """
+    使用 mysql.connector 在进程内导出一张表，输出格式可直接由 mysql 命令行还原
+
+    :param cnx: 已连接到目标数据库的 mysql.connector 连接
+    :param table_name: 表名
+    :param out: 文本输出流
+    :param where: 可选的 where 条件
+    :param no_data: 只导出表结构，等价于 --no-data
+    :param no_create_info: 不导出建表语句，等价于 --no-create-info
+    :param triggers: 在数据之后导出表上的触发器，为 False 时等价于 --skip-triggers
+    :param single_transaction: 在一致性快照事务中导出，等价于 --single-transaction
+    :param batch_bytes: 单条 INSERT 语句的最大字节数
+    :return: 导出的行数
+    """
+    set_utc_session(cnx)
+    if single_transaction:
+        start_snapshot(cnx)
+    out.write(DUMP_HEADER)
+    is_view = False
+    if not no_create_info:
+        is_view = write_create_table(cnx, table_name, out)
+    row_count = 0
+    if not no_data and not is_view:
+        row_count = write_rows(cnx, table_name, out, where, batch_bytes)
+    if triggers and not is_view:
+        write_triggers(out, show_triggers(cnx, table_name))
+    out.write(DUMP_FOOTER)
+    if single_transaction:
+        cnx.rollback()
+    return row_count
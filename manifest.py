@@ -0,0 +1,225 @@
+import hashlib
+import json
+import mmap
+import os
+import time
+
+from chunker import parse_part_file
+from codec import strip_codec_ext
+
+MANIFEST_NAME = 'manifest.json'
+CHECKSUM_BATCH = 50  # 每条 CHECKSUM TABLE 语句包含的表数
+HASH_ALGORITHM = 'sha256'  # 备份文件内容哈希算法
+HASH_BLOCK = 16 * 1024 * 1024  # 每次交给哈希函数的字节数，大块数据计算时会释放 GIL
+
+
+def read_manifest(backup_dir):
+    """
+    读取备份目录中的清单文件
+
+    :return: 清单内容，不存在时返回 None
+    """
+    path = os.path.join(backup_dir, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(backup_dir, manifest):
+    """
+    写入清单文件，先写临时文件再替换，中途失败不会留下不完整的清单
+    """
+    path = os.path.join(backup_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def new_manifest(database, parent=None):
+    return {'version': 1, 'database': database, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'parent': parent,
+            'hash': HASH_ALGORITHM, 'tables': {}}
+
+
+def hash_file(path):
+    """
+    以内存映射方式读取文件并计算哈希，不经过用户态缓冲区复制
+
+    :return: (字节数, 十六进制哈希值)
+    """
+    digest = hashlib.new(HASH_ALGORITHM)
+    size = os.path.getsize(path)
+    if size:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for offset in range(0, size, HASH_BLOCK):
+                    digest.update(view[offset:offset + HASH_BLOCK])
+    return size, digest.hexdigest()
+
+
+def hash_stream(src):
+    """
+    计算二进制输入流的哈希，用于压缩包成员等不在磁盘上的文件
+
+    :return: (字节数, 十六进制哈希值)
+    """
+    digest = hashlib.new(HASH_ALGORITHM)
+    size = 0
+    while True:
+        data = src.read(HASH_BLOCK)
+        if not data:
+            break
+        digest.update(data)
+        size += len(data)
+    return size, digest.hexdigest()
+
+
+def find_previous_backup(backup_dir, current_dir, database):
+    """
+    查找同一数据库最近一次带清单的备份目录
+
+    :param backup_dir: 备份根目录
+    :param current_dir: 本次备份目录，不参与查找
+    :param database: 数据库名
+    :return: (目录路径, 清单)，找不到时返回 (None, None)
+    """
+    current = os.path.basename(os.path.normpath(current_dir))
+    for name in sorted(os.listdir(backup_dir), reverse=True):
+        path = os.path.join(backup_dir, name)
+        if name == current or not os.path.isdir(path):
+            continue
+        manifest = read_manifest(path)
+        if manifest and manifest.get('database') == database:
+            return path, manifest
+    return None, None
+
+
+def get_fingerprints(cnx, database, tables, check='auto'):
+    """
+    计算表的变更指纹，指纹不变说明表的数据没有变化
+
+    auto 模式下优先使用 information_schema 中的 UPDATE_TIME(MyISAM 始终可靠，InnoDB 在服务重启后为空)，
+    没有 UPDATE_TIME 的表使用 CHECKSUM TABLE；checksum 模式下全部使用 CHECKSUM TABLE。视图没有指纹，每次都会备份。
+
+    :param cnx: mysql.connector 连接
+    :param database: 数据库名
+    :param tables: 表名列表
+    :param check: auto 或 checksum
+    :return: {表名: 指纹}，无法计算指纹的表不在其中
+    """
+    cursor = cnx.cursor()
+    try:
+        # MySQL 8.0 默认缓存 information_schema 中的统计信息 24 小时，缓存期内 UPDATE_TIME 不会变化
+        cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+    except Exception:
+        # MySQL 5.7 及 MariaDB 没有该变量，统计信息直接读取自存储引擎
+        pass
+    cursor.execute(
+        "SELECT TABLE_NAME, TABLE_TYPE, CREATE_TIME, UPDATE_TIME, TABLE_ROWS "
+        "FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s", (database,))
+    info = {row[0]: row[1:] for row in cursor}
+    fingerprints = {}
+    need_checksum = []
+    for table_name in tables:
+        table_type, create_time, update_time, table_rows = info.get(table_name, ('VIEW', None, None, None))
+        if table_type != 'BASE TABLE':
+            continue
+        if check == 'auto' and update_time is not None:
+            fingerprints[table_name] = {'create_time': str(create_time), 'update_time': str(update_time),
+                                        'rows': table_rows}
+        else:
+            need_checksum.append(table_name)
+    for i in range(0, len(need_checksum), CHECKSUM_BATCH):
+        batch = need_checksum[i:i + CHECKSUM_BATCH]
+        cursor.execute("CHECKSUM TABLE " + ', '.join(f"`{database}`.`{t}`" for t in batch))
+        for full_name, checksum in cursor.fetchall():
+            table_name = full_name.split('.', 1)[1]
+            if checksum is not None:
+                fingerprints[table_name] = {'create_time': str(info[table_name][1]), 'checksum': checksum}
+    cursor.close()
+    return fingerprints
+
+
+def group_files_by_table(backup_dir):
+    """
+    按表名归类备份目录中的备份文件(包括分片和逐表压缩的文件)
+
+    :return: {表名: [文件名]}
+    """
+    groups = {}
+    for file_name in sorted(os.listdir(backup_dir)):
+        plain_name = strip_codec_ext(file_name)[0]
+        if plain_name.endswith(('.sql', '.txt')):
+            groups.setdefault(parse_part_file(plain_name)[0], []).append(file_name)
+    return groups
+
+
+def reuse_table(backup_root, previous_dir, previous_entry, current_dir):
+    """
+    复用上一次备份中未变化的表: 优先建立硬链接，文件系统不支持时在清单中记录引用
+
+    :param backup_root: 备份根目录
+    :param previous_dir: 上一次备份目录
+    :param previous_entry: 上一次清单中该表的记录
+    :param current_dir: 本次备份目录
+    :return: 本次清单中该表的记录，上一次的文件不存在时返回 None
+    """
+    # 上一次备份本身可能也是引用，引用始终指向实际存放文件的目录
+    source_name = previous_entry.get('ref') or os.path.basename(os.path.normpath(previous_dir))
+    source_dir = os.path.join(backup_root, source_name)
+    files = previous_entry.get('files', [])
+    if not files or not all(os.path.isfile(os.path.join(source_dir, f)) for f in files):
+        return None
+    entry = dict(previous_entry, ref=None)
+    try:
+        for file_name in files:
+            os.link(os.path.join(source_dir, file_name), os.path.join(current_dir, file_name))
+    except OSError:
+        for file_name in files:
+            if os.path.isfile(os.path.join(current_dir, file_name)):
+                os.remove(os.path.join(current_dir, file_name))
+        entry['ref'] = source_name
+    return entry
+
+
+def referenced_files(backup_dir):
+    """
+    列出清单中以引用方式复用的文件
+
+    :return: {相对于备份目录的文件路径: 字节数}
+    """
+    manifest = read_manifest(backup_dir)
+    if not manifest:
+        return {}
+    files = {}
+    for entry in manifest['tables'].values():
+        if entry.get('ref'):
+            for file_name in entry['files']:
+                path = os.path.join(os.pardir, entry['ref'], file_name)
+                files[path] = os.path.getsize(os.path.join(backup_dir, path))
+    return files
+
+
+def chained_backups(backup_root, dir_path):
+    """
+    查找与备份目录以引用方式关联的其他备份，打包或删除这些目录中的任何一个都会使引用失效
+
+    :param backup_root: 备份根目录
+    :param dir_path: 备份目录
+    :return: 该目录引用的备份和引用了该目录的备份，按名称排序
+    """
+    dir_name = os.path.basename(os.path.normpath(dir_path))
+    chained = set()
+    manifest = read_manifest(dir_path)
+    if manifest:
+        chained.update(entry['ref'] for entry in manifest['tables'].values() if entry.get('ref'))
+    for name in os.listdir(backup_root):
+        if name == dir_name or not os.path.isdir(os.path.join(backup_root, name)):
+            continue
+        other = read_manifest(os.path.join(backup_root, name))
+        if other and any(entry.get('ref') == dir_name for entry in other['tables'].values()):
+            chained.add(name)
+    return sorted(chained)
@@ -0,0 +1,220 @@
+import collections
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+
+import connections
+
+REPORT_NAME = 'metrics.json'  # 备份目录中的性能报告
+RESTORE_REPORT_EXT = '.metrics.json'  # 还原的性能报告放在备份目录或压缩包旁边
+# Prometheus 指标: {名称: (类型, 说明)}
+PROMETHEUS_METRICS = {
+    'dbbp_run_seconds': ('gauge', 'Wall-clock seconds of the last run'),
+    'dbbp_run_timestamp_seconds': ('gauge', 'Unix time the last run finished'),
+    'dbbp_run_tasks': ('gauge', 'Tasks (tables, chunks or index builds) of the last run'),
+    'dbbp_run_failed_tables': ('gauge', 'Tables that failed in the last run'),
+    'dbbp_run_bytes': ('gauge', 'Bytes of the last run, uncompressed (in) and stored (out)'),
+    'dbbp_run_retries': ('gauge', 'Connection retries in the last run'),
+    'dbbp_run_worker_utilization': ('gauge', 'Busy task seconds divided by max_workers times wall-clock seconds'),
+    'dbbp_phase_seconds': ('gauge', 'Task seconds spent in each phase of the last run'),
+    'dbbp_table_seconds': ('gauge', 'Task seconds per table in the last run'),
+    'dbbp_table_bytes': ('gauge', 'Stored bytes per table in the last run'),
+}
+
+
+class TaskMetrics:
+    """
+    记录一个备份或还原任务的各阶段耗时、字节数和重试次数
+
+    阶段可以嵌套，内层阶段的耗时不计入外层，未归入任何阶段的时间记为 residual 阶段(备份为 dump，还原为 load)。
+    """
+
+    def __init__(self, unit, table, residual='dump'):
+        """
+        :param unit: 任务名，如表名、分片文件名或 二级索引:表名
+        :param table: 表名
+        :param residual: 未归入任何阶段的时间所记的阶段名
+        """
+        self.unit = unit
+        self.table = table
+        self.residual = residual
+        self.phases = collections.defaultdict(float)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.start = time.time()
+        self.retries_before = connections.retry_count()
+        self._nested = []  # 每层正在进行的阶段中，内层阶段已用的时间
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] += elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def meter(self, fileobj, phase, count=False):
+        """
+        包装输出流，写入和关闭的时间计入 phase
+
+        :param count: 写入的字节数计入 bytes_in(未压缩的字节数)
+        """
+        return MeteredWriter(fileobj, self, phase, count)
+
+    def finish(self):
+        """
+        :return: {'unit', 'table', 'worker', 'start', 'seconds', 'phases', 'bytes_in', 'bytes_out', 'retries'}
+        """
+        seconds = time.time() - self.start
+        phases = {name: round(value, 4) for name, value in self.phases.items()}
+        phases[self.residual] = round(max(0.0, seconds - sum(self.phases.values())), 4)
+        return {'unit': self.unit, 'table': self.table, 'worker': f"{os.getpid()}:{threading.current_thread().name}",
+                'start': round(self.start, 3), 'seconds': round(seconds, 4), 'phases': phases,
+                'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                'retries': connections.retry_count() - self.retries_before}
+
+
+class MeteredWriter(io.BufferedIOBase):
+    """
+    统计写入耗时和字节数的二进制输出流，关闭时一并关闭底层输出流
+    """
+
+    def __init__(self, fileobj, metrics, phase, count):
+        super().__init__()
+        self._fileobj = fileobj
+        self._metrics = metrics
+        self._phase = phase
+        self._count = count
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        with self._metrics.phase(self._phase):
+            written = self._fileobj.write(b)
+        if self._count:
+            self._metrics.bytes_in += len(b)
+        return written
+
+    def flush(self):
+        with self._metrics.phase(self._phase):
+            self._fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            # 压缩流关闭时写出剩余的压缩数据
+            with self._metrics.phase(self._phase):
+                self._fileobj.close()
+
+
+def build_report(kind, database, location, tasks, seconds, max_workers, failed_tables, stored_sizes=None):
+    """
+    汇总各任务的指标，生成一次备份或还原的性能报告
+
+    :param kind: backup 或 restore
+    :param database: 数据库名
+    :param location: 备份目录或压缩包路径
+    :param tasks: TaskMetrics.finish 返回值的列表，包括中断前已完成的任务
+    :param seconds: 本次运行的总耗时
+    :param max_workers: 并发数
+    :param failed_tables: 失败的表名列表
+    :param stored_sizes: {任务名: 备份文件字节数}，还原时用于统计读取的字节数
+    :return: 报告字典
+    """
+    tables = {}
+    phases = collections.defaultdict(float)
+    workers = collections.defaultdict(float)
+    for task in tasks:
+        bytes_out = task['bytes_out'] or (stored_sizes or {}).get(task['unit'], 0)
+        table = tables.setdefault(task['table'], {'tasks': 0, 'seconds': 0.0, 'phases': collections.defaultdict(float),
+                                                  'bytes_in': 0, 'bytes_out': 0, 'retries': 0})
+        table['tasks'] += 1
+        table['seconds'] += task['seconds']
+        table['bytes_in'] += task['bytes_in'] or bytes_out
+        table['bytes_out'] += bytes_out
+        table['retries'] += task['retries']
+        for name, value in task['phases'].items():
+            table['phases'][name] += value
+            phases[name] += value
+        workers[task['worker']] += task['seconds']
+    for table in tables.values():
+        table['seconds'] = round(table['seconds'], 3)
+        table['phases'] = {name: round(value, 3) for name, value in table['phases'].items()}
+        table['mb_per_s'] = round(table['bytes_in'] / 1024 / 1024 / table['seconds'], 2) if table['seconds'] else None
+    bytes_in = sum(t['bytes_in'] for t in tables.values())
+    busy = sum(workers.values())
+    return {'kind': kind, 'database': database, 'location': location, 'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'timestamp': round(time.time(), 3), 'seconds': round(seconds, 3), 'max_workers': max_workers,
+            'tasks': len(tasks), 'failed_tables': sorted(set(failed_tables)), 'bytes_in': bytes_in,
+            'bytes_out': sum(t['bytes_out'] for t in tables.values()),
+            'mb_per_s': round(bytes_in / 1024 / 1024 / seconds, 2) if seconds else None,
+            'retries': sum(t['retries'] for t in tables.values()),
+            'worker_utilization': round(busy / (max_workers * seconds), 3) if seconds else None,
+            'phases': {name: round(value, 3) for name, value in sorted(phases.items())},
+            'workers': {name: round(value, 3) for name, value in sorted(workers.items())},
+            'tables': dict(sorted(tables.items()))}
+
+
+def write_report(path, report):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def prometheus_samples(report):
+    # 报告对应的指标行 [(指标名, 标签, 值)]
+    labels = {'kind': report['kind'], 'database': report['database']}
+    samples = [('dbbp_run_seconds', labels, report['seconds']),
+               ('dbbp_run_timestamp_seconds', labels, report['timestamp']),
+               ('dbbp_run_tasks', labels, report['tasks']),
+               ('dbbp_run_failed_tables', labels, len(report['failed_tables'])),
+               ('dbbp_run_bytes', dict(labels, direction='in'), report['bytes_in']),
+               ('dbbp_run_bytes', dict(labels, direction='out'), report['bytes_out']),
+               ('dbbp_run_retries', labels, report['retries']),
+               ('dbbp_run_worker_utilization', labels, report['worker_utilization'] or 0)]
+    samples += [('dbbp_phase_seconds', dict(labels, phase=name), value) for name, value in report['phases'].items()]
+    for name, table in report['tables'].items():
+        samples.append(('dbbp_table_seconds', dict(labels, table=name), table['seconds']))
+        samples.append(('dbbp_table_bytes', dict(labels, table=name), table['bytes_out']))
+    return samples
+
+
+def format_labels(labels):
+    return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for key, value in labels.items())
+
+
+def write_prometheus(path, report):
+    """
+    将报告写入 node_exporter textfile 采集目录中的 .prom 文件
+
+    同一文件中其他数据库或另一种运行(备份/还原)的指标保留，本次运行的指标替换上一次的；
+    先写临时文件再改名，采集时不会读到写了一半的文件。
+    """
+    own = format_labels({'kind': report['kind'], 'database': report['database']})
+    lines = collections.defaultdict(list)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#') or not line.strip() or f'{{{own}' in line:
+                    continue
+                lines[line.split('{')[0].split(' ')[0]].append(line.rstrip('\n'))
+    for name, labels, value in prometheus_samples(report):
+        lines[name].append(f"{name}{{{format_labels(labels)}}} {value}")
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for name, (metric_type, help_text) in PROMETHEUS_METRICS.items():
+            if lines.get(name):
+                f.write(f"# HELP {name} {help_text}\n# TYPE {name} {metric_type}\n")
+                f.write('\n'.join(lines[name]) + '\n')
+    os.replace(tmp_path, path)
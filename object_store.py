@@ -0,0 +1,316 @@
+import collections
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from codec import COPY_BUFFER
+from manifest import HASH_ALGORITHM
+
+URL_PREFIX = 's3://'
+MIN_PART_MB = 5  # S3 分段上传中除最后一段外每段不能小于 5MB
+
+_settings = None  # 本进程使用的对象存储配置，见 install
+_clients = {}  # {进程号: S3 客户端}，客户端可在线程间共用，不能跨进程
+_client_lock = threading.Lock()
+_pending = {}  # {对象 URL: 已上传完数据、尚未提交的上传}，由 commit 提交
+
+
+def install(settings=None):
+    """
+    设置本进程使用的对象存储，进程池的子进程创建时沿用主进程的配置
+
+    :param settings: {'endpoint_url', 'region', 'access_key', 'secret_key', 'part_mb', 'threads'}，为空时取消
+    """
+    global _settings
+    _settings = settings
+    _clients.clear()
+
+
+def installed():
+    return _settings
+
+
+def is_object_url(location):
+    return isinstance(location, str) and location.startswith(URL_PREFIX)
+
+
+def split_url(url):
+    # s3://桶/路径 拆分为 (桶, 对象键)
+    bucket, _, key = url[len(URL_PREFIX):].partition('/')
+    return bucket, key.strip('/')
+
+
+def join_url(url, *names):
+    return '/'.join([url.rstrip('/')] + list(names))
+
+
+def client():
+    # boto3 为可选依赖且导入较慢，只在用到对象存储时导入
+    try:
+        import boto3
+        from botocore.config import Config
+    except ImportError:
+        raise RuntimeError("访问对象存储需要安装 boto3: pip install boto3")
+    if _settings is None:
+        raise RuntimeError("未配置对象存储(s3_url)")
+    with _client_lock:
+        if os.getpid() not in _clients:
+            _clients[os.getpid()] = boto3.session.Session().client(
+                's3', endpoint_url=_settings.get('endpoint_url'), region_name=_settings.get('region'),
+                aws_access_key_id=_settings.get('access_key'), aws_secret_access_key=_settings.get('secret_key'),
+                config=Config(max_pool_connections=max(10, _settings['threads'] * 2),
+                              retries={'max_attempts': 5, 'mode': 'standard'}))
+        return _clients[os.getpid()]
+
+
+def part_size():
+    return int(_settings['part_mb'] * 1024 * 1024)
+
+
+class MultipartWriter(io.BufferedIOBase):
+    """
+    将写入的数据按 part_mb 分段，由 threads 个线程并行上传到对象存储，边写边计算哈希
+
+    同时在内存中的分段不超过 threads 个，分段都在上传时，写入方等待，内存占用不随文件大小增长。
+    关闭时只等待所有分段上传完，不提交上传，提交(commit)前对象不可见，中断时不会留下不完整的对象。
+    不足一个分段的文件在提交时整个上传。
+    """
+
+    def __init__(self, url):
+        super().__init__()
+        self._url = url
+        self._bucket, self._key = split_url(url)
+        self._part_size = part_size()
+        self._buffer = bytearray()
+        self._digest = hashlib.new(HASH_ALGORITHM)
+        self._size = 0
+        self._upload_id = None
+        self._parts = []
+        self._slots = threading.BoundedSemaphore(_settings['threads'])
+        self._executor = None
+        self._error = None
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._digest.update(b)
+        self._size += len(b)
+        self._buffer += b
+        while len(self._buffer) >= self._part_size:
+            part = bytes(self._buffer[:self._part_size])
+            del self._buffer[:self._part_size]
+            self._submit(part)
+        return len(b)
+
+    def _submit(self, data):
+        if self._upload_id is None:
+            self._upload_id = client().create_multipart_upload(Bucket=self._bucket, Key=self._key)['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=_settings['threads'])
+        # 等待空闲的上传线程，分段上传失败时不再继续写入
+        self._slots.acquire()
+        if self._error:
+            self._slots.release()
+            raise self._error
+        self._parts.append(self._executor.submit(self._upload_part, len(self._parts) + 1, data))
+
+    def _upload_part(self, number, data):
+        try:
+            response = client().upload_part(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+                                            PartNumber=number, Body=data)
+            return {'PartNumber': number, 'ETag': response['ETag']}
+        except Exception as eu:
+            self._error = eu
+            raise
+        finally:
+            self._slots.release()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                upload = {'data': bytes(self._buffer)}
+            else:
+                if self._buffer:
+                    self._submit(bytes(self._buffer))
+                upload = {'upload_id': self._upload_id, 'parts': [part.result() for part in self._parts]}
+            self._buffer = bytearray()
+            _pending[self._url] = dict(upload, size=self._size, hash=self._digest.hexdigest())
+        except BaseException:
+            abort_upload(self._bucket, self._key, self._upload_id)
+            raise
+        finally:
+            if self._executor:
+                self._executor.shutdown()
+            super().close()
+
+
+def open_writer(url):
+    """
+    打开对象的输出流，写完关闭后须调用 commit 提交
+
+    :param url: s3://桶/对象键
+    :return: 二进制输出流
+    """
+    return MultipartWriter(url)
+
+
+def commit(url):
+    """
+    提交本进程中已写完的对象，提交后对象才出现在桶中
+
+    :return: (字节数, 十六进制哈希值)，与 hash_file 的返回值相同
+    """
+    upload = _pending.pop(url)
+    bucket, key = split_url(url)
+    if 'data' in upload:
+        client().put_object(Bucket=bucket, Key=key, Body=upload['data'])
+    else:
+        client().complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload['upload_id'],
+                                           MultipartUpload={'Parts': upload['parts']})
+    return upload['size'], upload['hash']
+
+
+def abort_upload(bucket, key, upload_id):
+    if upload_id is None:
+        return
+    from botocore.exceptions import ClientError
+    try:
+        client().abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+    except ClientError:
+        pass
+
+
+def abort_incomplete(url):
+    """
+    放弃 url 下未提交的分段上传，如失败的任务已上传的分段
+
+    :return: 放弃的上传数
+    """
+    bucket, prefix = split_url(url)
+    count = 0
+    for page in client().get_paginator('list_multipart_uploads').paginate(Bucket=bucket, Prefix=prefix + '/'):
+        for upload in page.get('Uploads', []):
+            abort_upload(bucket, upload['Key'], upload['UploadId'])
+            count += 1
+    return count
+
+
+def upload_file(path, url):
+    # 上传本地的小文件，如清单和性能报告
+    bucket, key = split_url(url)
+    with open(path, 'rb') as f:
+        client().put_object(Bucket=bucket, Key=key, Body=f.read())
+
+
+def list_objects(url):
+    """
+    列出 url 下一层的对象
+
+    :return: {对象名: 字节数}
+    """
+    bucket, prefix = split_url(url)
+    objects = {}
+    for page in client().get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix + '/',
+                                                                   Delimiter='/'):
+        for item in page.get('Contents', []):
+            objects[item['Key'][len(prefix) + 1:]] = item['Size']
+    return objects
+
+
+def list_backups(url):
+    """
+    列出 url 下的各次备份
+
+    :return: 备份名列表
+    """
+    bucket, prefix = split_url(url)
+    names = []
+    pages = client().get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix + '/' if prefix else '',
+                                                               Delimiter='/')
+    for page in pages:
+        names += [item['Prefix'].rstrip('/').rsplit('/', 1)[-1] for item in page.get('CommonPrefixes', [])]
+    return sorted(names)
+
+
+def read_json(url):
+    """
+    读取对象中的 JSON，对象不存在时返回 None
+    """
+    from botocore.exceptions import ClientError
+    bucket, key = split_url(url)
+    try:
+        body = client().get_object(Bucket=bucket, Key=key)['Body']
+    except ClientError as ej:
+        if ej.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    with body:
+        return json.loads(body.read())
+
+
+class RangedReader(io.RawIOBase):
+    """
+    按 part_mb 分段读取对象，threads 个线程并行下载之后的分段，内存中最多保留 threads 个分段
+
+    每段请求都带上第一次读取时的 ETag，读取期间对象被覆盖时报错，不会拼出新旧混合的数据。
+    """
+
+    def __init__(self, url, size, etag):
+        super().__init__()
+        self._bucket, self._key = split_url(url)
+        self._size = size
+        self._etag = etag
+        self._part_size = part_size()
+        self._starts = iter(range(0, size, self._part_size))
+        self._executor = ThreadPoolExecutor(max_workers=_settings['threads'])
+        self._pending = collections.deque()
+        self._current = memoryview(b'')
+        for _ in range(_settings['threads']):
+            self._prefetch()
+
+    def _prefetch(self):
+        start = next(self._starts, None)
+        if start is not None:
+            self._pending.append(self._executor.submit(self._get_range, start))
+
+    def _get_range(self, start):
+        end = min(start + self._part_size, self._size) - 1
+        body = client().get_object(Bucket=self._bucket, Key=self._key, Range=f'bytes={start}-{end}',
+                                   IfMatch=self._etag)['Body']
+        with body:
+            return body.read()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self._current):
+            if not self._pending:
+                return 0
+            self._current = memoryview(self._pending.popleft().result())
+            self._prefetch()
+        size = min(len(b), len(self._current))
+        b[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        super().close()
+
+
+def open_reader(url):
+    """
+    打开对象的输入流，多个分段并行下载
+
+    :return: 二进制输入流
+    """
+    bucket, key = split_url(url)
+    head = client().head_object(Bucket=bucket, Key=key)
+    return io.BufferedReader(RangedReader(url, head['ContentLength'], head['ETag']), COPY_BUFFER)
@@ -0,0 +1,357 @@
+import collections
+import contextlib
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import throttle
+from codec import COPY_BUFFER, RECIPE_EXT, codec_ext, compress_bytes, decompress_bytes
+from manifest import HASH_ALGORITHM, MANIFEST_NAME, read_manifest
+
+STORE_DIR = 'chunks'  # 备份根目录下的块仓库，同一备份根目录下的所有备份共用
+MIN_CHUNK = 512 * 1024  # 内容块的最小字节数
+AVG_CHUNK = 2 * 1024 * 1024  # 内容块的平均字节数
+MAX_CHUNK = 8 * 1024 * 1024  # 内容块的最大字节数，超过时不论内容直接切分
+CUT_WINDOW = 64  # 判断切分点时计算换行符之前多少个字节的校验和
+PREFETCH_CHUNKS = 2  # 还原时提前读取和解压的内容块数
+GC_GRACE_SECONDS = 3600  # 垃圾回收不删除最近这么多秒内写入或复用过的块
+
+
+def store_dir_for(backup_dir):
+    # 块仓库放在备份目录的上一级(备份根目录)中
+    return os.path.join(os.path.dirname(os.path.abspath(backup_dir)), STORE_DIR)
+
+
+def _phase(metrics, name):
+    return metrics.phase(name) if metrics else contextlib.nullcontext()
+
+
+class ChunkStore:
+    """
+    以内容哈希为键的块仓库，每个不同的内容块只压缩存放一次: 仓库/哈希前两位/哈希.压缩扩展名
+    """
+
+    def __init__(self, root, codec=None, level=None):
+        """
+        :param root: 仓库目录
+        :param codec: 新写入的块使用的压缩算法
+        :param level: 压缩级别
+        """
+        self.root = root
+        self.codec = codec
+        self.level = level
+
+    def path(self, digest, codec=None):
+        return os.path.join(self.root, digest[:2], digest + codec_ext(codec))
+
+    def put(self, digest, data, metrics=None):
+        """
+        存入一个内容块，仓库中已有时只更新修改时间，不压缩也不写盘
+
+        :param digest: 块内容的哈希
+        :param data: 块内容
+        :param metrics: 任务的 TaskMetrics，压缩和写盘的耗时分别计入 compress 和 write 阶段
+        :return: 新写入的字节数，已有的块为 0
+        """
+        path = self.path(digest, self.codec)
+        try:
+            # 标记为刚被引用，垃圾回收不会删除
+            os.utime(path)
+            return 0
+        except FileNotFoundError:
+            pass
+        with _phase(metrics, 'compress'):
+            stored = compress_bytes(data, self.codec, self.level)
+        with _phase(metrics, 'write'):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再改名，多个进程同时写入同一个块时内容相同，后改名的覆盖先改名的
+            tmp_path = f"{path}.{os.getpid()}_{threading.get_ident()}.tmp"
+            with throttle.wrap_write(open(tmp_path, 'wb')) as f:
+                f.write(stored)
+            os.replace(tmp_path, path)
+        return len(stored)
+
+    def get(self, digest, codec, check=False):
+        """
+        读取并解压一个内容块
+
+        :param codec: 块引用文件中记录的压缩算法
+        :param check: 校验解压后内容的哈希
+        :return: 块内容
+        """
+        path = self.path(digest, codec)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"块仓库中缺少内容块 {digest}")
+        with open(path, 'rb') as f:
+            data = decompress_bytes(f.read(), codec)
+        if check and hashlib.new(HASH_ALGORITHM, data).hexdigest() != digest:
+            raise ValueError(f"内容块 {digest} 的哈希与内容不一致")
+        return data
+
+
+class ChunkWriter(io.BufferedIOBase):
+    """
+    将写入的数据按内容切分为块存入块仓库，同时把块的引用逐行写入块引用文件
+
+    在换行符处切分: 块达到 MIN_CHUNK 后，换行符前 CUT_WINDOW 个字节的校验和落在阈值内时切分，阈值随距上一个换行符的
+    字节数增大，块的平均大小与行的长短无关。切分点只取决于附近的内容，未变化的数据切分出相同的块，只需查找哈希，
+    不再压缩和写盘；表中间的数据变化后，之后的切分点很快重新对齐。
+    引用在每个块写完后立即写入文件，垃圾回收能看到正在进行的备份引用的块。
+    """
+
+    def __init__(self, store, recipe_path, metrics=None):
+        """
+        :param store: ChunkStore
+        :param recipe_path: 块引用文件路径
+        :param metrics: 任务的 TaskMetrics，切分和计算哈希的耗时计入 dedup 阶段，未压缩的字节数计入 bytes_in，
+                        新写入的块的字节数计入 bytes_out
+        """
+        super().__init__()
+        self._store = store
+        self._metrics = metrics
+        self._buffer = bytearray()
+        self._scan = MIN_CHUNK  # 下一次从这里开始查找换行符
+        self._last_line = 0  # 上一个已检查的换行符之后的位置
+        self._size = 0
+        self._digest = hashlib.new(HASH_ALGORITHM)  # 各块哈希的哈希，校验时与块的内容比对
+        self._recipe = open(recipe_path, 'w', encoding='utf-8', newline='\n')
+        self._write_record({'version': 1, 'codec': store.codec})
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self._metrics:
+            self._metrics.bytes_in += len(b)
+        self._buffer += b
+        if len(self._buffer) >= MIN_CHUNK:
+            self._emit_chunks(final=False)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._emit_chunks(final=True)
+            self._write_record({'size': self._size, 'hash': self._digest.hexdigest()})
+        finally:
+            try:
+                super().close()
+            finally:
+                self._recipe.close()
+
+    def _emit_chunks(self, final):
+        while True:
+            with _phase(self._metrics, 'dedup'):
+                cut = self._find_cut(final)
+                if cut is None:
+                    return
+                chunk = bytes(self._buffer[:cut])
+                del self._buffer[:cut]
+                self._scan, self._last_line = MIN_CHUNK, 0
+                digest = hashlib.new(HASH_ALGORITHM, chunk).hexdigest()
+                self._digest.update(bytes.fromhex(digest))
+            stored = self._store.put(digest, chunk, self._metrics)
+            if self._metrics:
+                self._metrics.bytes_out += stored
+            self._size += len(chunk)
+            self._write_record({'chunk': digest, 'size': len(chunk)})
+
+    def _find_cut(self, final):
+        # 返回缓冲区中第一个切分点，数据不够时返回 None
+        buffer = self._buffer
+        limit = min(len(buffer), MAX_CHUNK)
+        span = AVG_CHUNK - MIN_CHUNK
+        while True:
+            newline = buffer.find(b'\n', self._scan, limit)
+            if newline < 0:
+                break
+            cut = newline + 1
+            gap = cut - max(self._last_line, MIN_CHUNK - CUT_WINDOW)
+            self._scan = self._last_line = cut
+            if zlib.crc32(buffer[max(0, cut - CUT_WINDOW):cut]) * span < gap << 32:
+                return cut
+        self._scan = max(self._scan, limit)
+        if len(buffer) >= MAX_CHUNK:
+            return MAX_CHUNK
+        if final and buffer:
+            return len(buffer)
+        return None
+
+    def _write_record(self, record):
+        self._recipe.write(json.dumps(record) + '\n')
+        self._recipe.flush()
+
+
+def read_recipe(path):
+    """
+    读取块引用文件
+
+    :return: (头部, [(块哈希, 字节数)], 尾部)，未写完的文件尾部为 None
+    """
+    header, chunks, footer = None, [], None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断时未写完的最后一行
+                continue
+            if 'chunk' in record:
+                chunks.append((record['chunk'], record['size']))
+            elif header is None:
+                header = record
+            else:
+                footer = record
+    return header, chunks, footer
+
+
+def recipe_size(path):
+    """
+    块引用文件对应的原始字节数，只读取文件末尾的尾部记录
+    """
+    with open(path, 'rb') as f:
+        f.seek(max(0, os.path.getsize(path) - 1024))
+        lines = f.read().splitlines()
+    try:
+        return json.loads(lines[-1])['size']
+    except (IndexError, KeyError, ValueError):
+        return sum(size for _, size in read_recipe(path)[1])
+
+
+class RecipeReader(io.RawIOBase):
+    """
+    按顺序读取块引用文件中的内容块，后台线程提前读取和解压之后的几个块
+    """
+
+    def __init__(self, store, chunks, codec):
+        super().__init__()
+        self._store = store
+        self._codec = codec
+        self._chunks = iter(chunks)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = collections.deque()
+        self._current = memoryview(b'')
+        for _ in range(PREFETCH_CHUNKS):
+            self._prefetch()
+
+    def _prefetch(self):
+        entry = next(self._chunks, None)
+        if entry is not None:
+            self._pending.append(self._executor.submit(self._store.get, entry[0], self._codec))
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self._current):
+            if not self._pending:
+                return 0
+            self._current = memoryview(self._pending.popleft().result())
+            self._prefetch()
+        size = min(len(b), len(self._current))
+        b[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        super().close()
+
+
+def open_recipe(path):
+    """
+    打开块引用文件，读出的是备份时写入的原始数据
+
+    :return: 二进制输入流
+    """
+    header, chunks, footer = read_recipe(path)
+    if header is None or footer is None:
+        raise ValueError(f"块引用文件 {path} 不完整")
+    store = ChunkStore(store_dir_for(os.path.dirname(path)))
+    return io.BufferedReader(RecipeReader(store, chunks, header['codec']), COPY_BUFFER)
+
+
+def verify_recipe(path):
+    """
+    读取块引用文件中的全部内容块，校验每个块的哈希、总字节数和尾部记录的哈希，不一致时抛出异常
+    """
+    header, chunks, footer = read_recipe(path)
+    if header is None or footer is None:
+        raise ValueError(f"块引用文件 {path} 不完整")
+    store = ChunkStore(store_dir_for(os.path.dirname(path)))
+    digest = hashlib.new(HASH_ALGORITHM)
+    size = 0
+    for chunk, chunk_size in chunks:
+        data = store.get(chunk, header['codec'], check=True)
+        if len(data) != chunk_size:
+            raise ValueError(f"内容块 {chunk} 的大小与引用不一致")
+        digest.update(bytes.fromhex(chunk))
+        size += chunk_size
+    if size != footer['size'] or digest.hexdigest() != footer['hash']:
+        raise ValueError(f"块引用文件 {path} 的内容与尾部记录不一致")
+
+
+def prune_backups(backup_dir, keep):
+    """
+    只保留最近 keep 次备份，删除更早的备份目录
+
+    没有清单的目录(未完成的备份、binlog 目录和块仓库)不删除；被保留的备份以引用方式复用的目录也不删除。
+
+    :param backup_dir: 备份根目录
+    :param keep: 保留的备份数
+    :return: 删除的目录名列表
+    """
+    runs = sorted(name for name in os.listdir(backup_dir)
+                  if os.path.isfile(os.path.join(backup_dir, name, MANIFEST_NAME)))
+    kept = runs[-keep:] if keep else runs
+    needed = set(kept)
+    for name in kept:
+        manifest = read_manifest(os.path.join(backup_dir, name))
+        needed.update(entry['ref'] for entry in manifest['tables'].values() if entry.get('ref'))
+    removed = [name for name in runs if name not in needed]
+    for name in removed:
+        shutil.rmtree(os.path.join(backup_dir, name))
+    return removed
+
+
+def collect_garbage(backup_dir, grace_seconds=GC_GRACE_SECONDS):
+    """
+    删除块仓库中不再被任何块引用文件引用的块
+
+    未完成目录中正在写入的引用文件同样计入；grace_seconds 内写入或复用过的块不删除，
+    覆盖备份查到块已存在到写入引用之间的间隔。
+
+    :param backup_dir: 备份根目录
+    :return: (删除的块数, 释放的字节数)
+    """
+    store_dir = os.path.join(backup_dir, STORE_DIR)
+    if not os.path.isdir(store_dir):
+        return 0, 0
+    live = set()
+    for root, dirs, files in os.walk(backup_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != store_dir]
+        for name in files:
+            if name.endswith(RECIPE_EXT):
+                live.update(chunk for chunk, _ in read_recipe(os.path.join(root, name))[1])
+    cutoff = time.time() - grace_seconds
+    removed = freed = 0
+    for prefix in os.listdir(store_dir):
+        prefix_dir = os.path.join(store_dir, prefix)
+        for name in os.listdir(prefix_dir):
+            path = os.path.join(prefix_dir, name)
+            stat = os.stat(path)
+            # 写入中断留下的临时文件同样按修改时间清理
+            if name.split('.')[0] in live and not name.endswith('.tmp') or stat.st_mtime >= cutoff:
+                continue
+            os.remove(path)
+            removed += 1
+            freed += stat.st_size
+    return removed, freed
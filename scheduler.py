@@ -0,0 +1,111 @@
+import fnmatch
+import os
+
+from clogger import clogger
+
+
+def get_table_sizes(cnx, database):
+    """
+    从 information_schema.TABLES 读取每张表的体积估算
+
+    :param cnx: 已建立的 mysql.connector 连接
+    :param database: 数据库名
+    :return: {表名: (数据+索引字节数, 估算行数)}
+    """
+    cursor = cnx.cursor()
+    cursor.execute(
+        "SELECT TABLE_NAME, COALESCE(DATA_LENGTH, 0) + COALESCE(INDEX_LENGTH, 0), COALESCE(TABLE_ROWS, 0) "
+        "FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s",
+        (database,))
+    sizes = {name: (int(size), int(rows)) for name, size, rows in cursor}
+    cursor.close()
+    return sizes
+
+
+def get_file_sizes(restore_dir, file_names):
+    """
+    读取备份文件的字节数，作为还原耗时的估算
+
+    :param restore_dir: 备份目录
+    :param file_names: 备份文件名列表
+    :return: {文件名: (字节数, 0)}
+    """
+    return {name: (os.path.getsize(os.path.join(restore_dir, name)), 0) for name in file_names}
+
+
+def lpt_order(names, sizes):
+    """
+    按照最长处理时间优先(LPT)排序任务
+
+    进程池按提交顺序把任务派发给空闲的进程，因此大表先提交、小表随后填充空闲进程，
+    总耗时会接近最大单表的耗时，而不是被排在末尾的大表拖长。
+
+    :param names: 任务名列表(表名或文件名)
+    :param sizes: {任务名: (字节数, 行数)}，缺失的任务视为 0
+    :return: 由大到小排序后的任务名列表
+    """
+    ordered = sorted(names, key=lambda name: sizes.get(name, (0, 0)), reverse=True)
+    if ordered:
+        total = sum(sizes.get(name, (0, 0))[0] for name in ordered)
+        largest = sizes.get(ordered[0], (0, 0))[0]
+        if total:
+            clogger.info(f"最大任务 {ordered[0]} 约 {largest / 1024 / 1024:.2f}MB，"
+                         f"占总量 {largest / total * 100:.1f}%")
+    return ordered
+
+
+def match_patterns(name, patterns):
+    """
+    判断表名是否匹配任一表名或通配符(如 user_*)
+
+    :param name: 表名
+    :param patterns: 表名或通配符列表
+    """
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def tier_index(name, tiers):
+    """
+    查找表名所在的优先级层
+
+    :param name: 表名
+    :param tiers: 每层的表名或通配符列表，按优先级由高到低排列
+    :return: 层序号，从 0 开始，不匹配任何一层时为 len(tiers)
+    """
+    for index, patterns in enumerate(tiers or []):
+        if match_patterns(name, patterns):
+            return index
+    return len(tiers or [])
+
+
+def assign_tiers(names, tiers, table_of=lambda name: name):
+    """
+    将任务按表名分到优先级层中，层内保持原有顺序(大任务优先)
+
+    :param names: 任务名列表(表名或文件名)
+    :param tiers: 每层的表名或通配符列表
+    :param table_of: 由任务名得到表名的函数
+    :return: 共 len(tiers) + 1 层的任务名列表，最后一层为不匹配任何一层的任务
+    """
+    assigned = [[] for _ in range(len(tiers or []) + 1)]
+    for name in names:
+        assigned[tier_index(table_of(name), tiers)].append(name)
+    return assigned
+
+
+def pick_task(pending_groups, running_groups, limit, group_limit=None):
+    """
+    选出下一个可以启动的任务: 按顺序第一个所在分组(如服务器)未达到并发上限的任务
+
+    :param pending_groups: 待启动任务所属的分组，按启动顺序(大任务优先)排列
+    :param running_groups: 正在运行的任务所属的分组
+    :param limit: 合计的并发上限
+    :param group_limit: 单个分组的并发上限，为空时不限制
+    :return: pending_groups 中的下标，没有可以启动的任务时为 None
+    """
+    if len(running_groups) >= limit:
+        return None
+    for index, group in enumerate(pending_groups):
+        if group_limit is None or running_groups.count(group) < group_limit:
+            return index
+    return None
@@ -0,0 +1,176 @@
+import multiprocessing
+import queue
+import time
+
+import mysql.connector
+
+import binlog
+from dump_engine import start_snapshot
+
+CONNECT_TIMEOUT_SECONDS = 60  # 等待所有快照连接建立的时间，此时尚未加锁，包括进程池启动子进程的时间
+LOCK_TIMEOUT_SECONDS = 5  # 持有全局读锁等待所有连接开启快照的时间，超时后释放锁并放弃备份
+
+# 当前进程中已开启快照事务的连接，进程池的每个子进程一个，asyncio 执行方式下主进程中有 max_workers 个
+_connections = queue.Queue()
+
+
+class SnapshotLock:
+    """
+    协调多个连接开启同一时刻的一致性快照
+
+    各连接(在子进程或主进程中)先建立好，然后才执行 FLUSH TABLES WITH READ LOCK；持有锁期间各连接只执行
+    START TRANSACTION WITH CONSISTENT SNAPSHOT，随后读取 binlog/GTID 位置并释放锁。锁只阻塞写入几毫秒，
+    启动进程和建立连接都不在锁内，之后所有连接都从这一时刻的快照并行导出，与单线程 mysqldump --single-transaction 一样一致。
+    """
+
+    def __init__(self, connect_kwargs):
+        """
+        :param connect_kwargs: mysql.connector.connect 的参数，子进程用它建立快照连接
+        """
+        self.connect_kwargs = connect_kwargs
+        self.connected = multiprocessing.Queue()  # 子进程建立连接的结果，成功时为空字符串，失败时为错误信息
+        self.started = multiprocessing.Queue()  # 子进程开启快照的结果
+        self.start = multiprocessing.Event()  # 已加锁(或已放弃)，等待中的子进程继续
+        self.locked = multiprocessing.Value('b', 0)
+        self.cnx = None
+
+    def __enter__(self):
+        self.cnx = mysql.connector.connect(**self.connect_kwargs)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.unlock()
+        finally:
+            # 放弃时唤醒仍在等待的子进程，锁已释放，它们不会开启快照
+            self.start.set()
+            self.cnx.close()
+
+    def worker_args(self):
+        # join 的参数，可以通过进程池初始化函数传给子进程
+        return self.connect_kwargs, self.connected, self.start, self.locked, self.started
+
+    def lock(self):
+        cursor = self.cnx.cursor()
+        cursor.execute("FLUSH TABLES WITH READ LOCK")
+        cursor.close()
+        self.locked.value = 1
+
+    def unlock(self):
+        if not self.locked.value:
+            return
+        self.locked.value = 0
+        cursor = self.cnx.cursor()
+        cursor.execute("UNLOCK TABLES")
+        cursor.close()
+
+    def wait_workers(self, count):
+        """
+        等待 count 个子进程建立连接后加锁，等它们开启快照，读取锁定期间的 binlog 位置后释放锁
+
+        :return: {'file', 'position', 'gtid'}，服务端未开启 binlog 时为 None
+        """
+        _wait(self.connected, count, CONNECT_TIMEOUT_SECONDS, "建立")
+        self.lock()
+        try:
+            self.start.set()
+            _wait(self.started, count, LOCK_TIMEOUT_SECONDS, "开启")
+            return binlog.get_binlog_position(self.cnx)
+        finally:
+            self.unlock()
+
+    def snapshot(self, connections):
+        """
+        在当前进程中为已建立的连接开启快照，放入当前进程的快照连接池，读取锁定期间的 binlog 位置后释放锁
+
+        :param connections: mysql.connector 连接列表
+        :return: {'file', 'position', 'gtid'}，服务端未开启 binlog 时为 None
+        """
+        self.lock()
+        try:
+            for cnx in connections:
+                start_snapshot(cnx)
+                _connections.put(cnx)
+            return binlog.get_binlog_position(self.cnx)
+        finally:
+            self.unlock()
+
+
+def _wait(results, count, timeout, action):
+    deadline = time.monotonic() + timeout
+    for _ in range(count):
+        try:
+            error = results.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            raise TimeoutError(f"{timeout} 秒内未能{action}全部一致性快照连接")
+        if error:
+            raise RuntimeError(f"{action}一致性快照连接失败：{error}")
+
+
+def join(connect_kwargs, connected, start, locked, started):
+    """
+    建立一个连接，等主进程加全局读锁后开启快照事务，放入当前进程的快照连接池，用作进程池初始化函数的一部分
+
+    全局读锁已释放时(如进程池替换了异常退出的子进程，或主进程已放弃)不再开启快照，
+    该进程中的备份任务会失败而不是导出不一致的数据。
+
+    :param connect_kwargs: mysql.connector.connect 的参数
+    :param connected: 建立连接的结果队列
+    :param start: 主进程加锁(或放弃)后设置的事件
+    :param locked: 全局读锁是否仍被持有
+    :param started: 开启快照的结果队列
+    """
+    if start.is_set():
+        return
+    try:
+        cnx = mysql.connector.connect(**connect_kwargs)
+    except Exception as ej:
+        connected.put(str(ej))
+        return
+    connected.put('')
+    start.wait(CONNECT_TIMEOUT_SECONDS + LOCK_TIMEOUT_SECONDS)
+    if not locked.value:
+        cnx.close()
+        return
+    try:
+        start_snapshot(cnx)
+    except Exception as ej:
+        cnx.close()
+        started.put(str(ej))
+        return
+    _connections.put(cnx)
+    started.put('')
+
+
+def acquire():
+    """
+    取出当前进程的一个快照连接，用完后以 release 归还
+    """
+    try:
+        return _connections.get_nowait()
+    except queue.Empty:
+        raise RuntimeError("当前进程没有一致性快照连接，全局读锁释放后启动的进程不能加入快照")
+
+
+def release(cnx):
+    # 任务失败时连接上可能还有未读完的结果，读完后才能执行下一条查询
+    try:
+        cnx.consume_results()
+    except Exception:
+        pass
+    _connections.put(cnx)
+
+
+def close_all():
+    """
+    结束当前进程中所有快照事务并关闭连接
+    """
+    while True:
+        try:
+            cnx = _connections.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            cnx.rollback()
+        finally:
+            cnx.close()
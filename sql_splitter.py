@@ -0,0 +1,188 @@
+import queue
+import re
+import threading
+
+DEFAULT_BATCH_BYTES = 4 * 1024 * 1024  # 每个导入任务包含的 INSERT 语句总字节数
+
+STRING_BODY = r"(?:[^'\\]|\\.|'')*"
+# 从字符串内部开始，匹配到字符串结束的引号
+CLOSE_STRING = re.compile(STRING_BODY + "'", re.S)
+# 完整的字符串常量
+STRINGS = re.compile("'" + STRING_BODY + "'", re.S)
+INSERT_PATTERN = re.compile(r'^(?:INSERT|REPLACE)\s+INTO\s', re.I)
+# 会话设置: 需要在每个导入连接上执行，如 /*!40101 SET NAMES utf8mb4 */、SET time_zone、USE
+SESSION_PATTERN = re.compile(r'^(?:/\*!\d+\s*)?(?:SET|USE)\s', re.I)
+# 并行导入时不能使用的语句: 表锁只对单个会话有效，DISABLE KEYS 只对 MyISAM 有效
+SKIP_PATTERN = re.compile(r'^(?:LOCK TABLES|UNLOCK TABLES|/\*!\d+\s*ALTER TABLE \S+ (?:DISABLE|ENABLE) KEYS)', re.I)
+
+
+def ends_in_string(line, in_string):
+    """
+    判断一行结束时是否处于单引号字符串内部
+
+    :param line: SQL 文本行
+    :param in_string: 这一行开始时是否在字符串内部
+    """
+    pos = 0
+    if in_string:
+        match = CLOSE_STRING.match(line)
+        if not match:
+            return True
+        pos = match.end()
+    return "'" in STRINGS.sub('', line[pos:])
+
+
+def classify(statement):
+    """
+    :return: insert、session、ddl，或 None 表示跳过
+    """
+    if INSERT_PATTERN.match(statement):
+        return 'insert'
+    if SKIP_PATTERN.match(statement):
+        return None
+    if SESSION_PATTERN.match(statement):
+        return 'session'
+    return 'ddl'
+
+
+def split_statements(lines):
+    """
+    将 mysqldump 风格的 SQL 文本流式拆分为语句
+
+    语句以行尾的分隔符结束，字符串常量中的分隔符和换行不会截断语句；
+    支持 DELIMITER 切换分隔符(触发器、存储过程)，语句之间的空行和 -- 注释被丢弃。
+
+    :param lines: 可迭代的 SQL 文本行
+    :return: 生成 (类型, 去掉分隔符的语句)，类型见 classify
+    """
+    delimiter = ';'
+    buffer = []
+    in_string = False
+    for line in lines:
+        if not buffer:
+            stripped = line.strip()
+            if not stripped or stripped.startswith('--'):
+                continue
+            if stripped.upper().startswith('DELIMITER '):
+                delimiter = stripped.split(None, 1)[1]
+                continue
+        buffer.append(line)
+        in_string = ends_in_string(line, in_string)
+        if in_string or not line.rstrip().endswith(delimiter):
+            continue
+        statement = ''.join(buffer).rstrip()[:-len(delimiter)].rstrip()
+        buffer = []
+        kind = classify(statement)
+        if kind:
+            yield kind, statement
+    statement = ''.join(buffer).strip()
+    if statement and classify(statement):
+        # 文件末尾没有分隔符的语句
+        yield classify(statement), statement
+
+
+def replay_statements(statements, connect, workers, session_sql=(), batch_bytes=DEFAULT_BATCH_BYTES):
+    """
+    由多个连接并行执行 INSERT 语句，DDL 和会话设置按文件中的顺序执行
+
+    INSERT 语句按 batch_bytes 分批交给 workers 个导入线程，每批在一个事务中提交；
+    遇到 DDL 或会话设置时先等待之前的数据全部导入，再在控制连接上执行，
+    会话设置同时记录下来，导入线程在执行下一批数据前补上，保证每个连接的会话环境与单线程导入相同。
+
+    :param statements: split_statements 生成的语句
+    :param connect: 建立连接的无参函数
+    :param workers: 导入线程数
+    :param session_sql: 每个连接首先执行的会话设置语句
+    :param batch_bytes: 每批 INSERT 语句的总字节数
+    :return: 执行的语句数
+    """
+    jobs = queue.Queue(maxsize=workers * 2)  # 解析速度快于导入时阻塞，内存中最多保留这么多批数据
+    settings = list(session_sql)
+    errors = []
+    control = connect()
+    threads = [threading.Thread(target=_load_batches, args=(connect, jobs, settings, errors), daemon=True)
+               for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    count = 0
+    batch, size = [], 0
+    try:
+        cursor = control.cursor()
+        for sql in settings:
+            cursor.execute(sql)
+        for kind, statement in statements:
+            if errors:
+                break
+            count += 1
+            if kind == 'insert':
+                batch.append(statement)
+                size += len(statement)
+                if size >= batch_bytes:
+                    jobs.put(batch)
+                    batch, size = [], 0
+                continue
+            if batch:
+                jobs.put(batch)
+                batch, size = [], 0
+            # DDL 和会话设置必须在之前的数据之后执行，如建触发器不能作用于之前的 INSERT
+            jobs.join()
+            if errors:
+                break
+            cursor.execute(_encode(statement))
+            if kind == 'session':
+                settings.append(statement)
+        if batch and not errors:
+            jobs.put(batch)
+        jobs.join()
+        cursor.close()
+        control.commit()
+    except Exception as er:
+        # 导入线程不再执行剩余的数据
+        errors.append(er)
+        raise
+    finally:
+        for _ in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
+        control.close()
+    if errors:
+        raise errors[0]
+    return count
+
+
+def _load_batches(connect, jobs, settings, errors):
+    # 导入线程: 收到第一批数据时才建立连接，出错后只取出剩余任务不再执行
+    cnx = None
+    applied = 0
+    try:
+        while True:
+            batch = jobs.get()
+            try:
+                if batch is None:
+                    return
+                if errors:
+                    continue
+                if cnx is None:
+                    cnx = connect()
+                cursor = cnx.cursor()
+                # 主线程只在所有任务完成后追加会话设置，此时读取是安全的
+                for sql in settings[applied:]:
+                    cursor.execute(_encode(sql))
+                applied = len(settings)
+                for statement in batch:
+                    cursor.execute(_encode(statement))
+                cursor.close()
+                cnx.commit()
+            except Exception as el:
+                errors.append(el)
+            finally:
+                jobs.task_done()
+    finally:
+        if cnx is not None:
+            cnx.close()
+
+
+def _encode(statement):
+    # 读取备份时无法解码的字节以 surrogateescape 保留，按原字节发送
+    return statement.encode('utf-8', errors='surrogateescape')
@@ -0,0 +1,126 @@
+"""
+基准测试的合成数据: 表清单、行数据，以及不连接数据库的 mysqldump/mysql 替身
+
+只依赖标准库，替身每次导出或还原都会启动一个新的解释器，不导入备份工具本身。
+用法: python synthetic.py mysqldump|mysql [原命令的参数]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+# 合成数据的规模: 大量小表、少量大表、宽行表和 BLOB 表
+PROFILES = {
+    'small': {'tiny': 50, 'huge': 1, 'huge_rows': 20000, 'wide': 1, 'wide_rows': 2000, 'blob': 1, 'blob_rows': 50},
+    'default': {'tiny': 500, 'huge': 3, 'huge_rows': 500000, 'wide': 2, 'wide_rows': 50000, 'blob': 2,
+                'blob_rows': 500},
+    'large': {'tiny': 2000, 'huge': 4, 'huge_rows': 5000000, 'wide': 4, 'wide_rows': 200000, 'blob': 4,
+              'blob_rows': 2000},
+}
+WIDE_COLUMNS = 60
+BLOB_BYTES = 16 * 1024
+# 每种表的字段定义和导出后每行的大致字节数
+KINDS = {
+    'tiny': ("id INT PRIMARY KEY, name VARCHAR(32), value INT", 40),
+    'huge': ("id BIGINT PRIMARY KEY, account_id INT, note VARCHAR(64), created DATETIME, KEY idx_account (account_id)",
+             100),
+    'wide': ("id INT PRIMARY KEY, " + ', '.join(f"c{i:02d} VARCHAR(20)" for i in range(WIDE_COLUMNS)),
+             WIDE_COLUMNS * 19),
+    'blob': ("id INT PRIMARY KEY, data MEDIUMBLOB", BLOB_BYTES * 2 + 10),
+}
+FAKE_BLOCK_BYTES = 1024 * 1024  # 模拟导出时重复输出的数据块大小
+
+
+def make_spec(profile, seed):
+    """
+    按规模和随机种子生成合成表的清单，相同的参数总是得到相同的表和行数
+
+    :param profile: PROFILES 中的规模名
+    :param seed: 随机种子
+    :return: [{'name', 'kind', 'rows', 'bytes'}]
+    """
+    counts = PROFILES[profile]
+    rng = random.Random(seed)
+    tables = [{'name': f'tiny_{i:04d}', 'kind': 'tiny', 'rows': rng.randint(1, 50)} for i in range(counts['tiny'])]
+    for kind in ('huge', 'wide', 'blob'):
+        tables += [{'name': f'{kind}_{i:02d}', 'kind': kind, 'rows': counts[f'{kind}_rows']}
+                   for i in range(counts[kind])]
+    for table in tables:
+        table['bytes'] = table['rows'] * KINDS[table['kind']][1]
+    return tables
+
+
+def make_row(kind, rng, row_id):
+    # 生成一行数据，内容由随机数生成器决定
+    if kind == 'tiny':
+        return row_id, f'name_{rng.randrange(10 ** 6)}', rng.randrange(10 ** 6)
+    if kind == 'huge':
+        created = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(1700000000 + rng.randrange(10 ** 7)))
+        return row_id, rng.randrange(10000), '%048x' % rng.getrandbits(192), created
+    if kind == 'wide':
+        return (row_id,) + tuple('%016x' % rng.getrandbits(64) for _ in range(WIDE_COLUMNS))
+    return row_id, rng.getrandbits(BLOB_BYTES * 8).to_bytes(BLOB_BYTES, 'little')
+
+
+def table_rng(seed, table):
+    return random.Random(f"{seed}:{table['name']}")
+
+
+def sql_literal(value):
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, bytes):
+        return '0x' + value.hex()
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def fake_dump_block(table, seed):
+    # 模拟导出时重复输出的一段 INSERT 语句，约 FAKE_BLOCK_BYTES 字节
+    rng = table_rng(seed, table)
+    lines = []
+    size = 0
+    row_id = 1
+    while size < FAKE_BLOCK_BYTES and row_id <= max(table['rows'], 1):
+        values = ','.join(f"({','.join(sql_literal(v) for v in make_row(table['kind'], rng, row_id))})"
+                          for row_id in range(row_id, min(row_id + 100, table['rows'] + 1)))
+        line = f"INSERT INTO `{table['name']}` VALUES {values};\n"
+        lines.append(line)
+        size += len(line)
+        row_id += 100
+    return ''.join(lines).encode()
+
+
+def fake_client(name):
+    """
+    mysqldump/mysql 的替身: mysqldump 按表清单输出等量的 SQL，mysql 读完标准输入即退出，
+    设置了模拟速率时按速率等待，只测量调度、管道、压缩和文件读写的开销
+    """
+    rate = float(os.environ.get('DBBP_BENCH_MB_S') or 0) * 1024 * 1024
+    start = time.time()
+    done = 0
+    if name == 'mysqldump':
+        with open(os.environ['DBBP_BENCH_SPEC'], encoding='utf-8') as f:
+            bench = json.load(f)
+        table = {t['name']: t for t in bench['spec']}[sys.argv[-1]]
+        out = sys.stdout.buffer
+        out.write(f"CREATE TABLE `{table['name']}` ({KINDS[table['kind']][0]});\n".encode())
+        block = fake_dump_block(table, bench['seed'])
+        while done < table['bytes']:
+            out.write(block[:table['bytes'] - done])
+            done += min(len(block), table['bytes'] - done)
+            if rate:
+                time.sleep(max(0.0, done / rate - (time.time() - start)))
+        out.flush()
+        return
+    while True:
+        data = sys.stdin.buffer.read(FAKE_BLOCK_BYTES)
+        if not data:
+            return
+        done += len(data)
+        if rate:
+            time.sleep(max(0.0, done / rate - (time.time() - start)))
+
+
+if __name__ == '__main__':
+    fake_client(sys.argv[1])
@@ -0,0 +1,87 @@
+import datetime
+import decimal
+
+from dump_engine import FETCH_ROWS, format_timedelta, quote_identifier, select_rows
+
+# 与 LOAD DATA 默认格式一致: 字段以 \t 分隔，行以 \n 结束，转义符为 \，NULL 写作 \N
+NULL_FIELD = b'\\N'
+# 转义顺序: 先转义反斜杠本身
+ESCAPE_BYTES = (
+    (b'\\', b'\\\\'),
+    (b'\t', b'\\t'),
+    (b'\n', b'\\n'),
+    (b'\r', b'\\r'),
+    (b'\0', b'\\0'),
+)
+
+
+def escape_field(value):
+    """
+    将列值转换为制表符分隔数据文件中的一个字段
+
+    :param value: mysql.connector 返回的列值
+    :return: 转义后的字节串
+    """
+    if value is None:
+        return NULL_FIELD
+    if isinstance(value, bool):
+        return b'1' if value else b'0'
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return str(value).encode()
+    if isinstance(value, (bytes, bytearray)):
+        data = bytes(value)
+    else:
+        if isinstance(value, set):
+            value = ','.join(sorted(value))
+        elif isinstance(value, datetime.timedelta):
+            value = format_timedelta(value)
+        data = str(value).encode('utf-8')
+    for raw, escaped in ESCAPE_BYTES:
+        if raw in data:
+            data = data.replace(raw, escaped)
+    return data
+
+
+def write_tab_rows(cnx, table_name, out, where=None):
+    """
+    以流式游标读取表数据，写出制表符分隔的数据文件，与 mysqldump --tab 生成的 .txt 文件格式相同
+
+    :param cnx: mysql.connector 连接
+    :param table_name: 表名
+    :param out: 二进制输出流
+    :param where: 可选的 where 条件，用于分片导出
+    :return: 导出的行数
+    """
+    cursor, _ = select_rows(cnx, table_name, where)
+    row_count = 0
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        out.write(b''.join(b'\t'.join(escape_field(v) for v in row) + b'\n' for row in rows))
+        row_count += len(rows)
+    cursor.close()
+    return row_count
+
+
+def load_tab_file(cnx, table_name, columns, data_file, replace=False):
+    """
+    使用 LOAD DATA LOCAL INFILE 将数据文件批量导入表中，连接需开启 allow_local_infile
+
+    :param cnx: mysql.connector 连接
+    :param table_name: 表名
+    :param columns: 数据文件中的列名，按文件中的列顺序
+    :param data_file: 数据文件路径
+    :param replace: 主键或唯一键冲突时覆盖已有的行
+    :return: 导入的行数
+    """
+    cursor = cnx.cursor()
+    cursor.execute(
+        f"LOAD DATA LOCAL INFILE %s {'REPLACE ' if replace else ''}INTO TABLE {quote_identifier(table_name)} "
+        f"CHARACTER SET utf8mb4 "
+        f"({', '.join(quote_identifier(c) for c in columns)})",
+        (data_file,))
+    row_count = cursor.rowcount
+    cursor.close()
+    cnx.commit()
+    return row_count
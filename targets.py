@@ -0,0 +1,38 @@
+import os
+
+
+def expand_targets(backuper_config):
+    """
+    将 targets 配置展开为每个数据库一份的完整配置
+
+    每个目标中的配置项覆盖 backuper 中的同名项，database 可以是列表，表示同一服务器上的多个数据库；
+    目标未配置 backup_dir 时，备份目录为 backup_dir/主机_端口/数据库名，各数据库的备份和清单互不影响；
+    s3_url 同样按 主机_端口/数据库名 区分。
+
+    :param backuper_config: dbbp.yaml 中的 backuper 配置
+    :return: 配置列表，没有配置 targets 时为空
+    """
+    base = {key: value for key, value in backuper_config.items() if key != 'targets'}
+    configs = []
+    for target in backuper_config.get('targets') or []:
+        merged = dict(base, **target)
+        databases = merged['database'] if isinstance(merged['database'], list) else [merged['database']]
+        for database in databases:
+            config = dict(merged, database=database)
+            if 'backup_dir' not in target:
+                config['backup_dir'] = os.path.join(base['backup_dir'], f"{config['hostname']}_{config['port']}",
+                                                    database)
+            if base.get('s3_url') and 's3_url' not in target:
+                config['s3_url'] = f"{base['s3_url'].rstrip('/')}/{config['hostname']}_{config['port']}/{database}"
+            configs.append(config)
+    return configs
+
+
+def server_of(backuper):
+    # 并发上限按服务器计算，同一实例上的多个数据库共用
+    return f"{backuper.hostname}:{backuper.port}"
+
+
+def target_label(backuper):
+    return f"{server_of(backuper)}/{backuper.database}"
+
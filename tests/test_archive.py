@@ -0,0 +1,85 @@
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import ARCHIVE_EXT, extract, open_member, pack_dir, read_index  # noqa: E402
+from codec import wrap_reader  # noqa: E402
+
+
+class ArchiveRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='dbbp_archive_')
+        self.backup_dir = os.path.join(self.root, '20240101_000000')
+        os.makedirs(self.backup_dir)
+        self.plain = {
+            'user.sql': b"INSERT INTO `user` VALUES (1,'a');\n" * 1000,
+            'order.0001.sql': b"INSERT INTO `order` VALUES (1,'b');\n" * 500,
+            'empty.sql': b'',
+        }
+        for name, data in self.plain.items():
+            with open(os.path.join(self.backup_dir, name), 'wb') as f:
+                f.write(data)
+        # 已逐表压缩的文件原样写入归档
+        self.compressed = gzip.compress(b"INSERT INTO `log` VALUES (1);\n" * 300)
+        with open(os.path.join(self.backup_dir, 'log.sql.gz'), 'wb') as f:
+            f.write(self.compressed)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_pack_and_read_members(self):
+        path = pack_dir(self.backup_dir, codec='gzip')
+        self.assertEqual(path, self.backup_dir + ARCHIVE_EXT)
+        self.assertFalse(os.path.exists(self.backup_dir))
+        index = read_index(path)
+        self.assertEqual(sorted(index), ['empty.sql.gz', 'log.sql.gz', 'order.0001.sql.gz', 'user.sql.gz'])
+        for name, data in self.plain.items():
+            self.assertEqual(index[name + '.gz']['raw_size'], len(data))
+            with wrap_reader(open_member(path, name + '.gz', index), 'gzip') as f:
+                self.assertEqual(f.read(), data)
+        with open_member(path, 'log.sql.gz') as f:
+            self.assertEqual(f.read(), self.compressed)
+
+    def test_pack_without_codec_keeps_source(self):
+        dest_path = os.path.join(self.root, 'copy' + ARCHIVE_EXT)
+        pack_dir(self.backup_dir, dest_path, delete=False)
+        self.assertTrue(os.path.isdir(self.backup_dir))
+        index = read_index(dest_path)
+        self.assertEqual(sorted(index), ['empty.sql', 'log.sql.gz', 'order.0001.sql', 'user.sql'])
+        with open_member(dest_path, 'user.sql', index) as f:
+            self.assertEqual(f.read(), self.plain['user.sql'])
+
+    def test_extract(self):
+        path = pack_dir(self.backup_dir)
+        dest_dir = extract(path, names=['order.0001.sql', 'log.sql.gz'])
+        self.assertEqual(dest_dir, self.backup_dir)
+        self.assertEqual(sorted(os.listdir(dest_dir)), ['log.sql.gz', 'order.0001.sql'])
+        shutil.rmtree(dest_dir)
+        dest_dir = extract(path, os.path.join(self.root, 'all'))
+        self.assertEqual(sorted(os.listdir(dest_dir)), ['empty.sql', 'log.sql.gz', 'order.0001.sql', 'user.sql'])
+        for name, data in self.plain.items():
+            with open(os.path.join(dest_dir, name), 'rb') as f:
+                self.assertEqual(f.read(), data)
+        with open(os.path.join(dest_dir, 'log.sql.gz'), 'rb') as f:
+            self.assertEqual(f.read(), self.compressed)
+
+    def test_rejects_damaged_archive(self):
+        path = pack_dir(self.backup_dir)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 1)
+        with self.assertRaises(ValueError):
+            read_index(path)
+        not_archive = os.path.join(self.root, 'other' + ARCHIVE_EXT)
+        with open(not_archive, 'wb') as f:
+            f.write(b'not an archive')
+        with self.assertRaises(ValueError):
+            read_index(not_archive)
+
+
+if __name__ == '__main__':
+    unittest.main()
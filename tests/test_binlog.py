@@ -0,0 +1,40 @@
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from binlog import compress_finished_segments, list_segments  # noqa: E402
+
+
+class CompressSegmentsTest(unittest.TestCase):
+    def setUp(self):
+        self.binlog_dir = tempfile.mkdtemp(prefix='dbbp_binlog_')
+        for seq in (1, 2, 3):
+            with open(os.path.join(self.binlog_dir, f'binlog.{seq:06d}'), 'wb') as f:
+                f.write(f'segment {seq}'.encode())
+
+    def tearDown(self):
+        shutil.rmtree(self.binlog_dir, ignore_errors=True)
+
+    def test_no_codec_keeps_segments(self):
+        for codec in (None, '', 'none'):
+            with self.subTest(codec=codec):
+                compress_finished_segments(self.binlog_dir, codec)
+                self.assertEqual([f for _, f in list_segments(self.binlog_dir)],
+                                 ['binlog.000001', 'binlog.000002', 'binlog.000003'])
+
+    def test_compresses_all_but_last(self):
+        compress_finished_segments(self.binlog_dir, 'gzip')
+        self.assertEqual(list_segments(self.binlog_dir),
+                         [('binlog.000001', 'binlog.000001.gz'), ('binlog.000002', 'binlog.000002.gz'),
+                          ('binlog.000003', 'binlog.000003')])
+        with gzip.open(os.path.join(self.binlog_dir, 'binlog.000002.gz')) as f:
+            self.assertEqual(f.read(), b'segment 2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunker import TRIGGER_PART, parse_part_file, part_file_name, split_ranges, split_schema_files  # noqa: E402
+
+
+class SplitRangesTest(unittest.TestCase):
+    def test_ranges_are_open_ended_and_contiguous(self):
+        self.assertEqual(split_ranges('id', 1, 100, 4),
+                         ['`id` < 26', '`id` >= 26 AND `id` < 51', '`id` >= 51 AND `id` < 76', '`id` >= 76'])
+
+    def test_nullable_key_takes_nulls_in_first_range(self):
+        self.assertEqual(split_ranges('id', 1, 10, 2, nullable=True), ['`id` < 6 OR `id` IS NULL', '`id` >= 6'])
+
+    def test_parts_capped_by_key_span(self):
+        self.assertEqual(split_ranges('id', 5, 6, 10), ['`id` < 6', '`id` >= 6'])
+        self.assertEqual(split_ranges('id', 7, 7, 3), ['1=1'])
+
+    def test_column_is_quoted(self):
+        self.assertEqual(split_ranges('order', 0, 9, 2), ['`order` < 5', '`order` >= 5'])
+
+
+class PartFileTest(unittest.TestCase):
+    def test_round_trip(self):
+        for part in (0, 1, 42, TRIGGER_PART):
+            self.assertEqual(parse_part_file(part_file_name('user.log', part)), ('user.log', part))
+        self.assertEqual(parse_part_file('user.sql'), ('user', None))
+
+    def test_schema_files_restored_first(self):
+        files = ['a.0000.sql', 'a.0001.sql', 'a.triggers.sql', 'b.sql', 'c.sql', 'c.txt']
+        self.assertEqual(split_schema_files(files), (['a.0000.sql', 'c.sql'],
+                                                     ['a.0001.sql', 'a.triggers.sql', 'b.sql', 'c.txt']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from concurrency import HOLD_INTERVALS, ConcurrencyController  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def sample(throughput, threads_running=1, row_lock_waits=0, replication_lag=None):
+    return {'threads_running': threads_running, 'row_lock_waits': row_lock_waits,
+            'replication_lag': replication_lag, 'throughput': throughput}
+
+
+class AdjustTest(unittest.TestCase):
+    def setUp(self):
+        # adjust 不使用监控连接，也不启动后台线程
+        self.controller = ConcurrencyController(None, 2, 6, max_threads_running=20, max_row_lock_waits=5,
+                                                max_replication_lag=30)
+
+    def test_waits_for_throughput_baseline(self):
+        self.assertEqual(self.controller.adjust(sample(None)), 2)
+
+    def test_increase_kept_when_throughput_improves(self):
+        self.assertEqual(self.controller.adjust(sample(10 * MB)), 3)
+        self.assertEqual(self.controller.adjust(sample(12 * MB)), 4)
+        self.assertEqual(self.controller.adjust(sample(14 * MB)), 5)
+
+    def test_increase_reverted_and_held_without_gain(self):
+        self.controller.adjust(sample(10 * MB))
+        self.assertEqual(self.controller.adjust(sample(10 * MB)), 2)
+        # 撤销后保持几个周期不再尝试增加
+        for _ in range(HOLD_INTERVALS):
+            self.assertEqual(self.controller.adjust(sample(10 * MB)), 2)
+        self.assertEqual(self.controller.adjust(sample(10 * MB)), 3)
+
+    def test_stops_at_max_workers(self):
+        throughput = 10 * MB
+        for _ in range(10):
+            throughput *= 2
+            self.controller.adjust(sample(throughput))
+        self.assertEqual(self.controller.limit, 6)
+        self.assertEqual(self.controller.adjust(sample(throughput * 2)), 6)
+
+    def test_halves_under_pressure_not_below_min(self):
+        self.controller.limit = 6
+        self.assertEqual(self.controller.adjust(sample(10 * MB, threads_running=21)), 3)
+        self.assertEqual(self.controller.adjust(sample(10 * MB, row_lock_waits=6)), 2)
+        self.assertEqual(self.controller.adjust(sample(10 * MB, replication_lag=31)), 2)
+
+    def test_pressure_clears_pending_increase(self):
+        self.controller.adjust(sample(10 * MB))
+        self.controller.adjust(sample(10 * MB, threads_running=21))
+        self.assertIsNone(self.controller.increase_base)
+        self.assertEqual(self.controller.hold, 0)
+        # 压力消失后不与压力前的吞吐比较，直接尝试增加
+        self.assertEqual(self.controller.adjust(sample(5 * MB)), 3)
+
+    def test_thresholds_not_checked_when_unset(self):
+        controller = ConcurrencyController(None, 1, 4)
+        self.assertEqual(controller.pressure(sample(MB, threads_running=1000, row_lock_waits=1000,
+                                                    replication_lag=1000)), [])
+        self.assertEqual(controller.adjust(sample(MB, threads_running=1000)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import connections  # noqa: E402
+
+
+def target(host, database):
+    return {'user': 'root', 'password': 'x', 'host': host, 'port': 3306, 'database': database}
+
+
+class PerTargetBreakerTest(unittest.TestCase):
+    def tearDown(self):
+        connections.install()
+
+    def test_single_breaker_applies_to_every_task(self):
+        breaker = connections.CircuitBreaker(1)
+        connections.install(breaker)
+        self.assertIs(connections.find_breaker(), breaker)
+        self.assertIs(connections.find_breaker(target('db1', 'app')), breaker)
+
+    def test_open_target_does_not_stop_others(self):
+        down, up = target('db1', 'app'), target('db2', 'app')
+        connections.install({connections.breaker_key(kwargs): connections.CircuitBreaker(2) for kwargs in (down, up)})
+        for _ in range(2):
+            connections.record_client_result(2, 'mysqldump: Got error: 2003: Can\'t connect', down)
+        connections.record_client_result(0, '', up)
+        with self.assertRaises(connections.CircuitOpenError):
+            connections.check_breaker(down)
+        connections.check_breaker(up)
+        # 连接参数中的其他项(如 allow_local_infile)不影响查找
+        with self.assertRaises(connections.CircuitOpenError):
+            connections.check_breaker(dict(down, allow_local_infile=True))
+
+    def test_unknown_target_has_no_breaker(self):
+        connections.install({connections.breaker_key(target('db1', 'app')): connections.CircuitBreaker(1)})
+        self.assertIsNone(connections.find_breaker(target('db3', 'app')))
+        connections.check_breaker(target('db3', 'app'))
+
+
+if __name__ == '__main__':
+    unittest.main()
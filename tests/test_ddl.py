@@ -0,0 +1,63 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ddl import alter_table_sql, rewrite_create_tables  # noqa: E402
+
+CREATE_ORDER = """DROP TABLE IF EXISTS `order`;
+CREATE TABLE `order` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `seq` bigint NOT NULL AUTO_INCREMENT,
+  `user_id` int NOT NULL,
+  `note` varchar(20) DEFAULT ',',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_note` (`note`),
+  KEY `idx_seq` (`seq`),
+  KEY `idx_user` (`user_id`),
+  CONSTRAINT `fk_user` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+INSERT INTO `order` VALUES (1,1,1,'a');
+"""
+
+
+class RewriteCreateTablesTest(unittest.TestCase):
+    def test_defers_secondary_indexes_and_foreign_keys(self):
+        deferred = {}
+        text = ''.join(rewrite_create_tables(CREATE_ORDER.splitlines(keepends=True), deferred))
+        self.assertEqual(text, """DROP TABLE IF EXISTS `order`;
+CREATE TABLE `order` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `seq` bigint NOT NULL AUTO_INCREMENT,
+  `user_id` int NOT NULL,
+  `note` varchar(20) DEFAULT ',',
+  PRIMARY KEY (`id`),
+  KEY `idx_seq` (`seq`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+INSERT INTO `order` VALUES (1,1,1,'a');
+""")
+        # 以自增列开头的索引必须保留在建表语句中
+        indexes, foreign_keys = deferred['order']
+        self.assertEqual(indexes, ['UNIQUE KEY `uk_note` (`note`)', 'KEY `idx_user` (`user_id`)'])
+        self.assertEqual(foreign_keys, ['CONSTRAINT `fk_user` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`)'])
+
+    def test_table_without_secondary_keys_unchanged(self):
+        lines = ["CREATE TABLE `a``b` (\r\n", "  `id` int NOT NULL,\r\n", "  PRIMARY KEY (`id`)\r\n",
+                 ") ENGINE=InnoDB;\r\n"]
+        deferred = {}
+        self.assertEqual(list(rewrite_create_tables(lines, deferred)),
+                         [lines[0], "  `id` int NOT NULL,\r\n  PRIMARY KEY (`id`)\r\n", lines[3]])
+        self.assertEqual(deferred, {})
+
+    def test_unterminated_block_passes_through(self):
+        lines = ["CREATE TABLE `t` (\n", "  `id` int,\n"]
+        self.assertEqual(list(rewrite_create_tables(lines, {})), lines)
+
+    def test_alter_table_sql(self):
+        self.assertEqual(alter_table_sql('a`b', ['KEY `k` (`x`)', 'KEY `j` (`y`)']),
+                         'ALTER TABLE `a``b` ADD KEY `k` (`x`), ADD KEY `j` (`y`)')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import datetime
+import decimal
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dump_engine import format_timedelta, quote_identifier, sql_literal, write_triggers  # noqa: E402
+from sql_splitter import split_statements  # noqa: E402
+
+
+class SqlLiteralTest(unittest.TestCase):
+    def test_scalars(self):
+        self.assertEqual(sql_literal(None), 'NULL')
+        self.assertEqual(sql_literal(True), '1')
+        self.assertEqual(sql_literal(42), '42')
+        self.assertEqual(sql_literal(decimal.Decimal('-1.50')), '-1.50')
+
+    def test_strings_are_escaped(self):
+        self.assertEqual(sql_literal("it's \\ \"x\"\n\r\0\x1a"), "'it\\'s \\\\ \\\"x\\\"\\n\\r\\0\\Z'")
+        self.assertEqual(sql_literal('中文'), "'中文'")
+
+    def test_binary_is_hex(self):
+        self.assertEqual(sql_literal(b'\x00\xff'), "X'00ff'")
+        self.assertEqual(sql_literal(bytearray()), "''")
+
+    def test_temporal_and_set(self):
+        self.assertEqual(sql_literal(datetime.datetime(2024, 1, 2, 3, 4, 5)), "'2024-01-02 03:04:05'")
+        self.assertEqual(sql_literal(datetime.date(2024, 1, 2)), "'2024-01-02'")
+        self.assertEqual(sql_literal(datetime.timedelta(hours=-1, seconds=1)), "'-00:59:59'")
+        self.assertEqual(sql_literal({'b', 'a'}), "'a,b'")
+
+    def test_timedelta_beyond_a_day(self):
+        self.assertEqual(format_timedelta(datetime.timedelta(days=1, hours=2, microseconds=5)), '26:00:00.000005')
+
+    def test_quote_identifier(self):
+        self.assertEqual(quote_identifier('a`b'), '`a``b`')
+
+
+class WriteTriggersTest(unittest.TestCase):
+    def test_delimiter_block_keeps_body_intact(self):
+        body = ("CREATE DEFINER=`root`@`%` TRIGGER `t_ai` AFTER INSERT ON `t` FOR EACH ROW "
+                "BEGIN INSERT INTO `log` VALUES (NEW.id); UPDATE `c` SET n = n + 1; END")
+        out = io.StringIO()
+        write_triggers(out, [('STRICT_TRANS_TABLES', body)])
+        statements = [statement for _, statement in split_statements(io.StringIO(out.getvalue()))]
+        self.assertIn(body, statements)
+        self.assertIn("/*!50003 SET @OLD_TRIGGER_SQL_MODE=@@SQL_MODE, SQL_MODE='STRICT_TRANS_TABLES' */", statements)
+
+
+if __name__ == '__main__':
+    unittest.main()
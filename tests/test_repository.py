@@ -0,0 +1,79 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bak_db_apply_async import archive_dir  # noqa: E402
+from codec import zstandard  # noqa: E402
+from repository import (MAX_CHUNK, ChunkStore, ChunkWriter, open_recipe, read_recipe, store_dir_for,  # noqa: E402
+                        verify_recipe)
+
+CODECS = [None, 'none', 'gzip', 'xz', 'lzma'] + (['zstd'] if zstandard else [])
+
+
+def dump_lines(rng, count):
+    # 与 mysqldump 输出类似的多行文本，行长不一
+    return b''.join(b"INSERT INTO `t` VALUES (%d,'%s');\n" % (i, b'x' * rng.randint(10, 400))
+                    for i in range(count))
+
+
+class ChunkRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='dbbp_repo_')
+        self.backup_dir = os.path.join(self.root, '20240101_000000')
+        os.makedirs(self.backup_dir)
+        self.data = dump_lines(random.Random(1), 20000)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write(self, codec, name='t.sql.chunks', data=None):
+        path = os.path.join(self.backup_dir, name)
+        with ChunkWriter(ChunkStore(store_dir_for(self.backup_dir), codec), path) as out:
+            out.write(self.data if data is None else data)
+        return path
+
+    def test_round_trip_every_codec(self):
+        for codec in CODECS:
+            with self.subTest(codec=codec):
+                path = self.write(codec, f'{codec}.sql.chunks')
+                with open_recipe(path) as f:
+                    self.assertEqual(f.read(), self.data)
+                verify_recipe(path)
+
+    def test_chunks_are_bounded_and_line_aligned(self):
+        _, chunks, footer = read_recipe(self.write('gzip'))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(footer['size'], len(self.data))
+        self.assertTrue(all(size <= MAX_CHUNK for _, size in chunks))
+        offset = 0
+        for _, size in chunks[:-1]:
+            offset += size
+            self.assertEqual(self.data[offset - 1:offset], b'\n')
+
+    def test_unchanged_data_reuses_chunks(self):
+        _, first, _ = read_recipe(self.write('gzip', 'a.sql.chunks'))
+        # 中间插入一行后，之后的切分点重新对齐，大部分块不变
+        lines = self.data.splitlines(keepends=True)
+        changed = b''.join(lines[:10000] + [b"INSERT INTO `t` VALUES (-1,'new');\n"] + lines[10000:])
+        _, second, _ = read_recipe(self.write('gzip', 'b.sql.chunks', changed))
+        shared = {chunk for chunk, _ in first} & {chunk for chunk, _ in second}
+        self.assertGreaterEqual(len(shared), len(first) - 2)
+
+    def test_archive_dir_keeps_repository_backups(self):
+        self.write('gzip')
+        backuper = types.SimpleNamespace(backup_dir=self.root, archive_format='dbbp', compress_codec=None,
+                                         compress_level=None)
+        for dir_path in (self.backup_dir, store_dir_for(self.backup_dir)):
+            archive_dir(backuper, dir_path)
+            self.assertTrue(os.path.isdir(dir_path))
+        self.assertEqual(sorted(os.listdir(self.root)), sorted([os.path.basename(self.backup_dir), 'chunks']))
+
+
+if __name__ == '__main__':
+    unittest.main()
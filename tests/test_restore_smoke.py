@@ -0,0 +1,34 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import run_in_process  # noqa: E402
+from synthetic import make_spec  # noqa: E402
+
+
+class RestoreSmokeTest(unittest.TestCase):
+    """
+    使用 benchmark 的 mysqldump/mysql 替身完成一次备份、打包和还原，不需要数据库
+    """
+
+    def run_fake_case(self, executor):
+        spec = make_spec('small', 1)
+        # 保留少量小表和一张大表，控制耗时
+        spec = spec[:5] + [dict(t, rows=2000) for t in spec if t['kind'] == 'huge']
+        return run_in_process({'mode': 'fake', 'executor': executor, 'workers': 2, 'repeat': 0, 'spec': spec,
+                               'seed': 1, 'codec': 'gzip', 'database': 'dbbp_smoke', 'config': {},
+                               'fake_mb_s': 0})
+
+    def test_backup_and_restore(self):
+        for executor in ('pool', 'asyncio'):
+            with self.subTest(executor=executor):
+                result = self.run_fake_case(executor)
+                self.assertFalse(result['backup_failed'])
+                self.assertEqual(result['restore_failed'], 0)
+                self.assertGreater(result['phases']['restore']['bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
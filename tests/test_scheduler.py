@@ -0,0 +1,44 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import lpt_order, pick_task  # noqa: E402
+
+
+class LptOrderTest(unittest.TestCase):
+    def test_largest_first(self):
+        sizes = {'a': (10, 100), 'b': (300, 5), 'c': (20, 1)}
+        self.assertEqual(lpt_order(['a', 'b', 'c'], sizes), ['b', 'c', 'a'])
+
+    def test_rows_break_ties_and_missing_sizes_last(self):
+        # 字节数相同时行数多的先提交，没有统计信息的任务视为 0
+        sizes = {'a': (100, 1), 'b': (100, 50), 'c': (0, 0)}
+        self.assertEqual(lpt_order(['d', 'a', 'c', 'b'], sizes), ['b', 'a', 'd', 'c'])
+
+    def test_empty_and_zero_sizes(self):
+        self.assertEqual(lpt_order([], {}), [])
+        self.assertEqual(lpt_order(['a', 'b'], {}), ['a', 'b'])
+
+
+class PickTaskTest(unittest.TestCase):
+    def test_first_task_when_slots_free(self):
+        self.assertEqual(pick_task(['a', 'b'], [], 2), 0)
+
+    def test_none_when_pool_full(self):
+        self.assertIsNone(pick_task(['a', 'b'], ['a', 'b'], 2))
+        self.assertIsNone(pick_task(['a'], ['b', 'b', 'b'], 2))
+
+    def test_skips_groups_at_their_limit(self):
+        # 服务器 a 已达到上限时，按顺序启动下一个其他服务器上的任务
+        self.assertEqual(pick_task(['a', 'a', 'b', 'c'], ['a', 'a'], 4, group_limit=2), 2)
+        self.assertIsNone(pick_task(['a', 'a'], ['a', 'a'], 4, group_limit=2))
+
+    def test_no_group_limit(self):
+        self.assertEqual(pick_task(['a'], ['a', 'a', 'a'], 4), 0)
+        self.assertIsNone(pick_task([], [], 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot  # noqa: E402
+
+
+class FakeConnection:
+    """
+    记录执行的语句，不连接数据库
+    """
+
+    def __init__(self, log, name):
+        self.log = log
+        self.name = name
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.log.append((self.name, sql))
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class SnapshotLockTest(unittest.TestCase):
+    def setUp(self):
+        self.log = []
+        self.count = 0
+        patcher = mock.patch.object(snapshot.mysql.connector, 'connect', side_effect=self.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(snapshot.close_all)
+
+    def connect(self, **kwargs):
+        self.count += 1
+        self.log.append((f'cnx{self.count}', 'CONNECT'))
+        return FakeConnection(self.log, f'cnx{self.count}')
+
+    def assert_lock_only_around_snapshots(self, workers):
+        statements = [sql for _, sql in self.log]
+        lock_at = statements.index("FLUSH TABLES WITH READ LOCK")
+        unlock_at = statements.index("UNLOCK TABLES")
+        # 所有连接都在加锁之前建立，锁内只开启快照和读取 binlog 位置
+        self.assertEqual(statements[:lock_at].count('CONNECT'), workers + 1)
+        held = statements[lock_at + 1:unlock_at]
+        self.assertEqual(held.count("START TRANSACTION WITH CONSISTENT SNAPSHOT"), workers)
+        self.assertNotIn('CONNECT', held)
+
+    def test_in_process_snapshot(self):
+        with snapshot.SnapshotLock({}) as lock:
+            cnxs = [snapshot.mysql.connector.connect() for _ in range(3)]
+            lock.snapshot(cnxs)
+        self.assert_lock_only_around_snapshots(3)
+        self.assertEqual(snapshot._connections.qsize(), 3)
+
+    def test_workers_connect_before_lock(self):
+        with snapshot.SnapshotLock({}) as lock:
+            threads = [threading.Thread(target=snapshot.join, args=lock.worker_args()) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            lock.wait_workers(3)
+        for thread in threads:
+            thread.join()
+        self.assert_lock_only_around_snapshots(3)
+
+    def test_late_worker_does_not_join(self):
+        with snapshot.SnapshotLock({}) as lock:
+            pass
+        snapshot.join(*lock.worker_args())
+        self.assertEqual(snapshot._connections.qsize(), 0)
+
+    def test_gives_up_when_workers_are_missing(self):
+        with mock.patch.object(snapshot, 'CONNECT_TIMEOUT_SECONDS', 0.2):
+            with self.assertRaises(TimeoutError):
+                with snapshot.SnapshotLock({}) as lock:
+                    lock.wait_workers(1)
+        self.assertNotIn("FLUSH TABLES WITH READ LOCK", [sql for _, sql in self.log])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sql_splitter import classify, ends_in_string, split_statements  # noqa: E402
+
+
+def split(text):
+    return list(split_statements(io.StringIO(text)))
+
+
+class SplitStatementsTest(unittest.TestCase):
+    def test_kinds_and_skipped_statements(self):
+        self.assertEqual(split("/*!40101 SET NAMES utf8mb4 */;\n"
+                               "LOCK TABLES `t` WRITE;\n"
+                               "/*!40000 ALTER TABLE `t` DISABLE KEYS */;\n"
+                               "INSERT INTO `t` VALUES (1);\n"
+                               "UNLOCK TABLES;\n"
+                               "DROP TABLE IF EXISTS `u`;\n"),
+                         [('session', '/*!40101 SET NAMES utf8mb4 */'),
+                          ('insert', 'INSERT INTO `t` VALUES (1)'),
+                          ('ddl', 'DROP TABLE IF EXISTS `u`')])
+
+    def test_delimiter_inside_string_does_not_split(self):
+        text = "INSERT INTO `t` VALUES ('a;\n',\n'it''s;'),('b\\';');\nINSERT INTO `t` VALUES (2);\n"
+        self.assertEqual(split(text), [('insert', "INSERT INTO `t` VALUES ('a;\n',\n'it''s;'),('b\\';')"),
+                                       ('insert', 'INSERT INTO `t` VALUES (2)')])
+
+    def test_comments_and_blank_lines_dropped(self):
+        self.assertEqual(split("-- MySQL dump\n\n--\n-- Table structure\n--\nCREATE TABLE `t` (\n  `id` int\n);\n"),
+                         [('ddl', 'CREATE TABLE `t` (\n  `id` int\n)')])
+
+    def test_delimiter_block(self):
+        text = ("DELIMITER ;;\n"
+                "CREATE TRIGGER `t_ai` AFTER INSERT ON `t` FOR EACH ROW BEGIN\n"
+                "  INSERT INTO `log` VALUES (NEW.id);\n"
+                "END ;;\n"
+                "DELIMITER ;\n"
+                "INSERT INTO `t` VALUES (1);\n")
+        self.assertEqual(split(text), [
+            ('ddl', "CREATE TRIGGER `t_ai` AFTER INSERT ON `t` FOR EACH ROW BEGIN\n"
+                    "  INSERT INTO `log` VALUES (NEW.id);\nEND"),
+            ('insert', 'INSERT INTO `t` VALUES (1)')])
+
+    def test_trailing_statement_without_delimiter(self):
+        self.assertEqual(split("INSERT INTO `t` VALUES (1);\nDROP TABLE `t`"),
+                         [('insert', 'INSERT INTO `t` VALUES (1)'), ('ddl', 'DROP TABLE `t`')])
+
+
+class HelpersTest(unittest.TestCase):
+    def test_ends_in_string(self):
+        self.assertTrue(ends_in_string("INSERT INTO t VALUES ('abc", False))
+        self.assertFalse(ends_in_string("def');", True))
+        self.assertTrue(ends_in_string("it\\'s still open", True))
+        self.assertFalse(ends_in_string("('a''b')", False))
+
+    def test_classify(self):
+        self.assertEqual(classify('REPLACE INTO `t` VALUES (1)'), 'insert')
+        self.assertEqual(classify("SET time_zone = '+00:00'"), 'session')
+        self.assertEqual(classify('USE `db`'), 'session')
+        self.assertEqual(classify('ALTER TABLE `t` ADD KEY (`a`)'), 'ddl')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import datetime
+import decimal
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tab_format import NULL_FIELD, escape_field  # noqa: E402
+
+
+class EscapeFieldTest(unittest.TestCase):
+    def test_null_and_numbers(self):
+        self.assertEqual(escape_field(None), NULL_FIELD)
+        self.assertEqual(escape_field(False), b'0')
+        self.assertEqual(escape_field(-7), b'-7')
+        self.assertEqual(escape_field(decimal.Decimal('3.10')), b'3.10')
+
+    def test_separators_are_escaped(self):
+        self.assertEqual(escape_field('a\tb\nc\rd\0e'), b'a\\tb\\nc\\rd\\0e')
+        # 反斜杠先转义，已转义的字符不会再次转义
+        self.assertEqual(escape_field('\\N'), b'\\\\N')
+        self.assertEqual(escape_field(b'\\\t'), b'\\\\\\t')
+
+    def test_text_and_temporal(self):
+        self.assertEqual(escape_field('中文'), '中文'.encode('utf-8'))
+        self.assertEqual(escape_field(datetime.datetime(2024, 1, 2, 3, 4, 5)), b'2024-01-02 03:04:05')
+        self.assertEqual(escape_field(datetime.timedelta(hours=30)), b'30:00:00')
+        self.assertEqual(escape_field({'y', 'x'}), b'x,y')
+
+    def test_fields_split_back(self):
+        row = ['a\tb', None, 'line\nbreak']
+        line = b'\t'.join(escape_field(v) for v in row)
+        self.assertEqual(len(line.split(b'\t')), len(row))
+        self.assertNotIn(b'\n', line)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zip_file  # noqa: E402
+
+LISTING = """
+7-Zip (a) 22.01 (x64) : Copyright (c) 1999-2022 Igor Pavlov : 2022-07-15
+
+Listing archive: 20240101_000000.7z
+
+--
+Path = 20240101_000000.7z
+Type = 7z
+Physical Size = 1234
+Headers Size = 210
+Method = LZMA2:24
+Solid = {solid}
+Blocks = 1
+
+----------
+Path = 20240101_000000
+Size = 0
+Folder = +
+
+Path = 20240101_000000\\user.sql
+Size = 1000
+Folder = -
+
+Path = 20240101_000000\\order.0001.sql
+Size = 2000
+Folder = -
+"""
+
+
+def listing(solid):
+    return subprocess.CompletedProcess([], 0, LISTING.format(solid=solid).encode(), b'')
+
+
+class ArchiveListingTest(unittest.TestCase):
+    def test_members_skip_folders(self):
+        with mock.patch.object(zip_file.subprocess, 'run', return_value=listing('-')):
+            self.assertEqual(zip_file.list_archive('x.7z'), {'20240101_000000\\user.sql': 1000,
+                                                             '20240101_000000\\order.0001.sql': 2000})
+
+    def test_solid_flag(self):
+        for solid, expected in (('+', True), ('-', False)):
+            with mock.patch.object(zip_file.subprocess, 'run', return_value=listing(solid)):
+                self.assertIs(zip_file.is_solid_archive('x.7z'), expected)
+
+    def test_extract_backup_returns_backup_dir(self):
+        root = tempfile.mkdtemp(prefix='dbbp_7z_')
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        src_path = os.path.join(root, '20240101_000000.7z')
+
+        def decompress(src, dest):
+            os.makedirs(os.path.join(dest, '20240101_000000'))
+
+        with mock.patch.object(zip_file.subprocess, 'run', return_value=listing('+')), \
+                mock.patch.object(zip_file, 'decompress', side_effect=decompress) as extracted:
+            restore_dir = zip_file.extract_backup(src_path)
+            # 已解压过时不再解压
+            zip_file.extract_backup(src_path)
+        self.assertEqual(restore_dir, os.path.join(root, '20240101_000000', '20240101_000000'))
+        self.assertEqual(extracted.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
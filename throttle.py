@@ -0,0 +1,184 @@
+import io
+import multiprocessing
+import os
+import shutil
+import subprocess
+import time
+
+BURST_SECONDS = 1.0  # 令牌桶容量为一秒的配额，空闲后最多突发这么多字节
+
+# 当前进程使用的令牌桶，主进程在备份开始时安装，进程池的子进程由初始化函数安装
+_buckets = {'read': None, 'write': None}
+
+
+def parse_minutes(text):
+    # "09:30" -> 570
+    hours, minutes = str(text).split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def profile_rates(profiles, read_mb, write_mb, now=None):
+    """
+    按当前时间选取限速配置，第一个覆盖当前时间的时段生效，没有时使用默认值
+
+    :param profiles: 时段列表 [{'start': '09:00', 'end': '18:00', 'read_mb': 10, 'write_mb': 10}]，
+                     结束时间早于开始时间时表示跨越午夜，时段中未配置的项使用默认值
+    :param read_mb: 默认的读取限速(MB/s)，为空或 0 时不限制
+    :param write_mb: 默认的写入限速(MB/s)，为空或 0 时不限制
+    :param now: time.struct_time，默认为当前时间
+    :return: (读取限速, 写入限速)，单位 MB/s
+    """
+    now = now or time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    for profile in profiles or []:
+        start, end = parse_minutes(profile['start']), parse_minutes(profile['end'])
+        if start <= minute < end or (end < start and (minute >= start or minute < end)):
+            return profile.get('read_mb', read_mb), profile.get('write_mb', write_mb)
+    return read_mb, write_mb
+
+
+class TokenBucket:
+    """
+    进程间共享的令牌桶
+
+    令牌数和时间戳保存在共享内存中，通过进程池初始化函数传给子进程后，所有进程和线程共用同一个配额。
+    消耗令牌时允许透支，透支的部分按速率折算成等待时间，因此单次写入再大也不会超出平均速率。
+    """
+
+    def __init__(self, kind, profiles, read_mb, write_mb):
+        """
+        :param kind: read 或 write，从时段配置中选取对应的限速
+        :param profiles: 时段配置，见 profile_rates
+        :param read_mb: 默认的读取限速(MB/s)
+        :param write_mb: 默认的写入限速(MB/s)
+        """
+        self.kind = kind
+        self.profiles = profiles
+        self.read_mb = read_mb
+        self.write_mb = write_mb
+        self.tokens = multiprocessing.Value('d', 0.0)
+        self.stamp = multiprocessing.Value('d', time.monotonic(), lock=False)
+
+    def rate(self):
+        # 当前时段的限速，字节/秒，为 0 时不限制
+        read_mb, write_mb = profile_rates(self.profiles, self.read_mb, self.write_mb)
+        return ((read_mb if self.kind == 'read' else write_mb) or 0) * 1024 * 1024
+
+    def consume(self, size):
+        """
+        消耗 size 个字节的令牌，配额不足时等待
+        """
+        rate = self.rate()
+        if not rate or not size:
+            return
+        with self.tokens.get_lock():
+            now = time.monotonic()
+            tokens = min(rate * BURST_SECONDS, self.tokens.value + (now - self.stamp.value) * rate) - size
+            self.tokens.value = tokens
+            self.stamp.value = now
+        if tokens < 0:
+            time.sleep(-tokens / rate)
+
+
+class ThrottledWriter(io.BufferedIOBase):
+    """
+    写入前先从令牌桶取得配额的二进制输出流，关闭时一并关闭底层输出流
+    """
+
+    def __init__(self, fileobj, bucket):
+        super().__init__()
+        self._fileobj = fileobj
+        self._bucket = bucket
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._bucket.consume(len(b))
+        return self._fileobj.write(b)
+
+    def flush(self):
+        self._fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            self._fileobj.close()
+
+
+def make_buckets(profiles, read_mb, write_mb):
+    """
+    创建读取和写入令牌桶，默认值和各时段都不限速的一项为 None
+
+    :return: {'read': TokenBucket 或 None, 'write': TokenBucket 或 None}
+    """
+    buckets = {}
+    for kind, default_mb in (('read', read_mb), ('write', write_mb)):
+        limited = default_mb or any(profile.get(f'{kind}_mb') for profile in profiles or [])
+        buckets[kind] = TokenBucket(kind, profiles, read_mb, write_mb) if limited else None
+    return buckets
+
+
+def install(buckets=None, low_priority=False):
+    """
+    在当前进程中启用令牌桶，也用作进程池的初始化函数
+
+    :param buckets: make_buckets 的返回值，为空时取消限速
+    :param low_priority: 同时降低当前进程的 CPU 和 IO 优先级
+    """
+    _buckets.update(buckets or {'read': None, 'write': None})
+    if low_priority:
+        lower_priority()
+
+
+def installed():
+    return dict(_buckets)
+
+
+def active():
+    return any(_buckets.values())
+
+
+def wrap_read(fileobj):
+    """
+    按读取限速包装写入未压缩导出数据的输出流，导出的字节数即为从服务端读取的字节数
+    """
+    return ThrottledWriter(fileobj, _buckets['read']) if _buckets['read'] else fileobj
+
+
+def wrap_write(fileobj):
+    """
+    按写入限速包装写入备份目录的文件
+    """
+    return ThrottledWriter(fileobj, _buckets['write']) if _buckets['write'] else fileobj
+
+
+def lower_priority():
+    # Linux 上未单独设置 IO 优先级时，IO 优先级随 nice 值降低
+    if hasattr(os, 'nice'):
+        os.nice(10)
+
+
+def low_priority_args():
+    """
+    以低 CPU 和 IO 优先级启动子进程的命令前缀，系统没有 ionice/nice 时为空
+    """
+    args = []
+    ionice, nice = shutil.which('ionice'), shutil.which('nice')
+    if ionice:
+        args += [ionice, '-c', '2', '-n', '7']
+    if nice:
+        args += [nice, '-n', '19']
+    return args
+
+
+def low_priority_kwargs():
+    """
+    以低优先级启动子进程的 Popen 参数，Windows 上使用低于正常的优先级类
+    """
+    if os.name == 'nt':
+        return {'creationflags': subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+    return {}
@@ -0,0 +1,63 @@
+import multiprocessing
+import sys
+
+import object_store
+from clogger import forward_to, forwarding_queue
+
+# forkserver 服务进程预先导入的模块，子进程从它 fork 出来时这些模块已导入，不再各自导入一遍
+PRELOAD_MODULES = ['__main__', 'connections', 'dump_engine', 'tab_format', 'codec', 'checkpoint', 'throttle',
+                   'metrics', 'snapshot', 'object_store']
+
+_targets = ()  # 子进程中执行任务的对象，创建进程池时传入一次
+
+
+def use_forkserver():
+    """
+    进程池改为从 forkserver 启动子进程，须在创建任何进程、队列和共享变量之前调用
+
+    forkserver 服务进程预先导入主模块和 PRELOAD_MODULES，之后每个子进程从它 fork，不再重新导入 mysql.connector 等模块，
+    导入的模块与服务进程共享内存；与直接 fork 不同，子进程不继承主进程的连接、线程和日志文件。
+    打包后的 exe 和 Windows 不支持 forkserver，仍使用默认方式(spawn)。
+
+    :return: 是否使用 forkserver
+    """
+    if getattr(sys, 'frozen', False) or 'forkserver' not in multiprocessing.get_all_start_methods():
+        return False
+    multiprocessing.set_forkserver_preload(PRELOAD_MODULES)
+    multiprocessing.set_start_method('forkserver', force=True)
+    return True
+
+
+def create_pool(processes, targets=(), initializer=None, initargs=()):
+    """
+    创建进程池，子进程的日志经队列转发给主进程，子进程沿用主进程的对象存储配置
+
+    :param processes: 子进程数
+    :param targets: 子进程中执行任务的对象(如 MysqlBackuper)，每个子进程只序列化一次，任务通过 call 按序号调用其方法
+    :param initializer: 子进程的其他初始化函数
+    :param initargs: initializer 的参数
+    :return: multiprocessing.Pool
+    """
+    return multiprocessing.Pool(processes=processes, initializer=init_worker,
+                                initargs=(forwarding_queue(), tuple(targets), object_store.installed(), initializer,
+                                          initargs))
+
+
+def init_worker(log_queue, targets, store_settings=None, initializer=None, initargs=()):
+    global _targets
+    forward_to(log_queue)
+    object_store.install(store_settings)
+    _targets = targets
+    if initializer:
+        initializer(*initargs)
+
+
+def call(index, method, *args):
+    """
+    子进程中的任务入口: 调用创建进程池时传入的第 index 个对象的方法，任务只传递方法名和参数
+
+    :param index: 对象在 targets 中的序号
+    :param method: 方法名
+    :return: 方法的返回值
+    """
+    return getattr(_targets[index], method)(*args)
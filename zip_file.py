@@ -1,7 +1,14 @@
+import io
+import json
 import os
 import subprocess
 
+import archive
+import object_store
 from clogger import clogger
+from codec import RECIPE_EXT, open_reader, strip_codec_ext, wrap_reader
+from manifest import MANIFEST_NAME, hash_file, hash_stream, read_manifest
+from repository import recipe_size, verify_recipe
 import time
 
 
@@ -62,7 +69,8 @@ def compress_and_delete(src_path, dest_path=None):
         file_name = os.path.splitext(os.path.basename(src_path))[0]
         dest_path = os.path.join(os.path.dirname(src_path), f'{file_name}.7z')
     clogger.info(f'正在压缩{src_path}为{dest_path},然后删除源文件')
-    cmd = ['7za.exe', 'a', '-t7z', dest_path, src_path, '-sdel']
+    # -ms=off 关闭固实压缩，每个文件单独压缩，还原时可以直接流式解压单个文件
+    cmd = ['7za.exe', 'a', '-t7z', '-ms=off', dest_path, src_path, '-sdel']
     run_7zip(cmd)
 
 
@@ -84,6 +92,153 @@ def decompress(src_path, dest_path=None):
     run_7zip(cmd)
 
 
+def list_archive(src_path, work_dir=default_work_dir):
+    """
+    列出 7z 压缩包中的文件
+
+    :param src_path: 压缩包路径
+    :param work_dir: 7za 所在目录
+    :return: {压缩包内的文件路径: 未压缩的字节数}
+    """
+    return _read_listing(src_path, work_dir)[1]
+
+
+def is_solid_archive(src_path, work_dir=default_work_dir):
+    """
+    判断 7z 压缩包是否为固实压缩(较早版本或手动创建的压缩包)
+
+    固实压缩包中的文件连续压缩在同一个数据块中，解压任意一个文件都要从块的开头解压，
+    逐个流式读取 N 个文件的总耗时随 N 的平方增长，这种压缩包应整体解压一次后再还原。
+    """
+    return _read_listing(src_path, work_dir)[0].get('Solid') == '+'
+
+
+def _read_listing(src_path, work_dir):
+    # 读取 7za l -slt 的输出，返回 (压缩包属性, {文件路径: 字节数})
+    result = subprocess.run([os.path.join(work_dir, '7za.exe'), 'l', '-slt', src_path], cwd=work_dir,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f'读取压缩包{src_path}失败：{result.stderr.decode("utf-8", "replace")}')
+    properties = {}
+    members = {}
+    entry = {}
+    started = False
+    # -slt 输出中压缩包本身的属性在 ---------- 之前，之后每个文件为一组 "键 = 值" 行，以空行分隔
+    for line in result.stdout.decode('utf-8', 'replace').splitlines() + ['']:
+        if line.startswith('----------'):
+            started = True
+        elif not line.strip():
+            if started and entry.get('Path') and entry.get('Folder') != '+':
+                members[entry['Path']] = int(entry.get('Size') or 0)
+            entry = {}
+        elif ' = ' in line:
+            key, value = line.split(' = ', 1)
+            if started:
+                entry[key.strip()] = value
+            else:
+                properties[key.strip()] = value.strip()
+    return properties, members
+
+
+def extract_backup(src_path, work_dir=default_work_dir):
+    """
+    将 7z 压缩包整体解压到同名目录，目录已存在(如继续一次中断的还原)时直接使用
+
+    :return: 解压后备份文件所在的目录
+    """
+    members = list_archive(src_path, work_dir)
+    dest_path = os.path.splitext(src_path)[0]
+    if not os.path.isdir(dest_path):
+        decompress(src_path, dest_path)
+    # 压缩的是备份目录本身，成员路径带有目录名
+    sub_dirs = {os.path.dirname(name.replace('\\', '/')) for name in members
+                if strip_codec_ext(name)[0].endswith(('.sql', '.txt'))}
+    restore_dir = os.path.join(dest_path, sub_dirs.pop()) if len(sub_dirs) == 1 else dest_path
+    return restore_dir if os.path.isdir(restore_dir) else dest_path
+
+
+def open_member(src_path, member, work_dir=default_work_dir):
+    """
+    流式读取 7z 压缩包中的一个文件，数据经 7za 的标准输出管道传递，不落盘
+
+    :param src_path: 压缩包路径
+    :param member: 压缩包内的文件路径
+    :param work_dir: 7za 所在目录
+    :return: 二进制输入流，关闭时检查 7za 的返回码
+    """
+    process = subprocess.Popen([os.path.join(work_dir, '7za.exe'), 'e', '-so', src_path, member], cwd=work_dir,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return _MemberStream(process, f'{src_path}:{member}')
+
+
+class _MemberStream(io.RawIOBase):
+    def __init__(self, process, name):
+        super().__init__()
+        self._process = process
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._process.stdout.readinto(b)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self._process.stdout.close()
+        if self._process.wait() != 0:
+            raise RuntimeError(f'解压{self.name}失败，返回码为 {self._process.returncode}')
+
+
+def list_backup_files(location):
+    """
+    列出备份目录或 7z 压缩包中的备份文件，包括逐表压缩的文件
+
+    :param location: 备份目录、.7z 压缩包、.dbbp 归档路径或对象存储中的备份 s3://桶/路径/备份名
+    :return: {文件名(压缩包中为包内路径): 字节数}，块引用文件为原始数据的字节数
+    """
+    if object_store.is_object_url(location):
+        files = object_store.list_objects(location)
+    elif os.path.isdir(location):
+        files = {f: (recipe_size if f.endswith(RECIPE_EXT) else os.path.getsize)(os.path.join(location, f))
+                 for f in os.listdir(location) if os.path.isfile(os.path.join(location, f))}
+    elif location.endswith(archive.ARCHIVE_EXT):
+        files = {name: member['size'] for name, member in archive.read_index(location).items()}
+    else:
+        files = list_archive(location)
+    return {f: size for f, size in files.items() if strip_codec_ext(f)[0].endswith(('.sql', '.txt'))}
+
+
+def open_backup_reader(location, file_name):
+    """
+    打开备份目录或 7z 压缩包中的备份文件，逐表压缩的文件在读取时即被解压
+
+    :param location: 备份目录、.7z 压缩包、.dbbp 归档路径或对象存储中的备份
+    :param file_name: list_backup_files 返回的文件名
+    :return: 二进制输入流
+    """
+    if os.path.isdir(location):
+        return open_reader(os.path.join(location, file_name))
+    if object_store.is_object_url(location):
+        # 多个分段并行下载，边下载边解压
+        return wrap_reader(object_store.open_reader(object_store.join_url(location, file_name)),
+                           strip_codec_ext(file_name)[1])
+    if location.endswith(archive.ARCHIVE_EXT):
+        # 按索引直接定位到成员所在的字节范围，只读取被选中的表
+        return wrap_reader(archive.open_member(location, file_name), strip_codec_ext(file_name)[1])
+    return wrap_reader(io.BufferedReader(open_member(location, file_name)), strip_codec_ext(file_name)[1])
+
+
+def open_backup_text(location, file_name):
+    """
+    以文本方式读取备份文件，无法解码的字节原样保留，写回时可还原
+    """
+    return io.TextIOWrapper(open_backup_reader(location, file_name), encoding='utf-8', errors='surrogateescape',
+                            newline='')
+
+
 # if __name__ == '__main__':
 #     # decompress(r"D:\NEMBackupDataBase\test.7z")
 #     # compress_and_delete(r"D:\NEMBackupDataBase\test")
@@ -93,3 +248,77 @@ def decompress(src_path, dest_path=None):
 #     print(result.returncode)
 #     print(result.stdout.decode('gbk'))
 #     print(result.stderr.decode('gbk'))
+
+
+def read_backup_manifest(location):
+    """
+    读取备份目录、7z 压缩包或 dbbp 归档中的清单文件
+
+    :param location: 备份目录、.7z 压缩包、.dbbp 归档路径或对象存储中的备份
+    :return: 清单内容，不存在时返回 None
+    """
+    if os.path.isdir(location):
+        return read_manifest(location)
+    if object_store.is_object_url(location):
+        return object_store.read_json(object_store.join_url(location, MANIFEST_NAME))
+    if location.endswith(archive.ARCHIVE_EXT):
+        names = archive.read_index(location)
+    else:
+        names = list_archive(location)
+    for name in names:
+        if os.path.basename(strip_codec_ext(name)[0].replace('\\', '/')) == MANIFEST_NAME:
+            with open_backup_reader(location, name) as f:
+                return json.load(f)
+    return None
+
+
+def archive_members(location):
+    """
+    建立备份文件名到 7z 压缩包、dbbp 归档成员名或对象名的映射
+
+    dbbp 归档中打包时压缩的成员会多出压缩扩展名，也按原文件名登记。
+
+    :return: {文件名: 成员名}
+    """
+    if object_store.is_object_url(location):
+        names = object_store.list_objects(location)
+    elif location.endswith(archive.ARCHIVE_EXT):
+        names = archive.read_index(location)
+    else:
+        names = list_archive(location)
+    members = {}
+    for name in names:
+        base_name = os.path.basename(name.replace('\\', '/'))
+        members[base_name] = name
+        plain_name, codec = strip_codec_ext(base_name)
+        if codec:
+            members.setdefault(plain_name, name)
+    return members
+
+
+def hash_backup_file(location, file_name, member=None):
+    """
+    计算备份文件的哈希，备份目录中的文件以内存映射方式读取，压缩包成员流式读取
+
+    :param location: 备份目录、.7z 压缩包、.dbbp 归档路径或对象存储中的备份
+    :param file_name: 备份文件名(备份目录中为相对路径)
+    :param member: 压缩包成员名或对象名，备份目录中为空
+    :return: (字节数, 十六进制哈希值)，与备份时写出的原文件一致
+    """
+    if member is None:
+        path = os.path.join(location, file_name)
+        if file_name.endswith(RECIPE_EXT):
+            # 块引用文件引用的块同样要读出校验，块损坏或缺失时抛出异常
+            verify_recipe(path)
+        return hash_file(path)
+    if object_store.is_object_url(location):
+        src = object_store.open_reader(object_store.join_url(location, member))
+    elif location.endswith(archive.ARCHIVE_EXT):
+        src = archive.open_member(location, member)
+        if os.path.basename(member.replace('\\', '/')) != file_name:
+            # 打包时才压缩的成员，解压后才是原文件
+            src = wrap_reader(src, strip_codec_ext(member)[1])
+    else:
+        src = io.BufferedReader(open_member(location, member))
+    with src:
+        return hash_stream(src)